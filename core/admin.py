@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Pharmacy, Medicine, PharmacyMedicine
+from .models import User, Pharmacy, Medicine, PharmacyMedicine, ScheduledJob
 
 # Custom UserAdmin to show role and approval
 class UserAdmin(BaseUserAdmin):
@@ -20,9 +20,24 @@ class PharmacyMedicineInline(admin.TabularInline):
     model = PharmacyMedicine
     extra = 1  # show 1 extra blank form
 
+    def get_queryset(self, request):
+        # Each row's label is PharmacyMedicine.__str__, which reads both FKs.
+        return super().get_queryset(request).select_related('medicine', 'pharmacy')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'medicine':
+            # Every inline row renders the same <select>; load its options
+            # once per request instead of once per row.
+            if not hasattr(request, '_medicine_choices'):
+                request._medicine_choices = list(field.choices)
+            field.choices = request._medicine_choices
+        return field
+
 @admin.register(Pharmacy)
 class PharmacyAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'phone')
+    list_select_related = ('owner',)
     search_fields = ('name', 'owner__username', 'phone')
     inlines = [PharmacyMedicineInline]
 
@@ -30,6 +45,13 @@ admin.site.register(Medicine)
 
 @admin.register(PharmacyMedicine)
 class PharmacyMedicineAdmin(admin.ModelAdmin):
-    list_display = ('medicine', 'pharmacy', 'price', 'quantity', 'expiry_date', 'updated_at')
-    list_filter = ('expiry_date',)
+    list_display = ('medicine', 'pharmacy', 'price', 'quantity', 'expiry_date', 'in_stock', 'updated_at')
+    list_select_related = ('medicine', 'pharmacy')
+    list_filter = ('in_stock', 'expiry_date')
     search_fields = ('medicine__name', 'pharmacy__name')
+
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'next_run_at', 'last_started_at', 'last_finished_at')
+    readonly_fields = ('last_started_at', 'last_finished_at', 'last_error')
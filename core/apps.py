@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from django.db.backends.signals import connection_created
+
+        from . import auth, metrics, signals  # noqa: F401
+        connection_created.connect(metrics.install)
+        # record_login saves last_login together with any re-made password hash.
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(auth.record_login, dispatch_uid='record_login')
@@ -0,0 +1,103 @@
+"""Async versions of the search and map endpoints for ASGI deployments.
+
+core.urls serves these in place of the views in core.views when
+settings.ASYNC_VIEWS is on. They parse requests and shape responses with
+the same helpers, so both sets return identical payloads; the difference
+is that a worker is not tied up while a request waits on the database.
+
+The result count and the page are awaited one after the other: Django's
+ORM runs every query of a request on the same database thread, so
+starting them together would not make them overlap. The distance search
+and the cluster index are synchronous code (grid queries and numpy) and
+run through sync_to_async.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import render
+from django.views.decorators.http import condition
+
+from . import datasets, search_cache
+from .clustering import cluster_index
+from .pagination import keyset_query, split_page
+from .exports import export_response
+from .views import (
+    LOCATION_EXPORT_FIELDS, PAYLOAD_CACHE_TIMEOUT, SEARCH_PAGE_SIZE, SearchQuery,
+    invalid_export, located_pharmacies, next_page_query, offer_json, parse_map_query,
+)
+
+
+async def _page(search):
+    if search.origin:
+        return await sync_to_async(search.nearest_page)()
+    queryset, key = keyset_query(search.results, search.cursor, search.field)
+    rows = [offer async for offer in queryset[:SEARCH_PAGE_SIZE + 1].aiterator()]
+    return split_page(rows, SEARCH_PAGE_SIZE, key)
+
+
+async def search_view(request):
+    search = SearchQuery(request)
+    results, next_cursor = await search_cache.apage(search, _page)
+    # Rendering reads request.user lazily, which must happen off the event loop.
+    return await sync_to_async(render)(request, 'search.html', {
+        'form': search.form, 'results': results, 'next_query': next_page_query(request, next_cursor),
+    })
+
+
+async def search_api(request):
+    search = SearchQuery(request)
+    if search.form.errors:
+        return JsonResponse({'errors': search.form.errors}, status=400)
+    results, next_cursor = await search_cache.apage(search, _page)
+    data = {'results': [offer_json(offer) for offer in results], 'next': next_cursor}
+    if request.GET.get('count'):
+        data['count'] = await search.results.acount()
+    return JsonResponse(data)
+
+
+async def _cached_json(key, build):
+    body = await cache.aget(key)
+    if body is None:
+        body = await build()
+        await cache.aset(key, body, PAYLOAD_CACHE_TIMEOUT)
+    return HttpResponse(body, content_type='application/json')
+
+
+@condition(etag_func=datasets.etag(datasets.PHARMACIES))
+async def pharmacy_locations_api(request):
+    export = request.GET.get('export')
+    if export:
+        return invalid_export(export) or export_response(
+            located_pharmacies().order_by('pk'), LOCATION_EXPORT_FIELDS, export, asynchronous=True,
+        )
+
+    async def build():
+        pharmacies = located_pharmacies()
+        data = [
+            {
+                'name': p.name,
+                'lat': p.latitude,
+                'lng': p.longitude,
+                'address': p.address,
+            } async for p in pharmacies.aiterator()
+        ]
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+    key = f'pharmacy-locations:{datasets.version(datasets.PHARMACIES)}'
+    return await _cached_json(key, build)
+
+
+async def pharmacy_map_api(request):
+    try:
+        west, south, east, north, zoom = parse_map_query(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'bbox=west,south,east,north and zoom are required.'}, status=400)
+
+    def query():
+        return cluster_index().query(west, south, east, north, zoom)
+
+    clusters, pharmacies = await sync_to_async(query)()
+    return JsonResponse({'zoom': zoom, 'clusters': clusters, 'pharmacies': pharmacies})
@@ -0,0 +1,114 @@
+"""The signed-in user's pharmacy, loaded at most once per request.
+
+AuthenticationMiddleware loads the user on every authenticated request.
+PharmacyOwnerBackend makes that the same query that loads their pharmacy:
+get_user() joins it in, so request.user.pharmacy costs nothing more.
+PharmacyMiddleware then exposes it lazily as request.pharmacy, which is
+None for users without one, and the login and logout signals reset it.
+Nothing is kept between requests, so there is no copy of the pharmacy or
+role to go stale.
+
+Logging in costs one password hash and one write to the user row. When
+authenticate() finds a hash made with outdated settings, it re-hashes the
+password in memory only. record_login then saves the new hash together
+with last_login, replacing Django's update_last_login.
+"""
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+
+class PharmacyOwnerBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = self.get_user_queryset().get(**{UserModel.USERNAME_FIELD: username})
+        except UserModel.DoesNotExist:
+            # Hash anyway, so unknown usernames take as long as wrong passwords.
+            UserModel().set_password(password)
+            return None
+
+        def rehash(raw_password):
+            user.set_password(raw_password)
+            user._rehashed = True
+
+        if check_password(password, user.password, rehash) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        try:
+            user = self.get_user_queryset().get(pk=user_id)
+        except ObjectDoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    def get_user_queryset(self):
+        from .models import User
+        return User._default_manager.select_related('pharmacy')
+
+
+def get_pharmacy(request):
+    """Return the Pharmacy owned by request.user, or None."""
+    if not hasattr(request, '_cached_pharmacy'):
+        user = request.user
+        pharmacy = None
+        if user.is_authenticated:
+            try:
+                pharmacy = user.pharmacy
+            except ObjectDoesNotExist:
+                pass
+        request._cached_pharmacy = pharmacy
+    return request._cached_pharmacy
+
+
+# Backends that signed sessions in before PharmacyOwnerBackend replaced them.
+LEGACY_BACKENDS = {'django.contrib.auth.backends.ModelBackend'}
+
+
+def adopt_legacy_session(request):
+    """Point a session signed in by a retired backend at the current one.
+
+    django.contrib.auth logs out sessions whose backend is no longer
+    configured. Must run before request.user is first resolved.
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and session.get(BACKEND_SESSION_KEY) in LEGACY_BACKENDS:
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+
+
+def attach_pharmacy(request):
+    """(Re)set request.pharmacy to resolve from request.user on first use."""
+    request.__dict__.pop('_cached_pharmacy', None)
+    request.pharmacy = SimpleLazyObject(lambda: get_pharmacy(request))
+
+
+def pharmacy_or_404(request):
+    pharmacy = get_pharmacy(request)
+    if pharmacy is None:
+        raise Http404("No pharmacy is registered to this account.")
+    return pharmacy
+
+
+def record_login(sender, request, user, **kwargs):
+    """user_logged_in receiver: save last_login, and a re-made hash, in one UPDATE.
+
+    A view that already saved last_login sets user._login_recorded.
+    """
+    if getattr(user, '_login_recorded', False):
+        return
+    user.last_login = timezone.now()
+    fields = ['last_login']
+    if getattr(user, '_rehashed', False):
+        fields.append('password')
+        user._rehashed = False
+    user.save(update_fields=fields)
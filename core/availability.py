@@ -0,0 +1,94 @@
+"""Nearest pharmacies that have a medicine in stock.
+
+Candidates come from Offer, one SQL query per search box: the medicine,
+stock and quantity conditions plus a latitude/longitude range, served by
+offer_stock_location_idx. Exact distances are computed with numpy over
+those rows only. The box starts at INITIAL_RADIUS_KM and grows fourfold
+until the k-th result is provably better than anything outside it, so at
+most a handful of small index range scans run however large the table.
+
+Results are ranked on a score of distance plus `price_weight` times the
+price: with price_weight=0.1, a price 10 lower is worth travelling 1 km
+further. The score is never below the distance, which is what lets the
+search stop once the k-th score fits inside the box.
+"""
+import math
+
+import numpy as np
+
+from .distance import DistanceIndex
+from .geo import KM_PER_DEGREE
+
+INITIAL_RADIUS_KM = 2.0
+# Wide enough to cover the whole country from any point in it.
+MAX_RADIUS_KM = 1500.0
+
+FIELDS = (
+    'stock_id', 'pharmacy_id', 'pharmacy_name', 'medicine_id', 'medicine_name',
+    'latitude', 'longitude', 'price', 'quantity', 'expiry_date',
+)
+
+
+def bounding_box(lat, lng, radius_km):
+    """Lookups for a lat/lng box containing every point within radius_km."""
+    dlat = radius_km / KM_PER_DEGREE
+    # East-west degrees are shortest on the box's poleward edge.
+    edge_lat = min(abs(lat) + dlat, 89.999)
+    dlng = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(edge_lat))), 180.0)
+    return {
+        'latitude__range': (lat - dlat, lat + dlat),
+        'longitude__range': (lng - dlng, lng + dlng),
+    }
+
+
+def rank(rows, lat, lng, radius_km=None, price_weight=0.0):
+    """Score `rows` (tuples of FIELDS) and keep each pharmacy's best one.
+
+    Returns (rows, distances, scores), best score first, ties on stock id.
+    """
+    if not rows:
+        return [], np.empty(0), np.empty(0)
+    stock_ids, pharmacy_ids, _, _, _, lats, lngs, prices = (np.asarray(column) for column in list(zip(*rows))[:8])
+    distances = DistanceIndex(stock_ids, lats.astype(float), lngs.astype(float)).distances(lat, lng)
+    scores = distances + price_weight * prices.astype(float)
+    candidates = np.arange(len(rows))
+    if radius_km is not None:
+        candidates = candidates[distances <= radius_km]
+    candidates = candidates[np.lexsort((stock_ids[candidates], scores[candidates]))]
+    # np.unique reports each pharmacy's first, so best, position.
+    _, first = np.unique(pharmacy_ids[candidates], return_index=True)
+    candidates = candidates[np.sort(first)]
+    return [rows[i] for i in candidates.tolist()], distances[candidates], scores[candidates]
+
+
+def nearest_with_stock(offers, lat, lng, k=10, min_quantity=1, radius_km=None, price_weight=0.0):
+    """Return up to `k` dicts, one per pharmacy, for the best offers in `offers`.
+
+    `offers` is an Offer queryset narrowed to the wanted medicines. Only
+    in-stock offers with at least `min_quantity` units are considered.
+    """
+    offers = offers.filter(in_stock=True, quantity__gte=min_quantity)
+    limit = min(radius_km, MAX_RADIUS_KM) if radius_km is not None else MAX_RADIUS_KM
+    radius = min(INITIAL_RADIUS_KM, limit)
+    rows, previous = [], None
+    while True:
+        box = bounding_box(lat, lng, radius)
+        batch = offers.filter(**box)
+        if previous is not None:
+            batch = batch.exclude(**previous)
+        rows.extend(batch.values_list(*FIELDS))
+        ranked, distances, scores = rank(rows, lat, lng, radius_km, price_weight)
+        if len(ranked) >= k and scores[k - 1] <= radius or radius >= limit:
+            break
+        previous = box
+        radius = min(radius * 4, limit)
+
+    return [
+        {
+            **dict(zip(FIELDS, row)),
+            'price': str(row[FIELDS.index('price')]),
+            'distance': distance,
+            'score': score,
+        }
+        for row, distance, score in zip(ranked[:k], distances[:k].tolist(), scores[:k].tolist())
+    ]
@@ -0,0 +1,104 @@
+"""Pharmacies that can fill a whole basket of medicines.
+
+Every pharmacy is scored by one grouped query over Offer: grouped by
+pharmacy, with the cheapest in-stock price of each basket item as a
+filtered Min. A NULL means the pharmacy lacks that item. Coverage, total
+price and distance are then ranked in Python over one row per pharmacy,
+instead of running one search per item and joining the results by hand.
+"""
+import heapq
+import math
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Min, Q
+
+from .availability import bounding_box
+from .catalog import normalize_name
+from .distance import DistanceIndex
+from .suggest import normalize
+from .text_search import medicine_search
+
+MAX_ITEMS = 10
+# Medicines an item that is not an exact catalog name may stand for.
+MATCHES_PER_ITEM = 20
+CENT = Decimal('0.01')
+
+
+def resolve_items(items):
+    """Map each item to the ids of the medicines that can fill it.
+
+    An exact catalog name means that medicine only; anything else means
+    the best text search matches. Unknown items map to [].
+    """
+    from .models import Medicine
+    keys = {item: normalize_name(item) for item in items}
+    exact = dict(
+        Medicine.objects.filter(normalized_name__in=set(keys.values())).values_list('normalized_name', 'pk')
+    )
+    return {
+        item: [exact[key]] if key in exact else medicine_search().ranked(normalize(item), MATCHES_PER_ITEM)
+        for item, key in keys.items()
+    }
+
+
+def rank_pharmacies(items, lat=None, lng=None, radius_km=None, sort_by='price', k=10):
+    """Return up to `k` pharmacies holding any of `items`, best first.
+
+    Pharmacies covering more items come first, then the lower total price
+    and distance; sort_by='distance' puts distance before price. Distances
+    are only computed, and `radius_km` only applies, given lat and lng.
+    """
+    from .models import Offer
+    medicines = resolve_items(items)
+    known = [item for item in items if medicines[item]]
+    if not known:
+        return []
+
+    offers = Offer.objects.filter(
+        in_stock=True, medicine_id__in={pk for item in known for pk in medicines[item]},
+    )
+    located = lat is not None and lng is not None
+    if located and radius_km is not None:
+        offers = offers.filter(**bounding_box(lat, lng, radius_km))
+    rows = list(
+        offers.order_by().values_list('pharmacy_id', 'pharmacy_name', 'latitude', 'longitude')
+        .annotate(**{
+            f'item{i}': Min('price', filter=Q(medicine_id__in=medicines[item]))
+            for i, item in enumerate(known)
+        })
+    )
+
+    distances = np.full(len(rows), math.inf)
+    if located and rows:
+        ids, _, lats, lngs = zip(*(row[:4] for row in rows))
+        found = DistanceIndex(ids, np.array(lats, dtype=float), np.array(lngs, dtype=float)).distances(lat, lng)
+        distances = np.where(np.isnan(found), math.inf, found)
+
+    results = []
+    for row, distance in zip(rows, distances.tolist()):
+        if radius_km is not None and located and distance > radius_km:
+            continue
+        prices = {item: price for item, price in zip(known, row[4:]) if price is not None}
+        results.append({
+            'pharmacy_id': row[0],
+            'pharmacy_name': row[1],
+            'latitude': row[2],
+            'longitude': row[3],
+            'distance': distance if located and distance != math.inf else None,
+            'covered': len(prices),
+            'missing': [item for item in items if item not in prices],
+            'total_price': sum(prices.values(), Decimal(0)),
+            'prices': prices,
+        })
+
+    def key(result):
+        distance = result['distance'] if result['distance'] is not None else math.inf
+        order = (distance, result['total_price']) if sort_by == 'distance' else (result['total_price'], distance)
+        return (-result['covered'], *order, result['pharmacy_id'])
+
+    best = heapq.nsmallest(k, results, key=key)
+    for result in best:
+        result['total_price'] = str(result['total_price'].quantize(CENT))
+        result['prices'] = {item: str(price.quantize(CENT)) for item, price in result['prices'].items()}
+    return best
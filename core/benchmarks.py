@@ -0,0 +1,137 @@
+"""Repeatable latency benchmarks for the request hot paths.
+
+Each scenario issues requests through the Django test client against a
+dataset made by core.synthetic and records wall time and SQL query count
+per request. Results are summarised as percentiles so runs can be diffed.
+"""
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Pharmacy, Medicine
+from .synthetic import NEPAL_BBOX
+
+BASKET_SIZE = 10
+
+
+def summarize(latencies, queries=None):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(50) * 1000, 3),
+        'p90_ms': round(percentile(90) * 1000, 3),
+        'p99_ms': round(percentile(99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+    if queries:
+        summary['queries_mean'] = round(statistics.fmean(queries), 2)
+        summary['queries_max'] = max(queries)
+    return summary
+
+
+def measure(make_request, requests):
+    """Call make_request(i) `requests` times; return the summary."""
+    latencies, queries = [], []
+    for i in range(requests):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = make_request(i)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Request failed with {response.status_code}: {response.content[:200]!r}")
+        queries.append(len(captured))
+    return summarize(latencies, queries)
+
+
+class Scenarios:
+    """Request factories for each benchmarked endpoint over the current data."""
+
+    def __init__(self, seed=1):
+        self.rng = random.Random(seed)
+        self.client = Client()
+        names = list(Medicine.objects.values_list('name', flat=True)[:500])
+        self.names = names
+        self.queries = [name[:4] for name in names] or ['para']
+        south, west, north, east = NEPAL_BBOX
+        self.points = [
+            (self.rng.uniform(south, north), self.rng.uniform(west, east)) for _ in range(100)
+        ]
+        pharmacy = Pharmacy.objects.select_related('owner').order_by('pk').first()
+        self.owner_client = Client()
+        if pharmacy:
+            self.owner_client.force_login(pharmacy.owner)
+
+    def search_price(self, i):
+        return self.client.get(reverse('search'), {
+            'query': self.queries[i % len(self.queries)], 'sort_by': 'price',
+        })
+
+    def search_distance(self, i):
+        lat, lng = self.points[i % len(self.points)]
+        return self.client.get(reverse('search'), {
+            'query': self.queries[i % len(self.queries)], 'sort_by': 'distance', 'lat': lat, 'lng': lng,
+        })
+
+    def basket_items(self):
+        return self.rng.sample(self.names, min(BASKET_SIZE, len(self.names)))
+
+    def basket(self, i):
+        lat, lng = self.points[i % len(self.points)]
+        return self.client.get(reverse('basket_api'), {'item': self.basket_items(), 'lat': lat, 'lng': lng})
+
+    def basket_by_search(self, i):
+        """The same basket as one price-sorted search per item, for comparison."""
+        for name in self.basket_items():
+            response = self.client.get(reverse('search_api'), {'query': name, 'sort_by': 'price'})
+        return response
+
+    def pharmacy_list_api(self, i):
+        return self.client.get(reverse('pharmacy_list_api'))
+
+    def pharmacy_locations_api(self, i):
+        return self.client.get(reverse('pharmacy_locations_api'))
+
+    def inv(self, i):
+        return self.owner_client.get(reverse('inv'))
+
+    def add_medicine(self, i):
+        return self.owner_client.post(reverse('add_medicine'), {
+            'medicine_name': f"Benchmark Medicine {self.rng.randrange(10 ** 9)}",
+            'generic_name': 'Benchmarkol',
+            'price': '12.50',
+            'quantity': 10,
+        })
+
+    def all(self):
+        return {
+            'search_price': self.search_price,
+            'search_distance': self.search_distance,
+            'basket': self.basket,
+            'basket_by_search': self.basket_by_search,
+            'pharmacy_list_api': self.pharmacy_list_api,
+            'pharmacy_locations_api': self.pharmacy_locations_api,
+            'inv': self.inv,
+            'add_medicine': self.add_medicine,
+        }
+
+
+def run(requests=50, only=None, seed=1):
+    """Benchmark every scenario (or those named in `only`) on the current data."""
+    cache.clear()
+    scenarios = Scenarios(seed).all()
+    return {
+        name: measure(make_request, requests)
+        for name, make_request in scenarios.items()
+        if not only or name in only
+    }
@@ -0,0 +1,207 @@
+"""The canonical medicine catalog.
+
+Medicine names are matched on a normalized key: case-folded, whitespace
+collapsed and dosages written one way ("500 MG" and "500mg" are the same
+medicine). Medicine.normalized_name holds the key under a unique
+constraint, so concurrent adds cannot create duplicates.
+
+resolve() maps one name to its Medicine through a per-process LRU cache,
+which Medicine signals clear entry by entry and which empties itself when
+another process changes the medicines dataset. Resolver does the same for
+bulk writers a batch of names at a time.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+
+from . import datasets
+from .suggest import normalize
+
+UNITS = {
+    'mg': 'mg', 'mcg': 'mcg', 'μg': 'mcg', 'ug': 'mcg', 'g': 'g', 'gm': 'g',
+    'ml': 'ml', 'iu': 'iu', '%': '%',
+}
+# Longest units first so "mcg" is not read as "m" + "cg", or "gm" as "g".
+DOSAGE = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(%s)(?![a-z])' % '|'.join(sorted(map(re.escape, UNITS), key=len, reverse=True))
+)
+
+NAME_CACHE_SIZE = 2048
+
+
+def normalize_name(name):
+    """Return the catalog key of a medicine name."""
+    return DOSAGE.sub(lambda m: m.group(1) + UNITS[m.group(2)], normalize(name or ''))
+
+
+def display_name(name):
+    """The name as stored for a new medicine: as typed, whitespace collapsed."""
+    return ' '.join(name.split())
+
+
+class NameCache:
+    """Thread-safe LRU map of catalog key -> Medicine field values."""
+
+    def __init__(self, maxsize=NAME_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        current = datasets.version(datasets.MEDICINES)
+        with self._lock:
+            if self._version != current:
+                self._entries.clear()
+                self._version = current
+            values = self._entries.get(key)
+            if values is not None:
+                self._entries.move_to_end(key)
+            return values
+
+    def put(self, key, values, version):
+        """Store `values`, read from the database at dataset `version`."""
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = values
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+names = NameCache()
+
+
+def _fields():
+    from .models import Medicine
+    return [field.attname for field in Medicine._meta.concrete_fields]
+
+
+def resolve(name, generic_name=None):
+    """Return the Medicine for `name`, creating it if needed.
+
+    generic_name, when given, replaces the stored one only if it differs.
+    """
+    from .models import Medicine
+    key = normalize_name(name)
+    values = names.get(key)
+    if values is None:
+        version = datasets.version(datasets.MEDICINES)
+        lookup = Medicine.objects.filter(normalized_name=key).values_list(*_fields())
+        values = lookup.first()
+        if values is None:
+            try:
+                with transaction.atomic():
+                    Medicine.objects.create(name=display_name(name), generic_name=generic_name or None)
+            except IntegrityError:
+                pass  # created by a concurrent request
+            version = datasets.version(datasets.MEDICINES)
+            values = lookup.get()
+        names.put(key, values, version)
+    medicine = Medicine.from_db(DEFAULT_DB_ALIAS, _fields(), values)
+    if generic_name and generic_name != medicine.generic_name:
+        medicine.generic_name = generic_name
+        medicine.save(update_fields=['generic_name'])
+    return medicine
+
+
+class Resolver:
+    """Catalog key -> (id, name, generic_name) map for bulk writers, filled a batch at a time."""
+
+    def __init__(self):
+        self.known = {}
+        self.created = 0
+
+    def id(self, name):
+        return self.known[normalize_name(name)][0]
+
+    def _load(self, keys):
+        from .models import Medicine
+        for pk, key, name, generic_name in (
+            Medicine.objects.filter(normalized_name__in=keys)
+            .values_list('pk', 'normalized_name', 'name', 'generic_name')
+        ):
+            self.known[key] = (pk, name, generic_name)
+
+    def resolve(self, wanted):
+        """`wanted` maps names to the generic name from the file (or None).
+
+        Returns True when medicines were created or changed.
+        """
+        from . import offers
+        from .models import Medicine
+        by_key = {normalize_name(name): (name, generic_name) for name, generic_name in wanted.items()}
+        missing = [key for key in by_key if key not in self.known]
+        if missing:
+            self._load(missing)
+
+        new = [
+            Medicine(name=display_name(name), generic_name=generic_name)
+            for key, (name, generic_name) in by_key.items() if key not in self.known
+        ]
+        if new:
+            # Conflicts are medicines another writer added since the lookup.
+            Medicine.objects.bulk_create(new, ignore_conflicts=True)
+            self._load([medicine.normalized_name for medicine in new])
+            self.created += len(new)
+
+        changed = []
+        for key, (_, generic_name) in by_key.items():
+            pk, name, current = self.known[key]
+            if generic_name and generic_name != current:
+                changed.append(Medicine(pk=pk, name=name, generic_name=generic_name))
+                self.known[key] = (pk, name, generic_name)
+        if changed:
+            Medicine.objects.bulk_update(changed, ['generic_name'])
+            for medicine in changed:
+                offers.sync_medicine(medicine)
+        return bool(new or changed)
+
+
+def merge_duplicates(Medicine, PharmacyMedicine, Offer):
+    """Fill normalized_name and merge medicines that share a key.
+
+    The lowest id survives, taking the first generic name found. A pharmacy
+    stocking several of the merged medicines keeps its most recently updated
+    row. Takes the model classes so migrations can pass historical ones.
+    Returns the number of medicines merged away.
+    """
+    groups = {}
+    for pk, name, generic_name in Medicine.objects.order_by('pk').values_list('pk', 'name', 'generic_name'):
+        groups.setdefault(normalize_name(name), []).append((pk, name, generic_name))
+
+    keepers, merged = [], 0
+    for key, members in groups.items():
+        (pk, name, generic_name), duplicates = members[0], members[1:]
+        generic_name = generic_name or next((g for _, _, g in duplicates if g), None)
+        keepers.append(Medicine(pk=pk, normalized_name=key, generic_name=generic_name))
+        if not duplicates:
+            continue
+        duplicate_ids = [member[0] for member in duplicates]
+        keep, drop, pharmacies = [], [], set()
+        for stock_pk, pharmacy_id in (
+            PharmacyMedicine.objects.filter(medicine_id__in=[pk, *duplicate_ids])
+            .order_by('pharmacy_id', '-updated_at', '-pk').values_list('pk', 'pharmacy_id')
+        ):
+            (drop if pharmacy_id in pharmacies else keep).append(stock_pk)
+            pharmacies.add(pharmacy_id)
+        PharmacyMedicine.objects.filter(pk__in=drop).delete()
+        PharmacyMedicine.objects.filter(pk__in=keep).update(medicine_id=pk)
+        Offer.objects.filter(stock_id__in=keep).update(medicine_id=pk, medicine_name=name, generic_name=generic_name)
+        Medicine.objects.filter(pk__in=duplicate_ids).delete()
+        merged += len(duplicates)
+
+    Medicine.objects.bulk_update(keepers, ['normalized_name', 'generic_name'], batch_size=1000)
+    return merged
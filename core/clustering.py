@@ -0,0 +1,118 @@
+"""Zoom-aware pharmacy clustering for the map.
+
+Pharmacies are projected to Web Mercator and, for every zoom level up to
+MAX_CLUSTER_ZOOM, bucketed into square cells about CLUSTER_RADIUS_PX screen
+pixels wide. Each level keeps the cell keys sorted with their member count
+and centroid, so a viewport query is a couple of vectorized comparisons
+over the non-empty cells instead of a pass over every pharmacy.
+"""
+import math
+
+import numpy as np
+
+from . import datasets
+from .datasets import VersionedValue
+
+TILE_SIZE = 256
+CLUSTER_RADIUS_PX = 60
+MAX_CLUSTER_ZOOM = 16
+MAX_LATITUDE = 85.05112878
+
+
+def project(lat, lng):
+    """Web Mercator position in the unit square, y growing southwards."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lng, dtype=np.float64) + 180) / 360
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return np.clip(x, 0, 1), np.clip(y, 0, 1)
+
+
+def cells_per_side(zoom):
+    return int(math.ceil(TILE_SIZE * 2 ** zoom / CLUSTER_RADIUS_PX))
+
+
+class ClusterLevel:
+    def __init__(self, zoom, x, y, lat, lng):
+        self.side = side = cells_per_side(zoom)
+        cx = np.minimum((x * side).astype(np.int64), side - 1)
+        cy = np.minimum((y * side).astype(np.int64), side - 1)
+        keys, first, inverse, counts = np.unique(
+            cx * side + cy, return_index=True, return_inverse=True, return_counts=True,
+        )
+        self.cx, self.cy = keys // side, keys % side
+        self.counts = counts
+        self.first = first
+        self.lat = np.bincount(inverse, weights=lat) / counts
+        self.lng = np.bincount(inverse, weights=lng) / counts
+
+
+class ClusterIndex:
+    def __init__(self, pharmacies):
+        """`pharmacies` is a list of (name, address, phone, latitude, longitude) tuples."""
+        self.pharmacies = pharmacies
+        self.lat = np.array([p[3] for p in pharmacies], dtype=np.float64)
+        self.lng = np.array([p[4] for p in pharmacies], dtype=np.float64)
+        self.x, self.y = project(self.lat, self.lng)
+        self.levels = [
+            ClusterLevel(zoom, self.x, self.y, self.lat, self.lng)
+            for zoom in range(MAX_CLUSTER_ZOOM + 1)
+        ] if pharmacies else []
+
+    def _pharmacy(self, position):
+        name, address, phone, latitude, longitude = self.pharmacies[position]
+        return {
+            'name': name, 'address': address, 'phone': phone,
+            'latitude': latitude, 'longitude': longitude,
+        }
+
+    def query(self, west, south, east, north, zoom):
+        """Return (clusters, pharmacies) visible in the bbox at `zoom`.
+
+        Cells holding a single pharmacy are returned as that pharmacy, and
+        past MAX_CLUSTER_ZOOM every pharmacy is returned individually.
+        """
+        if not self.pharmacies:
+            return [], []
+        (x0, x1), (y1, y0) = project([south, north], [west, east])
+        if zoom > MAX_CLUSTER_ZOOM:
+            inside = (self.x >= x0) & (self.x <= x1) & (self.y >= y0) & (self.y <= y1)
+            return [], [self._pharmacy(i) for i in np.flatnonzero(inside).tolist()]
+
+        level = self.levels[max(zoom, 0)]
+        side = level.side
+        inside = (
+            (level.cx >= int(x0 * side)) & (level.cx <= int(x1 * side)) &
+            (level.cy >= int(y0 * side)) & (level.cy <= int(y1 * side))
+        )
+        clusters, pharmacies = [], []
+        for i in np.flatnonzero(inside).tolist():
+            count = int(level.counts[i])
+            if count == 1:
+                pharmacies.append(self._pharmacy(int(level.first[i])))
+            else:
+                clusters.append({'lat': float(level.lat[i]), 'lng': float(level.lng[i]), 'count': count})
+        return clusters, pharmacies
+
+
+def _build_cluster_index():
+    from .models import Pharmacy
+    pharmacies = list(
+        Pharmacy.objects
+        .filter(owner__is_approved=True, latitude__isnull=False, longitude__isnull=False)
+        .order_by('pk')
+        .values_list('name', 'address', 'phone', 'latitude', 'longitude')
+    )
+    return ClusterIndex(pharmacies)
+
+
+_index = VersionedValue(datasets.PHARMACIES, _build_cluster_index)
+
+
+def cluster_index():
+    """Process-wide ClusterIndex of approved, located pharmacies."""
+    return _index.get()
+
+
+def invalidate():
+    _index.invalidate()
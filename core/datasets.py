@@ -0,0 +1,94 @@
+"""Version counters for datasets that are cached outside the database.
+
+Each dataset ("pharmacies", "medicines", ...) has a counter in the Django
+cache that signals bump on every write. Anything derived from the data,
+such as serialized API payloads, ETags or in-process indexes, is keyed by
+or checked against that counter, so every worker sharing the cache sees
+the change.
+
+Only workers that share the cache share the counters. The default
+CACHE_BACKEND, locmem, is private to each process: under several worker
+processes a write is seen by its own worker only, and the others keep
+serving stale payloads until their entries expire. Run more than one
+worker only with CACHE_BACKEND=file or redis.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+PHARMACIES = 'pharmacies'
+MEDICINES = 'medicines'
+
+
+def _key(name):
+    return f'dataset-version:{name}'
+
+
+def version(name):
+    value = cache.get(_key(name))
+    if value is None:
+        # Seed from the clock so a counter lost to eviction or a restart can
+        # never come back with a value that was already handed out.
+        cache.add(_key(name), time.time_ns(), timeout=None)
+        value = cache.get(_key(name))
+    return value
+
+
+def bump(name):
+    try:
+        return cache.incr(_key(name))
+    except ValueError:
+        version(name)
+        return cache.incr(_key(name))
+
+
+def versions(names):
+    """Return {name: version} for many datasets in one cache round trip."""
+    keys = {_key(name): name for name in names}
+    found = cache.get_many(keys)
+    result = {keys[key]: value for key, value in found.items()}
+    for name in set(keys.values()) - result.keys():
+        result[name] = version(name)
+    return result
+
+
+def reset(names):
+    """Invalidate many datasets at once.
+
+    Dropping the counters is enough: they are re-seeded from the clock on
+    the next read, so nothing cached against an old value matches again.
+    """
+    cache.delete_many([_key(name) for name in names])
+
+
+def etag(name):
+    """Return an etag_func for django.views.decorators.http.condition."""
+    def etag_func(request, *args, **kwargs):
+        return f'{name}-{version(name)}'
+    return etag_func
+
+
+class VersionedValue:
+    """Process-local value rebuilt when its dataset version changes."""
+
+    def __init__(self, dataset, build):
+        self.dataset = dataset
+        self.build = build
+        self._value = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        current = version(self.dataset)
+        value = self._value
+        if value is None or self._version != current:
+            with self._lock:
+                if self._value is None or self._version != current:
+                    self._value = self.build()
+                    self._version = current
+                value = self._value
+        return value
+
+    def invalidate(self):
+        self._value = None
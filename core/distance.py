@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM
+
+
+class DistanceIndex:
+    """Coordinates held in contiguous float64 arrays for batched haversine.
+
+    Latitudes and longitudes are stored in radians together with the cosine
+    of each latitude, so ranking a whole set of points from one origin is a
+    single vectorized pass.
+    """
+
+    def __init__(self, ids, latitudes, longitudes):
+        self.ids = np.asarray(ids)
+        self.lat = np.radians(np.ascontiguousarray(latitudes, dtype=np.float64))
+        self.lng = np.radians(np.ascontiguousarray(longitudes, dtype=np.float64))
+        self.cos_lat = np.cos(self.lat)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, lat, lng):
+        """Great-circle distance in km from (lat, lng) to every point."""
+        lat0, lng0 = math.radians(lat), math.radians(lng)
+        a = np.sin((self.lat - lat0) / 2) ** 2 + \
+            math.cos(lat0) * self.cos_lat * np.sin((self.lng - lng0) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def nearest(self, lat, lng, k, radius_km=None, after=None):
+        """Return (positions, distances) of the k closest points, closest first.
+
+        Ties are broken on id so results are stable between calls. `after`
+        is a (distance, id) pair; only points ordered after it are returned,
+        which is how distance-sorted pages continue from a cursor.
+        """
+        dist = self.distances(lat, lng)
+        mask = np.ones(len(dist), dtype=bool)
+        if radius_km is not None:
+            mask &= dist <= radius_km
+        if after is not None:
+            after_dist, after_id = after
+            mask &= (dist > after_dist) | ((dist == after_dist) & (self.ids > after_id))
+        candidates = np.flatnonzero(mask)
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(dist[candidates], k - 1)[:k]]
+        order = np.lexsort((self.ids[candidates], dist[candidates]))
+        candidates = candidates[order]
+        return candidates, dist[candidates]
+
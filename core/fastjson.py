@@ -0,0 +1,27 @@
+"""JSON encoding for hot read paths: orjson when it is installed, else the stdlib.
+
+Both produce compact UTF-8 bytes, the same shape DRF's JSONRenderer writes,
+and encode Decimals as strings and dates in ISO format.
+"""
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Return `value` encoded as JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
@@ -1,6 +1,10 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.forms import AuthenticationForm
+from . import catalog
+from .basket import MAX_ITEMS
+from .catalog import normalize_name
+from .importers import MAX_QUANTITY, format_for
 from .models import User, PharmacyMedicine, Medicine, Pharmacy
 
 
@@ -36,6 +40,69 @@ class SearchForm(forms.Form):
         required=False,
         widget=forms.Select()
     )
+    radius = forms.FloatField(
+        label="Within (km)",
+        required=False,
+        min_value=0,
+        widget=forms.NumberInput(attrs={'placeholder': 'Any distance'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # The radius limits distance-sorted searches only, which need the
+        # searcher's lat and lng.
+        located = self.data.get('lat') and self.data.get('lng')
+        if cleaned_data.get('radius') is not None and (cleaned_data.get('sort_by') != 'distance' or not located):
+            self.add_error('radius', "A radius needs sorting by distance from your location.")
+        return cleaned_data
+
+# Primary keys are BigAutoFields.
+MAX_ID = 2 ** 63 - 1
+
+
+class NearestStockForm(forms.Form):
+    medicine = forms.IntegerField(required=False, min_value=1, max_value=MAX_ID)
+    query = forms.CharField(required=False)
+    lat = forms.FloatField(min_value=-90, max_value=90)
+    lng = forms.FloatField(min_value=-180, max_value=180)
+    k = forms.IntegerField(required=False, min_value=1, max_value=50)
+    min_quantity = forms.IntegerField(required=False, min_value=1, max_value=MAX_QUANTITY)
+    radius = forms.FloatField(required=False, min_value=0)
+    price_weight = forms.FloatField(required=False, min_value=0)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('medicine') and not (cleaned_data.get('query') or '').strip():
+            raise forms.ValidationError("Give a medicine id or a query.")
+        return cleaned_data
+
+class ItemListField(forms.Field):
+    """A repeated query parameter, as a list of distinct non-blank values."""
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        items = (' '.join(item.split()) for item in value or [])
+        return list(dict.fromkeys(item for item in items if item))
+
+class BasketForm(forms.Form):
+    item = ItemListField()
+    lat = forms.FloatField(required=False, min_value=-90, max_value=90)
+    lng = forms.FloatField(required=False, min_value=-180, max_value=180)
+    radius = forms.FloatField(required=False, min_value=0)
+    sort_by = forms.ChoiceField(choices=SORT_CHOICES, required=False)
+    k = forms.IntegerField(required=False, min_value=1, max_value=50)
+
+    def clean_item(self):
+        items = self.cleaned_data['item']
+        if len(items) > MAX_ITEMS:
+            raise forms.ValidationError(f"A basket holds at most {MAX_ITEMS} medicines.")
+        return items
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('lat') is None) != (cleaned_data.get('lng') is None):
+            raise forms.ValidationError("Give both lat and lng, or neither.")
+        return cleaned_data
 
 class PharmacyMedicineForm(forms.ModelForm):
     medicine_name = forms.CharField(
@@ -71,21 +138,21 @@ class PharmacyMedicineForm(forms.ModelForm):
             }),
         }
 
-    def save(self, commit=True):
-        medicine_name = self.cleaned_data.get('medicine_name')
-        generic_name = self.cleaned_data.get('generic_name')
+    def clean_medicine_name(self):
+        medicine_name = self.cleaned_data['medicine_name']
+        # Editing a row onto a medicine the pharmacy already stocks would
+        # break the one-row-per-medicine rule.
+        if self.instance.pk and PharmacyMedicine.objects.filter(
+            pharmacy_id=self.instance.pharmacy_id, medicine__normalized_name=normalize_name(medicine_name),
+        ).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError("This medicine is already in your inventory.")
+        return medicine_name
 
-        # Create or get Medicine
-        medicine, created = Medicine.objects.get_or_create(
-            name=medicine_name,
-            defaults={'generic_name': generic_name}
+    def save(self, commit=True):
+        medicine = catalog.resolve(
+            self.cleaned_data.get('medicine_name'), self.cleaned_data.get('generic_name'),
         )
 
-        # Update generic name if already exists
-        if not created and generic_name:
-            medicine.generic_name = generic_name
-            medicine.save()
-
         # Link medicine to PharmacyMedicine
         instance = super().save(commit=False)
         instance.medicine = medicine
@@ -109,6 +176,25 @@ class MedicineForm(forms.ModelForm):
             }),
         }
 
+class InventoryImportForm(forms.Form):
+    file = forms.FileField(
+        label="Inventory file",
+        help_text="CSV, JSON Lines or JSON with medicine_name, generic_name, price, quantity, expiry_date.",
+        widget=forms.ClearableFileInput(attrs={
+            "accept": ".csv,.jsonl,.ndjson,.json",
+            "class": "w-full p-3 rounded-md border border-blue-300 focus:outline-none focus:ring-2 focus:ring-blue-500"
+        })
+    )
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        try:
+            self.format = format_for(upload.name)
+        except ValueError as exc:
+            raise forms.ValidationError(str(exc))
+        return upload
+
+
 class PharmacyLocationForm(forms.ModelForm):
     class Meta:
         model = Pharmacy
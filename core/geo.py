@@ -0,0 +1,131 @@
+import math
+
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360
+
+# Pharmacies are bucketed into a fixed lat/lng grid. 0.1 degree is roughly
+# 11 km north-south, which keeps a city inside a handful of cells.
+GRID_CELL_DEG = 0.1
+GRID_ROWS = int(round(180 / GRID_CELL_DEG))
+GRID_COLS = int(round(360 / GRID_CELL_DEG))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * \
+        math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * R * math.asin(math.sqrt(a))
+
+
+def grid_cell(lat, lng):
+    """Return the (row, col) grid cell for a coordinate, or (None, None)."""
+    if lat is None or lng is None:
+        return None, None
+    row = int((lat + 90) // GRID_CELL_DEG)
+    col = int((lng + 180) // GRID_CELL_DEG)
+    return min(max(row, 0), GRID_ROWS - 1), min(max(col, 0), GRID_COLS - 1)
+
+
+def _square(row, col, rings):
+    return {
+        'grid_row__range': (max(row - rings, 0), min(row + rings, GRID_ROWS - 1)),
+        'grid_col__range': (max(col - rings, 0), min(col + rings, GRID_COLS - 1)),
+    }
+
+
+def _covered_km(lat, rings):
+    """Distance from the origin that is guaranteed to be inside the square.
+
+    The square extends `rings` whole cells past the origin's own cell in
+    every direction. East-west cells shrink with latitude, so use the
+    narrowest row the square can reach.
+    """
+    if rings <= 0:
+        return 0.0
+    widest_lat = min(abs(lat) + (rings + 1) * GRID_CELL_DEG, 90)
+    return rings * GRID_CELL_DEG * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+
+def _closer_rings(lat, lng, row, col, distance_km):
+    """Largest ring count whose whole square lies closer than `distance_km`, or -1.
+
+    The farthest point of a lat/lng rectangle from the origin is one of its
+    corners, so four haversines bound each square.
+    """
+    rings = -1
+    while rings + 1 < max(GRID_ROWS, GRID_COLS):
+        r = rings + 1
+        lats = (max(row - r, 0) * GRID_CELL_DEG - 90, (min(row + r, GRID_ROWS - 1) + 1) * GRID_CELL_DEG - 90)
+        lngs = (max(col - r, 0) * GRID_CELL_DEG - 180, (min(col + r, GRID_COLS - 1) + 1) * GRID_CELL_DEG - 180)
+        if max(haversine(lat, lng, corner_lat, corner_lng) for corner_lat in lats for corner_lng in lngs) >= distance_km:
+            break
+        rings = r
+    return rings
+
+
+def nearest(queryset, lat, lng, k, radius_km=None, prefix='pharmacy__', after=None):
+    """Return up to `k` objects from `queryset` ordered by distance.
+
+    Only the grid cells around (lat, lng) are queried. The search square is
+    grown until the k-th result is provably closer than anything left
+    outside it, or until `radius_km` is covered. Candidates in each square are
+    ranked with one vectorized DistanceIndex pass. Each returned object gets a
+    `distance` attribute in km. `prefix` is the lookup path from the
+    queryset's model to the fields holding grid_row/grid_col/latitude/longitude.
+    `after` is an optional (distance, pk) pair; results start past it. The
+    squares wholly closer than it are excluded in SQL, so a deep page loads
+    only the rows around its own distance.
+    """
+    from .distance import DistanceIndex
+
+    row, col = grid_cell(lat, lng)
+    lat_attr, lng_attr = prefix + 'latitude', prefix + 'longitude'
+    found = []
+    previous = None
+    rings = 1
+    if after is not None:
+        skipped = _closer_rings(lat, lng, row, col, after[0])
+        if skipped >= 0:
+            previous = {prefix + key: value for key, value in _square(row, col, skipped).items()}
+            rings = max(rings, skipped * 2)
+    while True:
+        square = {prefix + key: value for key, value in _square(row, col, rings).items()}
+        batch = queryset.filter(**square)
+        if previous is not None:
+            batch = batch.exclude(**previous)
+        batch = [
+            (obj, _resolve(obj, lat_attr), _resolve(obj, lng_attr))
+            for obj in batch
+        ]
+        batch = [item for item in batch if item[1] is not None and item[2] is not None]
+        if batch:
+            objs, lats, lngs = zip(*batch)
+            index = DistanceIndex([obj.pk for obj in objs], lats, lngs)
+            positions, distances = index.nearest(lat, lng, k, radius_km, after)
+            for position, distance in zip(positions.tolist(), distances.tolist()):
+                objs[position].distance = distance
+                found.append(objs[position])
+            found.sort(key=lambda x: (x.distance, x.pk))
+            found = found[:k]
+
+        covered = _covered_km(lat, rings)
+        if len(found) >= k and found[-1].distance <= covered:
+            break
+        if radius_km is not None and covered >= radius_km:
+            break
+        if rings >= max(GRID_ROWS, GRID_COLS):
+            break
+        previous = square
+        # Grow faster while short of k: a sparse area would otherwise cost
+        # a query per doubling all the way out to the country's edge.
+        rings *= 2 if len(found) >= k else 4
+    return found
+
+
+def _resolve(obj, path):
+    for attr in path.split('__'):
+        obj = getattr(obj, attr)
+    return obj
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 hasher with settings.PASSWORD_PBKDF2_ITERATIONS rounds.
+
+    It shares the pbkdf2_sha256 algorithm name, so existing hashes verify
+    as before. A hash with a different round count, higher or lower, is
+    re-made at the user's next login. The count never goes below Django's
+    own, so a low setting cannot weaken stored hashes; only the test
+    runner lifts that floor, through PASSWORD_PBKDF2_ALLOW_FEWER_ITERATIONS.
+    """
+
+    @property
+    def iterations(self):
+        configured = getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
+        if getattr(settings, 'PASSWORD_PBKDF2_ALLOW_FEWER_ITERATIONS', False):
+            return configured
+        return max(configured, PBKDF2PasswordHasher.iterations)
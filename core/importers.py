@@ -0,0 +1,214 @@
+"""Bulk inventory import from CSV, JSON Lines or JSON files.
+
+Rows are streamed from the file and processed in chunks. Per chunk, the
+medicine names are resolved through a core.catalog.Resolver with one
+query for names not seen yet, missing medicines are created with a
+single bulk_create, and the pharmacy's stock is upserted with
+bulk_create(update_conflicts=True), all inside one transaction together
+with the matching Offer rows. Bad rows are reported by line number and
+never stop the import. A file that cannot be read any further (bad
+encoding, broken CSV quoting) stops it with ImportAborted; the chunks
+before that point stay committed.
+
+CSV and JSON Lines are read one row at a time, whatever their size. A
+.json file is a single document and is parsed whole, so it is limited to
+MAX_JSON_CHARS; larger files must be CSV or JSON Lines.
+"""
+import csv
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from . import catalog, datasets, offers, search_cache
+from .catalog import normalize_name
+from .models import Medicine, PharmacyMedicine
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'jsonl', 'json')
+# PharmacyMedicine.price is DecimalField(max_digits=10, decimal_places=2).
+MAX_PRICE = Decimal('100000000')
+# PharmacyMedicine.quantity is an IntegerField: 32 bits on every backend.
+MIN_QUANTITY, MAX_QUANTITY = -2 ** 31, 2 ** 31 - 1
+MAX_JSON_CHARS = 10_000_000
+MAX_NAME_LENGTH = Medicine._meta.get_field('name').max_length
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.medicines_created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+class ImportAborted(Exception):
+    """The file could not be read to the end. `report` covers the rows imported before."""
+
+    def __init__(self, report, reason):
+        imported = f"; {report.imported} rows were imported before it" if report.imported else ""
+        super().__init__(f"{reason}{imported}")
+        self.report = report
+
+
+def format_for(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported file type '.{extension}', use .csv, .jsonl or .json.")
+    return extension
+
+
+def read_rows(stream, fmt):
+    """Yield (line_number, row_dict) from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as exc:
+                    yield line_number, exc
+    else:
+        text = stream.read(MAX_JSON_CHARS + 1)
+        if len(text) > MAX_JSON_CHARS:
+            raise ValueError(
+                f"A .json import is read whole and may be at most {MAX_JSON_CHARS} characters; "
+                "use .csv or .jsonl for larger files."
+            )
+        data = json.loads(text)
+        if not isinstance(data, list):
+            raise ValueError("A .json import must contain a list of rows.")
+        yield from enumerate(data, start=1)
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0 or price >= MAX_PRICE or price.as_tuple().exponent < -2:
+        raise ValueError("price must be a positive amount with at most two decimals")
+    return price
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise ValueError("quantity must be a whole number")
+    if not MIN_QUANTITY <= quantity <= MAX_QUANTITY:
+        raise ValueError(f"quantity must be between {MIN_QUANTITY} and {MAX_QUANTITY}")
+    return quantity
+
+
+def parse_expiry_date(value):
+    expiry = str(value or '').strip()
+    try:
+        return date.fromisoformat(expiry) if expiry else None
+    except ValueError:
+        raise ValueError("expiry_date must be YYYY-MM-DD")
+
+
+def parse_row(row):
+    """Return (name, generic_name, price, quantity, expiry_date) or raise ValueError."""
+    if isinstance(row, Exception):
+        raise ValueError(f"invalid JSON: {row}")
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    name = str(row.get('medicine_name') or row.get('name') or '').strip()
+    if not name:
+        raise ValueError("medicine_name is required")
+    if len(name) > MAX_NAME_LENGTH or len(normalize_name(name)) > MAX_NAME_LENGTH:
+        raise ValueError(f"medicine_name must be at most {MAX_NAME_LENGTH} characters")
+    generic_name = str(row.get('generic_name') or '').strip() or None
+    if generic_name and len(generic_name) > MAX_NAME_LENGTH:
+        raise ValueError(f"generic_name must be at most {MAX_NAME_LENGTH} characters")
+    price = parse_price(row.get('price', ''))
+    quantity = parse_quantity(row.get('quantity', ''))
+    expiry_date = parse_expiry_date(row.get('expiry_date'))
+    return name, generic_name, price, quantity, expiry_date
+
+
+
+def import_inventory(pharmacy, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Upsert `rows` (from read_rows) into `pharmacy`'s stock and return an ImportReport.
+
+    Raises ImportAborted if reading `rows` fails part way.
+    """
+    report = ImportReport()
+    resolver = catalog.Resolver()
+    medicines_changed = False
+    today = now().date()
+    rows = iter(rows)
+    while True:
+        try:
+            chunk = list(islice(rows, chunk_size))
+        except (ValueError, csv.Error) as exc:
+            finish_import(report, resolver, medicines_changed)
+            raise ImportAborted(report, exc) from exc
+        if not chunk:
+            break
+
+        # Later lines win when the same medicine appears twice in a chunk,
+        # however its name is written; an upsert may not touch the same row
+        # twice.
+        parsed = {}
+        for line, row in chunk:
+            try:
+                name, generic_name, price, quantity, expiry_date = parse_row(row)
+            except ValueError as exc:
+                report.error(line, str(exc))
+                continue
+            key = normalize_name(name)
+            parsed.pop(key, None)
+            parsed[key] = (name, generic_name, price, quantity, expiry_date)
+        if not parsed:
+            continue
+
+        with transaction.atomic():
+            medicines_changed |= resolver.resolve(
+                {values[0]: values[1] for values in parsed.values()}
+            )
+            stock = [
+                PharmacyMedicine(
+                    pharmacy=pharmacy,
+                    medicine_id=resolver.id(name),
+                    price=price,
+                    quantity=quantity,
+                    expiry_date=expiry_date,
+                    in_stock=PharmacyMedicine.stock_flag(quantity, expiry_date, today),
+                )
+                for name, _, price, quantity, expiry_date in parsed.values()
+            ]
+            PharmacyMedicine.objects.bulk_create(
+                stock,
+                update_conflicts=True,
+                unique_fields=['pharmacy', 'medicine'],
+                update_fields=['price', 'quantity', 'expiry_date', 'in_stock', 'updated_at'],
+            )
+            medicine_ids = [row.medicine_id for row in stock]
+            offers.sync_stock(PharmacyMedicine.objects.filter(
+                pharmacy=pharmacy, medicine_id__in=medicine_ids,
+            ))
+            search_cache.invalidate(medicine_ids)
+        report.imported += len(stock)
+
+    finish_import(report, resolver, medicines_changed)
+    return report
+
+
+def finish_import(report, resolver, medicines_changed):
+    report.medicines_created = resolver.created
+    if medicines_changed:
+        # bulk writes skip the Medicine signals.
+        datasets.bump(datasets.MEDICINES)
@@ -0,0 +1,182 @@
+"""Batched inventory edits with optimistic concurrency.
+
+A batch is a list of changes to one owner's stock rows: new price,
+quantity and/or expiry_date values, or a delete. Each change carries the
+row's `updated_at` as the client last read it, as a version token. The
+batch is applied in one transaction. The rows are read once, and if any
+token is stale the whole batch is rejected, so no edit can overwrite a
+change the client has not seen.
+
+Updates are written with one bulk_update per set of changed fields.
+Their Offers and cached searches are synced here, because bulk writes
+skip the model signals. Tokens are full-precision ISO 8601 strings;
+DjangoJSONEncoder would cut them to milliseconds, so build them with
+version().
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from . import offers, search_cache
+from .importers import parse_expiry_date, parse_price, parse_quantity
+from .models import PharmacyMedicine
+
+BATCH_LIMIT = 1000
+EDITABLE_FIELDS = {
+    'price': parse_price,
+    'quantity': parse_quantity,
+    'expiry_date': parse_expiry_date,
+}
+
+
+class BatchError(Exception):
+    """The batch is malformed. `errors` lists (index, message) pairs."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid changes")
+        self.errors = errors
+
+
+class Conflict(Exception):
+    """Rows changed since the client read them. `rows` holds their current state."""
+
+    def __init__(self, rows):
+        super().__init__(f"{len(rows)} rows changed")
+        self.rows = rows
+
+
+class Change:
+    def __init__(self, pk, token, values=None, delete=False):
+        self.pk = pk
+        self.token = token
+        self.values = values or {}
+        self.delete = delete
+
+
+def version(updated_at):
+    return updated_at.isoformat()
+
+
+def stock_json(row):
+    return {
+        'id': row['pk'],
+        'medicine_name': row['medicine__name'],
+        'price': str(row['price']),
+        'quantity': row['quantity'],
+        'expiry_date': row['expiry_date'].isoformat() if row['expiry_date'] else None,
+        'in_stock': row['in_stock'],
+        'updated_at': version(row['updated_at']),
+    }
+
+
+def stock_values(owner):
+    return PharmacyMedicine.objects.filter(pharmacy__owner=owner).values(
+        'pk', 'medicine__name', 'price', 'quantity', 'expiry_date', 'in_stock', 'updated_at',
+    )
+
+
+def stock_versions(owner):
+    """Every stock row of `owner`'s pharmacy with its version token, newest first."""
+    return [stock_json(row) for row in stock_values(owner).order_by('-updated_at')]
+
+
+def parse_change(item):
+    if not isinstance(item, dict):
+        raise ValueError("change must be an object")
+    pk = item.get('id')
+    if not isinstance(pk, int) or isinstance(pk, bool):
+        raise ValueError("id must be a stock item id")
+    token = parse_datetime(str(item.get('updated_at') or ''))
+    if token is None:
+        raise ValueError("updated_at must be the item's last updated_at")
+    if timezone.is_naive(token):
+        token = timezone.make_aware(token, datetime.timezone.utc)
+    if item.get('delete'):
+        return Change(pk, token, delete=True)
+    values = {field: parse(item[field]) for field, parse in EDITABLE_FIELDS.items() if field in item}
+    if not values:
+        raise ValueError("nothing to change: give price, quantity, expiry_date or delete")
+    if 'quantity' in values and values['quantity'] < 0:
+        raise ValueError("quantity cannot be negative")
+    return Change(pk, token, values)
+
+
+def parse_batch(data):
+    """Return the list of Changes in a decoded request body, or raise BatchError."""
+    items = data.get('changes') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError([(None, "body must be {\"changes\": [...]}")])
+    if len(items) > BATCH_LIMIT:
+        raise BatchError([(None, f"at most {BATCH_LIMIT} changes per batch")])
+    changes, errors, seen = [], [], set()
+    for index, item in enumerate(items):
+        try:
+            change = parse_change(item)
+        except ValueError as exc:
+            errors.append((index, str(exc)))
+            continue
+        if change.pk in seen:
+            errors.append((index, "item changed twice in one batch"))
+        seen.add(change.pk)
+        changes.append(change)
+    if errors:
+        raise BatchError(errors)
+    return changes
+
+
+def apply_batch(owner, changes):
+    """Apply `changes` to `owner`'s stock in one transaction.
+
+    Returns {'updated': [{'id', 'updated_at'}], 'deleted': [ids]}. Raises
+    BatchError for rows that are not the owner's and Conflict for stale
+    tokens, leaving the stock untouched.
+    """
+    with transaction.atomic():
+        rows = {
+            row.pk: row for row in PharmacyMedicine.objects.select_for_update(of=('self',))
+            .filter(pharmacy__owner=owner, pk__in=[change.pk for change in changes])
+            .only('pk', 'medicine_id', 'price', 'quantity', 'expiry_date', 'in_stock', 'updated_at')
+        }
+        missing = [(index, "no such stock item") for index, change in enumerate(changes) if change.pk not in rows]
+        if missing:
+            raise BatchError(missing)
+        stale = [change.pk for change in changes if rows[change.pk].updated_at != change.token]
+        if stale:
+            raise Conflict([stock_json(row) for row in stock_values(owner).filter(pk__in=stale)])
+
+        stamp = now()
+        today = stamp.date()
+        by_fields = defaultdict(list)
+        for change in changes:
+            row = rows[change.pk]
+            changed = [field for field, value in change.values.items() if getattr(row, field) != value]
+            if change.delete or not changed:
+                continue  # an unchanged row keeps its version
+            for field in changed:
+                setattr(row, field, change.values[field])
+            row.in_stock = PharmacyMedicine.stock_flag(row.quantity, row.expiry_date, today)
+            row.updated_at = stamp
+            by_fields[tuple(changed)].append(row)
+        for fields, group in by_fields.items():
+            PharmacyMedicine.objects.bulk_update(group, [*fields, 'in_stock', 'updated_at'])
+        written = [row for group in by_fields.values() for row in group]
+        if written:
+            offers.sync_stock(PharmacyMedicine.objects.filter(pk__in=[row.pk for row in written]))
+            search_cache.invalidate(row.medicine_id for row in written)
+
+        deleted = [change.pk for change in changes if change.delete]
+        if deleted:
+            # A real delete, so the Offer cascade and stock signals run.
+            PharmacyMedicine.objects.filter(pk__in=deleted).delete()
+
+    return {
+        'updated': [
+            {'id': change.pk, 'updated_at': version(rows[change.pk].updated_at)}
+            for change in changes if not change.delete
+        ],
+        'deleted': deleted,
+    }
@@ -0,0 +1,146 @@
+"""Periodic background jobs, scheduled in the database.
+
+Jobs are registered here with @job and run by the run_jobs management
+command. Each has a ScheduledJob row holding when it is next due; a worker
+claims a due job by moving next_run_at forward with a conditional UPDATE,
+so any number of workers (or cron invocations of run_jobs --once) can run
+side by side without running a job twice.
+"""
+import datetime
+import logging
+import traceback
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils.timezone import now
+
+from . import search_cache
+from .models import Offer, PharmacyMedicine, ScheduledJob, StockSummary
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_BATCH_SIZE = 1000
+EXPIRING_SOON_DAYS = 30
+
+
+class Job:
+    def __init__(self, name, func, every):
+        self.name = name
+        self.func = func
+        self.every = every
+
+
+JOBS = {}
+
+
+def job(every):
+    """Register the decorated function as a job run every `every`."""
+    def register(func):
+        JOBS[func.__name__] = Job(func.__name__, func, every)
+        return func
+    return register
+
+
+def run(name):
+    """Run a job now, record the outcome on its ScheduledJob and return its result."""
+    entry = JOBS[name]
+    started = now()
+    ScheduledJob.objects.update_or_create(
+        name=name, defaults={'last_started_at': started}, create_defaults={
+            'last_started_at': started, 'next_run_at': started + entry.every,
+        },
+    )
+    try:
+        result = entry.func()
+    except Exception:
+        logger.exception("Job %s failed", name)
+        ScheduledJob.objects.filter(name=name).update(last_finished_at=now(), last_error=traceback.format_exc())
+        raise
+    ScheduledJob.objects.filter(name=name).update(last_finished_at=now(), last_error='')
+    return result
+
+
+def run_due():
+    """Run every job that is due and return {name: result or exception}."""
+    current = now()
+    ScheduledJob.objects.bulk_create(
+        [ScheduledJob(name=name, next_run_at=current) for name in JOBS],
+        ignore_conflicts=True,
+    )
+    results = {}
+    due = ScheduledJob.objects.filter(name__in=list(JOBS), next_run_at__lte=current)
+    for name, next_run_at in due.values_list('name', 'next_run_at'):
+        claimed = ScheduledJob.objects.filter(name=name, next_run_at=next_run_at).update(
+            next_run_at=current + JOBS[name].every,
+        )
+        if not claimed:
+            continue  # another worker got there first
+        try:
+            results[name] = run(name)
+        except Exception as exc:
+            results[name] = exc
+    return results
+
+
+@job(every=datetime.timedelta(hours=1))
+def expire_stock():
+    """Clear the in-stock flag of stock whose expiry date has come.
+
+    Works in batches of EXPIRY_BATCH_SIZE rows, each one UPDATE of the
+    stock and one of its Offers, so the write lock is never held for long.
+    Returns the number of rows expired.
+    """
+    today = now().date()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                PharmacyMedicine.objects.filter(in_stock=True, expiry_date__lte=today)
+                .values_list('pk', 'medicine_id')[:EXPIRY_BATCH_SIZE]
+            )
+            if not rows:
+                return expired
+            ids = [pk for pk, _ in rows]
+            PharmacyMedicine.objects.filter(pk__in=ids).update(in_stock=False)
+            Offer.objects.filter(stock_id__in=ids).update(in_stock=False)
+            search_cache.invalidate(medicine_id for _, medicine_id in rows)
+        expired += len(rows)
+
+
+@job(every=datetime.timedelta(minutes=15))
+def stock_summaries():
+    """Recount every pharmacy's StockSummary with one grouped query.
+
+    Returns the number of pharmacies summarised.
+    """
+    today = now().date()
+    refreshed_at = now()
+    counts = (
+        PharmacyMedicine.objects.order_by().values('pharmacy')
+        .annotate(
+            items=Count('pk'),
+            in_stock=Count('pk', filter=Q(in_stock=True)),
+            expired=Count('pk', filter=Q(expiry_date__lte=today)),
+            expiring_soon=Count('pk', filter=Q(
+                expiry_date__gt=today, expiry_date__lte=today + datetime.timedelta(days=EXPIRING_SOON_DAYS),
+            )),
+        )
+    )
+    summaries = [
+        StockSummary(
+            pharmacy_id=row['pharmacy'], items=row['items'], in_stock=row['in_stock'],
+            expired=row['expired'], expiring_soon=row['expiring_soon'], refreshed_at=refreshed_at,
+        )
+        for row in counts
+    ]
+    with transaction.atomic():
+        StockSummary.objects.bulk_create(
+            summaries,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['pharmacy'],
+            update_fields=['items', 'in_stock', 'expired', 'expiring_soon', 'refreshed_at'],
+        )
+        # Pharmacies whose last stock row was deleted.
+        StockSummary.objects.filter(refreshed_at__lt=refreshed_at).delete()
+    return len(summaries)
@@ -0,0 +1,129 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import synthetic
+from core.benchmarks import summarize
+from core.models import Medicine, PharmacyMedicine
+
+
+class Command(BaseCommand):
+    help = (
+        "Run parallel search readers and inventory writers against a throwaway copy "
+        "of the configured database and report throughput, latency and lock errors. "
+        "Compare profiles by running it under different settings, e.g. SQLITE_WAL=1, "
+        "SQLITE_TUNED=0 or DATABASE_ENGINE=postgres."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run.")
+        parser.add_argument('--pharmacies', type=int, default=500)
+        parser.add_argument('--medicines', type=int, default=1000)
+        parser.add_argument('--stock-per-pharmacy', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        scratch = None
+        if connection.vendor == 'sqlite':
+            # The default SQLite test database lives in memory, where WAL and
+            # the other pragmas do not apply; benchmark a real file instead.
+            scratch = tempfile.mkdtemp()
+            settings_dict['TEST']['NAME'] = os.path.join(scratch, 'benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            synthetic.generate(
+                users=0,
+                pharmacies=options['pharmacies'],
+                medicines=options['medicines'],
+                stock_per_pharmacy=options['stock_per_pharmacy'],
+                seed=options['seed'],
+            )
+            report = self.run_workers(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if scratch:
+                for name in os.listdir(scratch):
+                    os.remove(os.path.join(scratch, name))
+                os.rmdir(scratch)
+
+        report['profile'] = {
+            'vendor': connection.vendor,
+            'options': {key: str(value) for key, value in settings_dict.get('OPTIONS', {}).items()},
+            'conn_max_age': settings_dict.get('CONN_MAX_AGE'),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run_workers(self, options):
+        names = list(Medicine.objects.values_list('name', flat=True)[:200])
+        stock_ids = list(PharmacyMedicine.objects.values_list('pk', flat=True))
+        deadline = time.perf_counter() + options['duration']
+        results = {'read': [], 'write': []}
+        errors = {'read': 0, 'write': 0}
+        lock = threading.Lock()
+
+        def read(rng, client):
+            response = client.get(reverse('search_api'), {'query': rng.choice(names)[:4], 'sort_by': 'price'})
+            if response.status_code != 200:
+                raise DatabaseError(f"search returned {response.status_code}")
+
+        def write(rng, client):
+            with transaction.atomic():
+                stock = PharmacyMedicine.objects.get(pk=rng.choice(stock_ids))
+                stock.quantity = rng.randint(0, 200)
+                stock.save()
+
+        def worker(kind, seed):
+            rng = random.Random(seed)
+            client = Client(raise_request_exception=False)
+            latencies, failed = [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        (read if kind == 'read' else write)(rng, client)
+                    except DatabaseError:
+                        failed += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+            with lock:
+                results[kind].extend(latencies)
+                errors[kind] += failed
+
+        threads = [
+            threading.Thread(target=worker, args=('read', options['seed'] + i))
+            for i in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('write', options['seed'] + 1000 + i))
+            for i in range(options['writers'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = {'readers': options['readers'], 'writers': options['writers'], 'seconds': round(elapsed, 2)}
+        for kind, latencies in results.items():
+            summary = summarize(latencies) if latencies else {'requests': 0}
+            summary['per_second'] = round(len(latencies) / elapsed, 1)
+            summary['errors'] = errors[kind]
+            report[kind] = summary
+        return report
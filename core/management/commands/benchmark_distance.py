@@ -0,0 +1,44 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.distance import DistanceIndex
+from core.geo import haversine
+
+
+class Command(BaseCommand):
+    help = "Compare scalar haversine ranking with the vectorized DistanceIndex."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--k', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        n, repeat, k = options['points'], options['repeat'], options['k']
+        lats = [rng.uniform(26.35, 30.45) for _ in range(n)]
+        lngs = [rng.uniform(80.05, 88.2) for _ in range(n)]
+        origin = (27.7172, 85.3240)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            ranked = sorted(
+                range(n), key=lambda i: haversine(origin[0], origin[1], lats[i], lngs[i])
+            )[:k]
+        scalar = (time.perf_counter() - started) / repeat
+
+        index = DistanceIndex(range(n), lats, lngs)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            positions, _ = index.nearest(origin[0], origin[1], k)
+        vectorized = (time.perf_counter() - started) / repeat
+
+        if ranked != positions.tolist():
+            self.stderr.write("Warning: scalar and vectorized rankings differ.")
+        self.stdout.write(f"points={n} k={k} repeat={repeat}")
+        self.stdout.write(f"scalar haversine + sort: {scalar * 1000:.2f} ms")
+        self.stdout.write(f"DistanceIndex.nearest:   {vectorized * 1000:.2f} ms")
+        self.stdout.write(f"speedup: {scalar / vectorized:.1f}x")
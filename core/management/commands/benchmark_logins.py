@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core.benchmarks import measure
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password hashing, authenticate() and full login requests under the "
+        "configured PASSWORD_HASHER_PROFILE. Runs in one process, so the rates are per "
+        "core. Uses a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help="Logins per measurement.")
+
+    def handle(self, *args, **options):
+        logins = options['logins']
+        password = 'benchmark-Pa55word'
+        hasher = get_hasher()
+        self.stdout.write(
+            f"profile={settings.PASSWORD_HASHER_PROFILE} hasher={hasher.algorithm} "
+            f"iterations={getattr(hasher, 'iterations', '-')}"
+        )
+
+        started = time.perf_counter()
+        for _ in range(logins):
+            make_password(password)
+        self.report("make_password", (time.perf_counter() - started) / logins)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = User(username='benchmark', role='user', is_approved=True)
+            user.set_password(password)
+            user.save()
+
+            started = time.perf_counter()
+            for _ in range(logins):
+                authenticate(username='benchmark', password=password)
+            self.report("authenticate()", (time.perf_counter() - started) / logins)
+
+            url = reverse('login')
+            summary = measure(
+                lambda i: Client().post(url, {'username': 'benchmark', 'password': password}), logins,
+            )
+            self.report("POST /login/", summary['mean_ms'] / 1000, f", {summary['queries_mean']} queries")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, label, seconds, extra=''):
+        self.stdout.write(f"{label:<16} {seconds * 1000:8.2f} ms  {1 / seconds:8.1f}/s per core{extra}")
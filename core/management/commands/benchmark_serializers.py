@@ -0,0 +1,61 @@
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from core import fastjson, synthetic
+from core.models import Pharmacy
+from core.serializers import PharmacySerializer, render_pharmacies
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare PharmacySerializer with the values_list fast path for /api/pharmacies/ "
+        "at several pharmacy counts, on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000', help="Comma-separated pharmacy counts.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in (int(n) for n in options['sizes'].split(',')):
+                call_command('flush', interactive=False, verbosity=0)
+                synthetic.generate(users=0, pharmacies=size, medicines=1, stock_per_pharmacy=0)
+                self.report(size, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, size, repeat):
+        queryset = Pharmacy.objects.all()
+
+        def drf():
+            return JSONRenderer().render(PharmacySerializer(queryset, many=True).data)
+
+        def fast_stdlib():
+            with mock.patch.object(fastjson, 'orjson', None):
+                return render_pharmacies(queryset)
+
+        timings = {}
+        for name, render in [('drf', drf), ('fast_stdlib', fast_stdlib), ('fast', lambda: render_pharmacies(queryset))]:
+            if name == 'fast' and fastjson.orjson is None:
+                continue
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                render()
+                best = min(best, time.perf_counter() - started)
+            timings[name] = best
+
+        line = ', '.join(
+            f"{name} {seconds * 1000:.0f} ms ({timings['drf'] / seconds:.1f}x)" for name, seconds in timings.items()
+        )
+        self.stdout.write(f"{size} pharmacies: {line}")
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importers import IMPORT_CHUNK_SIZE, ImportAborted, format_for, import_inventory, read_rows
+from core.models import Pharmacy
+
+
+class Command(BaseCommand):
+    help = "Import a pharmacy's stock from a CSV, JSON Lines or JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('owner', help="Username of the pharmacy owner.")
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'json'])
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            pharmacy = Pharmacy.objects.get(owner__username=options['owner'])
+        except Pharmacy.DoesNotExist:
+            raise CommandError(f"No pharmacy owned by '{options['owner']}'.")
+        try:
+            fmt = options['format'] or format_for(options['path'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        started = time.perf_counter()
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            try:
+                report = import_inventory(pharmacy, read_rows(stream, fmt), options['chunk_size'])
+            except ImportAborted as exc:
+                raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.imported} rows ({report.medicines_created} new medicines, "
+            f"{len(report.errors)} skipped) in {elapsed:.2f}s."
+        ))
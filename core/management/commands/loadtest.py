@@ -0,0 +1,101 @@
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import summarize
+from core.synthetic import GENERICS, NEPAL_BBOX
+
+
+def scenarios(rng):
+    """Yield (path, params) for the search and map endpoints, forever."""
+    south, west, north, east = NEPAL_BBOX
+    while True:
+        query = rng.choice(GENERICS)[:4]
+        lat, lng = rng.uniform(south, north), rng.uniform(west, east)
+        yield rng.choice([
+            ('/api/search/', {'query': query, 'sort_by': 'price', 'count': 1}),
+            ('/api/search/', {'query': query, 'sort_by': 'distance', 'lat': lat, 'lng': lng}),
+            ('/search/', {'query': query, 'sort_by': 'price'}),
+            ('/api/pharmacies/map/', {'bbox': f'{lng - 1},{lat - 1},{lng + 1},{lat + 1}', 'zoom': 9}),
+            ('/api/pharmacies/locations/', {}),
+        ])
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test running servers with many concurrent keep-alive clients, e.g. "
+        "--target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001, "
+        "and report throughput and latency per target and client count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True,
+                            help="name=base_url of a running server; repeat to compare.")
+        parser.add_argument('--clients', default='10,50,200',
+                            help="Comma-separated numbers of concurrent clients.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith('http://'):
+                raise CommandError(f"--target must look like name=http://host:port, got {target!r}.")
+            targets.append((name, urlsplit(url)))
+
+        report = []
+        for clients in (int(n) for n in options['clients'].split(',')):
+            for name, url in targets:
+                result = self.run(url, clients, options['duration'], options['seed'])
+                result.update(target=name, clients=clients)
+                self.stderr.write(f"{name} x{clients}: {result['per_second']} req/s")
+                report.append(result)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run(self, url, clients, duration, seed):
+        deadline = time.perf_counter() + duration
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client(index):
+            requests = scenarios(random.Random(seed + index))
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            mine, failed = [], 0
+            while time.perf_counter() < deadline:
+                path, params = next(requests)
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', f'{path}?{urlencode(params)}' if params else path)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    failed += 1
+                    connection.close()
+                    continue
+                if response.status >= 500:
+                    failed += 1
+                else:
+                    mine.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+                errors.append(failed)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = summarize(latencies) if latencies else {'requests': 0}
+        result['per_second'] = round(len(latencies) / elapsed, 1)
+        result['errors'] = sum(errors)
+        return result
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.text_search import medicine_search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the medicine name search index for the active database."
+
+    def handle(self, *args, **options):
+        backend = medicine_search()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt medicine index ({type(backend).__name__})."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import offers
+
+
+class Command(BaseCommand):
+    help = "Recreate the Offer search table from pharmacy stock."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = offers.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} offers."))
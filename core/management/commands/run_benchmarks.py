@@ -0,0 +1,61 @@
+import json
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmarks, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark search, map APIs and inventory views at several data sizes. "
+        "Runs against a throwaway test database and prints JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000',
+                            help="Comma-separated pharmacy counts to benchmark.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per scenario.")
+        parser.add_argument('--medicines', type=int, default=2000)
+        parser.add_argument('--stock-per-pharmacy', type=int, default=30)
+        parser.add_argument('--only', help="Comma-separated scenario names.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        only = options['only'].split(',') if options['only'] else None
+        report = {'requests_per_scenario': options['requests'], 'sizes': []}
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in sizes:
+                call_command('flush', interactive=False, verbosity=0)
+                started = time.perf_counter()
+                counts = synthetic.generate(
+                    users=size,
+                    pharmacies=size,
+                    medicines=options['medicines'],
+                    stock_per_pharmacy=options['stock_per_pharmacy'],
+                    seed=options['seed'],
+                )
+                self.stderr.write(f"seeded {size} pharmacies in {time.perf_counter() - started:.1f}s")
+                report['sizes'].append({
+                    'pharmacies': size,
+                    'data': counts,
+                    'scenarios': benchmarks.run(options['requests'], only, options['seed']),
+                })
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
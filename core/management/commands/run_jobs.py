@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the background jobs in core.jobs as they fall due. Runs forever unless "
+        "--once is given (for cron); --job runs one job immediately."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the due jobs once and exit.")
+        parser.add_argument('--job', choices=sorted(jobs.JOBS), help="Run this job now, whether due or not.")
+        parser.add_argument('--poll', type=float, default=30.0, help="Seconds between checks for due jobs.")
+
+    def handle(self, *args, **options):
+        if options['job']:
+            self.report({options['job']: jobs.run(options['job'])})
+            return
+        while True:
+            close_old_connections()
+            self.report(jobs.run_due())
+            if options['once']:
+                return
+            time.sleep(options['poll'])
+
+    def report(self, results):
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                self.stderr.write(self.style.ERROR(f"{name} failed: {result}"))
+            else:
+                self.stdout.write(f"{name}: {result}")
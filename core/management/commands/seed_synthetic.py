@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from core.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = "Create a seeded synthetic dataset of users, pharmacies, medicines and stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--pharmacies', type=int, default=100)
+        parser.add_argument('--medicines', type=int, default=500)
+        parser.add_argument('--stock-per-pharmacy', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='synthetic',
+                            help="Username/name prefix, so several datasets can coexist.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f"{prefix}_").exists():
+            raise CommandError(f"Synthetic data with prefix '{prefix}' already exists; pick another --prefix.")
+
+        started = time.perf_counter()
+        counts = generate(
+            users=options['users'],
+            pharmacies=options['pharmacies'],
+            medicines=options['medicines'],
+            stock_per_pharmacy=options['stock_per_pharmacy'],
+            seed=options['seed'],
+            prefix=prefix,
+        )
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{count} {kind}" for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary} in {elapsed:.1f}s."))
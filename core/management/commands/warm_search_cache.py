@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from core import search_cache
+from core.models import PopularSearch
+from core.views import SearchQuery
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the search cache with the first pages of the most requested searches, "
+        "e.g. after a deploy. Only useful with a shared CACHE_BACKEND (file or redis)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100, help="Number of searches to warm.")
+
+    def handle(self, *args, **options):
+        if settings.CACHE_BACKEND == 'locmem':
+            self.stderr.write(self.style.WARNING(
+                "CACHE_BACKEND is locmem: the pages are cached in this process only."
+            ))
+        factory = RequestFactory()
+        searches = PopularSearch.objects.order_by('-hits', '-last_seen').values_list('params', flat=True)
+        warmed = 0
+        for params in searches[:options['top']]:
+            search = SearchQuery(factory.get(f'/?{params}'))
+            if search.params:
+                search_cache.page(search, record=False)
+                warmed += 1
+        self.stdout.write(self.style.SUCCESS(f"Warmed {warmed} searches."))
@@ -0,0 +1,177 @@
+"""Per-view request metrics kept in process memory.
+
+MetricsMiddleware records, for each URL name, the request wall time, the
+number and total duration of SQL queries, how many of those queries
+repeated an earlier query shape in the same request, and the time spent
+rendering templates. Values go into fixed-bucket histograms that the
+staff-only metrics view renders in the Prometheus text format.
+
+The registry is per process, so with several workers each one reports
+its own numbers; scrape every worker or sum them in Prometheus.
+"""
+import bisect
+import contextvars
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.template.base import Template
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'medfinder_request_duration_seconds': ('Wall time of the request.', DURATION_BUCKETS),
+    'medfinder_db_queries': ('SQL queries made by the request.', QUERY_COUNT_BUCKETS),
+    'medfinder_db_query_duration_seconds': ('Time spent in SQL queries by the request.', DURATION_BUCKETS),
+    'medfinder_duplicate_queries': ('Queries repeating an earlier query shape in the same request.',
+                                    QUERY_COUNT_BUCKETS),
+    'medfinder_template_render_seconds': ('Time spent rendering templates by the request.', DURATION_BUCKETS),
+}
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+def query_shape(sql):
+    """The statement with literals and IN-list lengths removed."""
+    return _NUMBER.sub('?', _IN_LIST.sub('IN (...)', sql))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf overflow; cumulated on export.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, values):
+        """`values` maps histogram names to this request's observation."""
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Return every histogram in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    label = view.replace('\\', '\\\\').replace('"', '\\"')
+                    cumulative = 0
+                    for bound, count in zip([*buckets, '+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{label}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{view="{label}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestRecorder:
+    """Collects one request's queries and template time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.shapes = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def record_query(self, sql, duration):
+        self.query_time += duration
+        self.queries += 1
+        self.shapes[query_shape(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.shapes.values())
+
+    def duplicate_shapes(self):
+        return {shape: count for shape, count in self.shapes.items() if count > 1}
+
+
+# Recorders listening in the current context. Context variables follow a
+# request into sync_to_async threads, so the queries async views run on the
+# ORM's worker thread are attributed to the right request too.
+_query_recorders = contextvars.ContextVar('query_recorders', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    recorders = _query_recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.record_query(sql, duration)
+
+
+def install(connection, **kwargs):
+    """connection_created receiver: pass the connection's queries to the active recorders."""
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def record_queries(recorder):
+    """Send every query made in this context, on any connection, to `recorder`."""
+    token = _query_recorders.set(_query_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _query_recorders.reset(token)
+
+
+current_recorder = contextvars.ContextVar('current_recorder', default=None)
+
+_template_render = Template.render
+
+
+def _timed_render(self, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return _template_render(self, context)
+    # Included templates render inside their parent; only time the outermost.
+    recorder.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        recorder.template_depth -= 1
+        if not recorder.template_depth:
+            recorder.template_time += time.perf_counter() - started
+
+
+def instrument_templates():
+    Template.render = _timed_render
@@ -0,0 +1,139 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from .auth import adopt_legacy_session, attach_pharmacy
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingMiddleware:
+    """Base for middleware that watches the queries of a whole request.
+
+    Works for sync and async views alike: subclasses implement record(),
+    a context manager wrapped around the rest of the chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with self.record(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with self.record(request):
+            return await self.get_response(request)
+
+    def record(self, request):
+        raise NotImplementedError
+
+
+class MetricsMiddleware(RecordingMiddleware):
+    """Record per-view timing and SQL metrics for a sample of requests.
+
+    Enabled with settings.METRICS_ENABLED; settings.METRICS_SAMPLE_RATE is
+    the share of requests (0 to 1) that are measured.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+        metrics.instrument_templates()
+
+    @contextmanager
+    def record(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            yield
+            return
+
+        recorder = metrics.RequestRecorder()
+        token = metrics.current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            with metrics.record_queries(recorder):
+                yield
+        finally:
+            metrics.current_recorder.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.registry.observe(view, {
+            'medfinder_request_duration_seconds': elapsed,
+            'medfinder_db_queries': recorder.queries,
+            'medfinder_db_query_duration_seconds': recorder.query_time,
+            'medfinder_duplicate_queries': recorder.duplicates,
+            'medfinder_template_render_seconds': recorder.template_time,
+        })
+        if settings.DEBUG and recorder.duplicates:
+            for shape, count in recorder.duplicate_shapes().items():
+                logger.warning("Query ran %d times in %s: %s", count, view, shape)
+
+
+class RepeatedQueriesError(Exception):
+    pass
+
+
+class RepeatedQueryGuardMiddleware(RecordingMiddleware):
+    """Flag requests that run the same query shape more than a set number of times.
+
+    That is almost always an N+1: a related object loaded once per row of a
+    list. settings.REPEATED_QUERY_LIMIT is the allowed number of runs per
+    shape (unset turns the guard off) and settings.REPEATED_QUERY_ACTION is
+    'log' or 'raise'. The test runner switches it to 'raise'.
+    """
+
+    def __init__(self, get_response):
+        self.limit = getattr(settings, 'REPEATED_QUERY_LIMIT', None)
+        if not self.limit:
+            raise MiddlewareNotUsed
+        self.action = getattr(settings, 'REPEATED_QUERY_ACTION', 'log')
+        if self.action not in ('log', 'raise'):
+            raise ImproperlyConfigured("REPEATED_QUERY_ACTION must be 'log' or 'raise'.")
+        super().__init__(get_response)
+
+    @contextmanager
+    def record(self, request):
+        with metrics.record_queries(metrics.RequestRecorder()) as recorder:
+            yield
+        repeated = {
+            shape: count for shape, count in recorder.shapes.items() if count > self.limit
+        }
+        if repeated:
+            message = f"{request.path} repeated queries more than {self.limit} times: " + '; '.join(
+                f"{count}x {shape}" for shape, count in repeated.items()
+            )
+            if self.action == 'raise':
+                raise RepeatedQueriesError(message)
+            logger.warning(message)
+
+
+class PharmacyMiddleware(MiddlewareMixin):
+    """Set request.pharmacy: the signed-in user's Pharmacy (or None), loaded on first use.
+
+    Must come after AuthenticationMiddleware, and before anything that reads
+    request.user, as it first moves sessions of retired auth backends over
+    (see core.auth.adopt_legacy_session). Views that need the object
+    itself, not a lazy proxy, call core.auth.get_pharmacy(request).
+    """
+
+    def process_request(self, request):
+        adopt_legacy_session(request)
+        attach_pharmacy(request)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+from core.geo import grid_cell
+
+
+def fill_grid_cells(apps, schema_editor):
+    Pharmacy = apps.get_model('core', 'Pharmacy')
+    pharmacies = list(Pharmacy.objects.filter(latitude__isnull=False, longitude__isnull=False))
+    for pharmacy in pharmacies:
+        pharmacy.grid_row, pharmacy.grid_col = grid_cell(pharmacy.latitude, pharmacy.longitude)
+    Pharmacy.objects.bulk_update(pharmacies, ['grid_row', 'grid_col'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_rename_location_lat_pharmacy_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacy',
+            name='grid_col',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pharmacy',
+            name='grid_row',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacy',
+            index=models.Index(fields=['grid_row', 'grid_col'], name='pharmacy_grid_idx'),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:58
+
+from django.db import migrations
+
+from core.text_search import backend_for
+
+
+def install_text_index(apps, schema_editor):
+    backend = backend_for(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor)
+
+
+def uninstall_text_index(apps, schema_editor):
+    backend = backend_for(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.uninstall(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_pharmacy_grid_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_text_index, uninstall_text_index),
+    ]
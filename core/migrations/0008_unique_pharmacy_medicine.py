@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:28
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_stock(apps, schema_editor):
+    """Keep only the most recently added row for each (pharmacy, medicine)."""
+    PharmacyMedicine = apps.get_model('core', 'PharmacyMedicine')
+    duplicates = (
+        PharmacyMedicine.objects.values('pharmacy', 'medicine')
+        .annotate(rows=Count('pk'), keep=Max('pk'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        PharmacyMedicine.objects.filter(
+            pharmacy=group['pharmacy'], medicine=group['medicine'],
+        ).exclude(pk=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_medicine_text_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_stock, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pharmacymedicine',
+            constraint=models.UniqueConstraint(fields=('pharmacy', 'medicine'), name='unique_pharmacy_medicine'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def fill_offers(apps, schema_editor):
+    PharmacyMedicine = apps.get_model('core', 'PharmacyMedicine')
+    Offer = apps.get_model('core', 'Offer')
+    today = now().date()
+    Offer.objects.bulk_create(
+        (
+            Offer(
+                stock_id=stock.pk,
+                medicine_id=stock.medicine_id,
+                pharmacy_id=stock.pharmacy_id,
+                medicine_name=stock.medicine.name,
+                generic_name=stock.medicine.generic_name,
+                pharmacy_name=stock.pharmacy.name,
+                latitude=stock.pharmacy.latitude,
+                longitude=stock.pharmacy.longitude,
+                grid_row=stock.pharmacy.grid_row,
+                grid_col=stock.pharmacy.grid_col,
+                price=stock.price,
+                quantity=stock.quantity,
+                expiry_date=stock.expiry_date,
+                in_stock=stock.quantity > 0 and (stock.expiry_date is None or stock.expiry_date > today),
+            )
+            for stock in PharmacyMedicine.objects.select_related('pharmacy', 'medicine').iterator()
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_unique_pharmacy_medicine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Offer',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='offer', serialize=False, to='core.pharmacymedicine')),
+                ('medicine_name', models.CharField(max_length=255)),
+                ('generic_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('pharmacy_name', models.CharField(max_length=255)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('grid_row', models.IntegerField(blank=True, null=True)),
+                ('grid_col', models.IntegerField(blank=True, null=True)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.IntegerField()),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('in_stock', models.BooleanField()),
+                ('medicine', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.medicine')),
+                ('pharmacy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.pharmacy')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medicine', 'price'], name='offer_medicine_price_idx'), models.Index(fields=['medicine', 'in_stock'], name='offer_medicine_stock_idx'), models.Index(fields=['price'], name='offer_price_idx'), models.Index(fields=['grid_row', 'grid_col'], name='offer_grid_idx')],
+            },
+        ),
+        migrations.RunPython(fill_offers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_offer_read_model'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pharmacymedicine',
+            name='medicine',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.medicine'),
+        ),
+        migrations.AlterField(
+            model_name='pharmacymedicine',
+            name='pharmacy',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.pharmacy'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['name'], name='medicine_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacy',
+            index=models.Index(condition=models.Q(('latitude__isnull', False), ('longitude__isnull', False)), fields=['latitude', 'longitude'], name='pharmacy_located_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacymedicine',
+            index=models.Index(fields=['medicine', 'price'], name='stock_medicine_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacymedicine',
+            index=models.Index(fields=['pharmacy', '-updated_at'], name='stock_pharmacy_updated_idx'),
+        ),
+    ]
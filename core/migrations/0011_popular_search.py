@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_search_and_inventory_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularSearch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.CharField(max_length=255, unique=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def fill_stock_flags(apps, schema_editor):
+    PharmacyMedicine = apps.get_model('core', 'PharmacyMedicine')
+    PharmacyMedicine.objects.filter(
+        models.Q(quantity__lte=0) | models.Q(expiry_date__lte=now().date())
+    ).update(in_stock=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_popular_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSummary',
+            fields=[
+                ('pharmacy', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='core.pharmacy')),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('in_stock', models.PositiveIntegerField(default=0)),
+                ('expired', models.PositiveIntegerField(default=0)),
+                ('expiring_soon', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pharmacymedicine',
+            name='in_stock',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacymedicine',
+            index=models.Index(condition=models.Q(('in_stock', True)), fields=['expiry_date'], name='stock_expiry_idx'),
+        ),
+        migrations.RunPython(fill_stock_flags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+from core.catalog import merge_duplicates
+
+
+def merge_medicines(apps, schema_editor):
+    merge_duplicates(
+        apps.get_model('core', 'Medicine'),
+        apps.get_model('core', 'PharmacyMedicine'),
+        apps.get_model('core', 'Offer'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_stock_flags_and_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(merge_medicines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+from core.text_search import backend_for
+
+
+def install_text_index(apps, schema_editor):
+    # SQLite rebuilds core_medicine to alter the column, which drops the
+    # triggers keeping the full-text index current; put them back.
+    backend = backend_for(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_medicine_normalized_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicine',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+        migrations.RunPython(install_text_index, migrations.RunPython.noop),
+    ]
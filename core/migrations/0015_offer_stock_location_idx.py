@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_medicine_normalized_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(condition=models.Q(('in_stock', True)), fields=['medicine', 'latitude', 'longitude'], name='offer_stock_location_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .catalog import normalize_name
+from .geo import grid_cell
+
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -11,6 +14,17 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     is_approved = models.BooleanField(default=False)
 
+    # The fields that decide whether the user's pharmacy is listed.
+    VISIBILITY_FIELDS = ('role', 'is_approved')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_visibility = instance.visibility()
+        return instance
+
+    def visibility(self):
+        return tuple(self.__dict__.get(field) for field in self.VISIBILITY_FIELDS)
     
 class Pharmacy(models.Model):
     owner = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -19,30 +33,185 @@ class Pharmacy(models.Model):
     phone = models.CharField(max_length=20)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    grid_row = models.IntegerField(null=True, blank=True, editable=False)
+    grid_col = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['grid_row', 'grid_col'], name='pharmacy_grid_idx'),
+            # Map and location APIs only ever list pharmacies with coordinates.
+            models.Index(
+                fields=['latitude', 'longitude'], name='pharmacy_located_idx',
+                condition=models.Q(latitude__isnull=False, longitude__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.grid_row, self.grid_col = grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'grid_row', 'grid_col'}
+        super().save(*args, **kwargs)
+
+
+class MedicineQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # save() is skipped here, so fill in the catalog key the same way.
+        objs = list(objs)
+        for medicine in objs:
+            medicine.normalized_name = normalize_name(medicine.name)
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class Medicine(models.Model):
     name = models.CharField(max_length=255)
+    # Catalog key of `name` (see core.catalog); one medicine per key.
+    normalized_name = models.CharField(max_length=255, unique=True, editable=False)
     generic_name = models.CharField(max_length=255, blank=True, null=True)
 
+    objects = MedicineQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='medicine_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_name'}
+        super().save(*args, **kwargs)
+
 class PharmacyMedicine(models.Model):
-    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE)
-    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
+    # Both FKs lead a composite index below, which also serves plain FK lookups.
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, db_index=False)
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, db_index=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.IntegerField()
     expiry_date = models.DateField(null=True, blank=True)
+    # Set on save and cleared by the expire_stock job once expiry_date passes.
+    in_stock = models.BooleanField(default=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pharmacy', 'medicine'], name='unique_pharmacy_medicine'),
+        ]
+        indexes = [
+            models.Index(fields=['medicine', 'price'], name='stock_medicine_price_idx'),
+            models.Index(fields=['pharmacy', '-updated_at'], name='stock_pharmacy_updated_idx'),
+            # The expiry sweep only looks at rows still flagged in stock.
+            models.Index(fields=['expiry_date'], name='stock_expiry_idx', condition=models.Q(in_stock=True)),
+        ]
+
     def __str__(self):
         return f"{self.medicine.name} @ {self.pharmacy.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the medicine the row was loaded with, so moving stock to
+        # another medicine also invalidates the searches that listed it.
+        instance._loaded_medicine_id = instance.__dict__.get('medicine_id')
+        return instance
+
+    @staticmethod
+    def stock_flag(quantity, expiry_date, today=None):
+        from django.utils.timezone import now
+        today = today or now().date()
+        return quantity > 0 and (expiry_date is None or expiry_date > today)
+
     @property
     def is_in_stock(self):
-        from django.utils.timezone import now
-        return self.quantity > 0 and (self.expiry_date is None or self.expiry_date > now().date())
+        return self.in_stock
+
+    def save(self, *args, **kwargs):
+        self.in_stock = self.stock_flag(self.quantity, self.expiry_date)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'quantity', 'expiry_date'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'in_stock'}
+        super().save(*args, **kwargs)
+
+
+class Offer(models.Model):
+    """Flattened copy of one PharmacyMedicine row that search reads from.
+
+    Kept current by core.offers through signals; `rebuild_offers` recreates
+    the whole table.
+    """
+    stock = models.OneToOneField(PharmacyMedicine, on_delete=models.CASCADE, primary_key=True, related_name='offer')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, db_index=False, related_name='+')
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='+')
+    medicine_name = models.CharField(max_length=255)
+    generic_name = models.CharField(max_length=255, blank=True, null=True)
+    pharmacy_name = models.CharField(max_length=255)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    grid_row = models.IntegerField(null=True, blank=True)
+    grid_col = models.IntegerField(null=True, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField()
+    expiry_date = models.DateField(null=True, blank=True)
+    in_stock = models.BooleanField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medicine', 'price'], name='offer_medicine_price_idx'),
+            models.Index(fields=['medicine', 'in_stock'], name='offer_medicine_stock_idx'),
+            models.Index(fields=['price'], name='offer_price_idx'),
+            models.Index(fields=['grid_row', 'grid_col'], name='offer_grid_idx'),
+            models.Index(
+                fields=['medicine', 'latitude', 'longitude'],
+                name='offer_stock_location_idx',
+                condition=models.Q(in_stock=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_name} @ {self.pharmacy_name}"
+
+
+class PopularSearch(models.Model):
+    """How often a first page of search results was asked for.
+
+    `params` is the normalized query string the search cache is keyed by;
+    warm_search_cache replays the most requested ones after a deploy.
+    """
+    params = models.CharField(max_length=255, unique=True)
+    hits = models.PositiveIntegerField(default=0)
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return self.params
+
+
+class StockSummary(models.Model):
+    """Stock counts for one pharmacy, refreshed by the stock_summaries job."""
+    pharmacy = models.OneToOneField(Pharmacy, on_delete=models.CASCADE, primary_key=True, related_name='stock_summary')
+    items = models.PositiveIntegerField(default=0)
+    in_stock = models.PositiveIntegerField(default=0)
+    expired = models.PositiveIntegerField(default=0)
+    expiring_soon = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.pharmacy}: {self.in_stock}/{self.items} in stock"
+
+
+class ScheduledJob(models.Model):
+    """Schedule and last outcome of a job registered in core.jobs."""
+    name = models.CharField(max_length=100, unique=True)
+    next_run_at = models.DateTimeField()
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
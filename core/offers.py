@@ -0,0 +1,67 @@
+"""Maintenance of the Offer read model.
+
+Every PharmacyMedicine has one Offer row carrying the medicine, pharmacy
+and stock fields search needs, so search never joins or computes stock
+per row. Signals call these functions on single-row writes; bulk writers
+(imports, batch edits) call them directly for the rows they touched.
+"""
+from django.db import connection
+
+from .models import Offer, PharmacyMedicine
+
+COLUMNS = [
+    'stock_id', 'medicine_id', 'pharmacy_id', 'medicine_name', 'generic_name',
+    'pharmacy_name', 'latitude', 'longitude', 'grid_row', 'grid_col',
+    'price', 'quantity', 'expiry_date', 'in_stock',
+]
+
+# One set-based statement per sync: the projection is computed by the
+# database with INSERT ... SELECT and upserted on the stock id, so syncing
+# 100k rows costs the same round trips as syncing one. The WHERE clause is
+# always present, which SQLite needs to parse INSERT ... SELECT ... ON CONFLICT.
+SYNC_SQL = """
+    INSERT INTO core_offer ({columns})
+    SELECT s.id, s.medicine_id, s.pharmacy_id, m.name, m.generic_name,
+           p.name, p.latitude, p.longitude, p.grid_row, p.grid_col,
+           s.price, s.quantity, s.expiry_date, s.in_stock
+    FROM core_pharmacymedicine s
+    JOIN core_pharmacy p ON p.id = s.pharmacy_id
+    JOIN core_medicine m ON m.id = s.medicine_id
+    WHERE s.id IN ({stock})
+    ON CONFLICT (stock_id) DO UPDATE SET {updates}
+"""
+
+
+def sync_stock(stock):
+    """Upsert the Offers for a PharmacyMedicine queryset."""
+    stock_sql, stock_params = stock.values('pk').query.sql_with_params()
+    sql = SYNC_SQL.format(
+        columns=', '.join(COLUMNS),
+        stock=stock_sql,
+        updates=', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:]),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, stock_params)
+
+
+def sync_pharmacy(pharmacy):
+    Offer.objects.filter(pharmacy=pharmacy).update(
+        pharmacy_name=pharmacy.name,
+        latitude=pharmacy.latitude,
+        longitude=pharmacy.longitude,
+        grid_row=pharmacy.grid_row,
+        grid_col=pharmacy.grid_col,
+    )
+
+
+def sync_medicine(medicine):
+    Offer.objects.filter(medicine=medicine).update(
+        medicine_name=medicine.name, generic_name=medicine.generic_name,
+    )
+
+
+def rebuild():
+    """Recreate every Offer from PharmacyMedicine. Returns the number of rows."""
+    Offer.objects.all().delete()
+    sync_stock(PharmacyMedicine.objects.all())
+    return Offer.objects.count()
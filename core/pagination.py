@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+import math
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _pk(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(value)
+    return value
+
+
+def _price(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(value)
+    price = Decimal(str(value))
+    if not price.is_finite() or abs(price) >= 10 ** 12:
+        raise ValueError(value)
+    return str(price)
+
+
+def _distance(value):
+    if value is None:
+        return None  # past the located rows, into the ones without a location
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(value)
+    return float(value)
+
+
+# What a cursor holds for each ordering: the sort key, then the pk tiebreak.
+CURSOR_TYPES = {
+    'pk': (_pk,),
+    'price': (_price, _pk),
+    'distance': (_distance, _pk),
+}
+
+
+def decode_cursor(cursor, field='pk'):
+    """Return the values stored in `cursor` for an ordering by `field`.
+
+    Returns None if the cursor is unusable: not ours, tampered with, or
+    written for another ordering.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    types = CURSOR_TYPES[field]
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    try:
+        return [parse(value) for parse, value in zip(types, values)]
+    except (ValueError, ArithmeticError):
+        return None
+
+
+def split_page(rows, size, key):
+    """Trim a list fetched with size + 1 rows and build the cursor for the next page."""
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, encode_cursor(key(rows[-1]))
+    return rows, None
+
+
+def keyset_query(queryset, cursor, field='pk'):
+    """Return (queryset, key) for the page after `cursor`, ordered by `field` then pk.
+
+    `key(row)` gives the cursor values for a row. Slice the queryset to the
+    page size plus one and hand the rows to split_page.
+    """
+    if field == 'pk':
+        queryset = queryset.order_by('pk')
+        if cursor:
+            queryset = queryset.filter(pk__gt=cursor[-1])
+        return queryset, lambda obj: [obj.pk]
+    queryset = queryset.order_by(field, 'pk')
+    if cursor:
+        value, pk = cursor
+        queryset = queryset.filter(
+            Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+        )
+    return queryset, lambda obj: [getattr(obj, field), obj.pk]
+
+
+def keyset_page(queryset, cursor, size, field='pk'):
+    """Return (rows, next_cursor) ordered by `field` with pk as the tiebreak.
+
+    The cursor holds the sort key of the last row already shown, so each
+    page is a range scan that starts where the previous one stopped rather
+    than an OFFSET over everything before it.
+    """
+    queryset, key = keyset_query(queryset, cursor, field)
+    return split_page(list(queryset[:size + 1]), size, key)
@@ -0,0 +1,180 @@
+"""Cache of search result pages.
+
+Pages are keyed by the normalized search (query text, sort mode, location
+rounded by SearchQuery, radius and cursor) plus the pharmacy and medicine
+dataset versions. Each entry also records a version per medicine the query
+matches; a PharmacyMedicine write resets its medicine's version, so only
+the searches that could list that medicine are recomputed.
+
+First pages are counted in PopularSearch so warm_search_cache can refill
+the cache with the most requested searches after a deploy.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.utils.timezone import now
+
+from . import datasets
+from .models import Medicine
+from .text_search import medicine_search
+
+logger = logging.getLogger(__name__)
+
+# Queries matching more medicines than this are not cached; checking that
+# many versions would cost more than running the search.
+MAX_CACHED_MEDICINES = 200
+
+
+def stock_dataset(medicine_id):
+    return f'stock:{medicine_id}'
+
+
+def invalidate(medicine_ids):
+    """Drop cached searches that may list stock of these medicines."""
+    names = [stock_dataset(pk) for pk in set(medicine_ids) if pk is not None]
+    datasets.reset(names)
+    # And again once the write is visible: a search running in between may
+    # have cached the old rows against the new versions.
+    transaction.on_commit(lambda: datasets.reset(names))
+
+
+def cache_key(search):
+    if not search.params or not search.params['query']:
+        return None
+    digest = hashlib.sha1(json.dumps([search.params, search.cursor]).encode()).hexdigest()
+    return (
+        f'search:{datasets.version(datasets.PHARMACIES)}:'
+        f'{datasets.version(datasets.MEDICINES)}:{digest}'
+    )
+
+
+def _matching_medicines(query):
+    """Ids of the medicines `query` matches, or None when there are too many."""
+    key = f'search-medicines:{datasets.version(datasets.MEDICINES)}:{hashlib.sha1(query.encode()).hexdigest()}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(
+            Medicine.objects.filter(pk__in=medicine_search().matching(query))
+            .values_list('pk', flat=True)[:MAX_CACHED_MEDICINES + 1]
+        )
+        cache.set(key, ids, settings.SEARCH_CACHE_TIMEOUT)
+    return ids if len(ids) <= MAX_CACHED_MEDICINES else None
+
+
+def _stock_versions(medicine_ids):
+    return datasets.versions([stock_dataset(pk) for pk in medicine_ids])
+
+
+def _lookup(search, record):
+    """Return (key, page, versions).
+
+    `page` is the cached page, or None on a miss; `versions` is what a page
+    computed now must be stored with, or None when it must not be stored.
+    """
+    if not settings.SEARCH_CACHE_TIMEOUT:
+        return None, None, None
+    key = cache_key(search)
+    if key is None:
+        return None, None, None
+    if record and search.cursor is None:
+        popularity.record(search.querystring())
+    entry = cache.get(key)
+    if entry is not None:
+        versions, page = entry
+        if datasets.versions(versions) == versions:
+            return key, page, None
+    medicine_ids = _matching_medicines(search.params['query'])
+    # Versions are read before the page so a write racing the search leaves
+    # the entry stale, never the other way round.
+    return key, None, None if medicine_ids is None else _stock_versions(medicine_ids)
+
+
+def page(search, record=True):
+    """search.page(), through the cache."""
+    key, result, versions = _lookup(search, record)
+    if result is None:
+        result = search.page()
+        if versions is not None:
+            cache.set(key, (versions, result), settings.SEARCH_CACHE_TIMEOUT)
+    return result
+
+
+async def apage(search, fetch):
+    """Async page(): `fetch` is the coroutine function computing a miss."""
+    key, result, versions = await sync_to_async(_lookup)(search, True)
+    if result is None:
+        result = await fetch(search)
+        if versions is not None:
+            await cache.aset(key, (versions, result), settings.SEARCH_CACHE_TIMEOUT)
+    return result
+
+
+# One statement per flush, adding the process's counts to the stored ones.
+UPSERT_SQL = """
+    INSERT INTO core_popularsearch (params, hits, last_seen)
+    VALUES {values}
+    ON CONFLICT (params) DO UPDATE SET
+        hits = core_popularsearch.hits + excluded.hits,
+        last_seen = excluded.last_seen
+"""
+
+
+class Popularity:
+    """Per-process search counts, written to PopularSearch in batches.
+
+    A flush runs inside the search request that makes it due. If the
+    write fails, for example on a locked SQLite database, it is logged and
+    the counts are kept for the next flush instead of failing the search.
+    Counts not yet flushed when the process exits are lost; that is at
+    most flush_every searches or flush_interval seconds of them.
+    """
+
+    flush_every = 100
+    flush_interval = 60
+
+    def __init__(self):
+        self.counts = {}
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, params):
+        if len(params) > 255:
+            return
+        with self._lock:
+            self.counts[params] = self.counts.get(params, 0) + 1
+            self.pending += 1
+            due = (self.pending >= self.flush_every
+                   or time.monotonic() - self.flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+            self.pending = 0
+            self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        seen = connection.ops.adapt_datetimefield_value(now())
+        params = []
+        for key, hits in counts.items():
+            params += [key, hits, seen]
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(UPSERT_SQL.format(values=', '.join(['(%s, %s, %s)'] * len(counts))), params)
+        except DatabaseError:
+            logger.warning("Could not save %d search counts, keeping them for the next flush", len(counts), exc_info=True)
+            with self._lock:
+                for key, hits in counts.items():
+                    self.counts[key] = self.counts.get(key, 0) + hits
+
+
+popularity = Popularity()
@@ -1,8 +1,17 @@
 # core/serializers.py
 from rest_framework import serializers
+from . import fastjson
 from .models import Pharmacy
 
 class PharmacySerializer(serializers.ModelSerializer):
     class Meta:
         model = Pharmacy
         fields = ['name', 'address', 'phone', 'latitude', 'longitude']
+
+
+def render_pharmacies(queryset):
+    """Read-only fast path for PharmacySerializer: the same JSON, without
+    building model instances or per-field serializer objects."""
+    fields = PharmacySerializer.Meta.fields
+    rows = queryset.values_list(*fields)
+    return fastjson.dumps([dict(zip(fields, row)) for row in rows])
@@ -0,0 +1,65 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import auth, catalog, datasets, offers, search_cache
+from .models import User, Pharmacy, Medicine, PharmacyMedicine
+
+
+@receiver([post_save, post_delete], sender=Pharmacy)
+def pharmacy_changed(sender, **kwargs):
+    datasets.bump(datasets.PHARMACIES)
+
+
+@receiver(post_save, sender=Pharmacy)
+def pharmacy_saved(sender, instance, created=False, raw=False, **kwargs):
+    # A new pharmacy has no Offers yet.
+    if not raw and not created:
+        offers.sync_pharmacy(instance)
+
+
+@receiver(post_save, sender=Medicine)
+def medicine_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        offers.sync_medicine(instance)
+
+
+@receiver(post_save, sender=PharmacyMedicine)
+def stock_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        offers.sync_stock(PharmacyMedicine.objects.filter(pk=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=PharmacyMedicine)
+def stock_changed(sender, instance, **kwargs):
+    search_cache.invalidate([instance.medicine_id, getattr(instance, '_loaded_medicine_id', None)])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # Approving a pharmacy owner puts their pharmacy on the map and API.
+    # Logins and password changes save the user too, and must not drop
+    # every cached pharmacy payload and search page.
+    if update_fields is not None and not set(update_fields) & set(User.VISIBILITY_FIELDS):
+        return
+    loaded = getattr(instance, '_loaded_visibility', None)
+    if created or loaded is None:
+        changed = instance.role == 'pharmacy'
+    else:
+        changed = loaded != instance.visibility() and 'pharmacy' in (loaded[0], instance.role)
+    instance._loaded_visibility = instance.visibility()
+    if changed:
+        datasets.bump(datasets.PHARMACIES)
+
+
+@receiver([post_save, post_delete], sender=Medicine)
+def medicine_changed(sender, instance, **kwargs):
+    catalog.names.forget(instance.normalized_name)
+    datasets.bump(datasets.MEDICINES)
+
+
+@receiver([user_logged_in, user_logged_out])
+def session_user_changed(sender, request, **kwargs):
+    # request.user changed mid-request; resolve the pharmacy again.
+    if request is not None and hasattr(request, 'pharmacy'):
+        auth.attach_pharmacy(request)
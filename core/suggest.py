@@ -0,0 +1,66 @@
+from bisect import bisect_left
+
+from . import datasets
+from .datasets import VersionedValue
+
+
+def normalize(text):
+    """Case-fold and collapse whitespace so lookups ignore formatting."""
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """Sorted array of normalized names answering prefix queries with bisect.
+
+    Two parallel lists keep it compact: the sorted normalized keys and the
+    display text for each key.
+    """
+
+    def __init__(self, names):
+        entries = {}
+        for name in names:
+            if name:
+                entries.setdefault(normalize(name), name.strip())
+        self.keys = sorted(entries)
+        self.labels = [entries[key] for key in self.keys]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        matches = []
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(matches) < limit:
+            if not self.keys[position].startswith(prefix):
+                break
+            matches.append(self.labels[position])
+            position += 1
+        return matches
+
+
+def _build_medicine_index():
+    from .models import Medicine
+    names = []
+    for name, generic_name in Medicine.objects.values_list('name', 'generic_name').iterator():
+        names.append(name)
+        names.append(generic_name)
+    return PrefixIndex(names)
+
+
+_index = VersionedValue(datasets.MEDICINES, _build_medicine_index)
+
+
+def medicine_index():
+    """Process-wide PrefixIndex of medicine and generic names, built on first use."""
+    return _index.get()
+
+
+def invalidate():
+    _index.invalidate()
+
+
+def suggest(prefix, limit=10):
+    return medicine_index().lookup(prefix, limit)
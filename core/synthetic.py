@@ -0,0 +1,146 @@
+"""Seeded synthetic data for load testing and benchmarks.
+
+Pharmacies are placed around Nepal's larger cities with some spread over
+the whole country, medicines get brand/generic/strength names, and every
+pharmacy stocks a random sample of them. Everything is written with
+bulk_create, so the derived data that signals normally maintain (grid
+cells, offers, dataset versions) is filled in explicitly.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import catalog, datasets, offers
+from .geo import grid_cell
+from .models import User, Pharmacy, PharmacyMedicine
+
+# south, west, north, east
+NEPAL_BBOX = (26.35, 80.05, 30.45, 88.2)
+
+CITIES = [
+    ('Kathmandu', 27.7172, 85.3240, 0.35),
+    ('Pokhara', 28.2096, 83.9856, 0.12),
+    ('Biratnagar', 26.4525, 87.2718, 0.1),
+    ('Birgunj', 27.0104, 84.8770, 0.08),
+    ('Bharatpur', 27.6766, 84.4354, 0.08),
+    ('Butwal', 27.7006, 83.4484, 0.07),
+    ('Dharan', 26.8065, 87.2846, 0.06),
+    ('Nepalgunj', 28.0500, 81.6167, 0.06),
+    ('Dhangadhi', 28.6852, 80.6216, 0.04),
+    ('Janakpur', 26.7288, 85.9263, 0.04),
+]
+# Share of pharmacies placed uniformly over the country rather than in a city.
+RURAL_SHARE = 0.2
+
+GENERICS = [
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Azithromycin', 'Cetirizine',
+    'Metformin', 'Amlodipine', 'Omeprazole', 'Pantoprazole', 'Atorvastatin',
+    'Losartan', 'Ciprofloxacin', 'Metronidazole', 'Salbutamol', 'Montelukast',
+    'Levocetirizine', 'Diclofenac', 'Ranitidine', 'Domperidone', 'Ondansetron',
+    'Cefixime', 'Doxycycline', 'Prednisolone', 'Vitamin D3', 'Folic Acid',
+]
+BRAND_PARTS = (
+    ['Ze', 'Pa', 'Ca', 'Flo', 'Me', 'Ni', 'Ro', 'Su', 'Ta', 'Vi', 'Lo', 'Am', 'Di', 'Ko', 'Ra'],
+    ['lo', 'ra', 'ci', 'mo', 'te', 'na', 'zi', 'vo', 'pa', 'xi', 'du', 'ge'],
+    ['l', 'n', 'x', 'cin', 'tol', 'pan', 'zole', 'mab', 'fen', 'rin'],
+)
+STRENGTHS = ['50mg', '100mg', '250mg', '500mg', '650mg', '10mg', '20mg', '5ml']
+
+SYNTHETIC_PASSWORD = 'synthetic-password'
+
+
+def _point(rng):
+    south, west, north, east = NEPAL_BBOX
+    if rng.random() < RURAL_SHARE:
+        return rng.uniform(south, north), rng.uniform(west, east)
+    _, lat, lng, spread = rng.choices(CITIES, weights=[c[3] for c in CITIES])[0]
+    lat = min(max(rng.gauss(lat, spread / 2), south), north)
+    lng = min(max(rng.gauss(lng, spread / 2), west), east)
+    return lat, lng
+
+
+def _medicine_names(rng, count):
+    names, seen = [], set()
+    for i in range(count):
+        brand = ''.join(rng.choice(part) for part in BRAND_PARTS).capitalize()
+        name = f"{brand} {rng.choice(STRENGTHS)}"
+        if name in seen:
+            name = f"{brand} {i} {rng.choice(STRENGTHS)}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def generate(users=1000, pharmacies=100, medicines=500, stock_per_pharmacy=50, seed=1, prefix='synthetic'):
+    """Create the dataset and return a dict of how many rows of each kind were made."""
+    rng = random.Random(seed)
+    password = make_password(SYNTHETIC_PASSWORD)
+    stock_per_pharmacy = min(stock_per_pharmacy, medicines)
+    today = datetime.date.today()
+
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [
+                User(username=f"{prefix}_user{i}", password=password, role='user', is_approved=True)
+                for i in range(users)
+            ],
+            batch_size=2000,
+        )
+        owners = User.objects.bulk_create(
+            [
+                User(username=f"{prefix}_pharmacy{i}", password=password, role='pharmacy',
+                     is_approved=rng.random() < 0.95)
+                for i in range(pharmacies)
+            ],
+            batch_size=2000,
+        )
+
+        rows = []
+        for i, owner in enumerate(owners):
+            lat, lng = _point(rng)
+            grid_row, grid_col = grid_cell(lat, lng)
+            rows.append(Pharmacy(
+                owner=owner, name=f"{prefix.title()} Pharmacy {i}",
+                address=f"Ward {rng.randint(1, 32)}", phone=f"+977-{rng.randint(1000000, 9999999)}",
+                latitude=lat, longitude=lng, grid_row=grid_row, grid_col=grid_col,
+            ))
+        pharmacy_rows = Pharmacy.objects.bulk_create(rows, batch_size=2000)
+
+        # Through the catalog, so names already there (from an earlier run
+        # with another prefix) are reused rather than duplicated.
+        names = _medicine_names(rng, medicines)
+        resolver = catalog.Resolver()
+        for start in range(0, len(names), 2000):
+            resolver.resolve({name: rng.choice(GENERICS) for name in names[start:start + 2000]})
+        medicine_ids = [resolver.id(name) for name in names]
+
+        stock = []
+        for pharmacy in pharmacy_rows:
+            for medicine_id in rng.sample(medicine_ids, stock_per_pharmacy):
+                expiry = today + datetime.timedelta(days=rng.randint(-60, 900))
+                quantity = rng.randint(0, 200)
+                stock.append(PharmacyMedicine(
+                    pharmacy=pharmacy, medicine_id=medicine_id,
+                    price=Decimal(rng.randint(500, 150000)).scaleb(-2), quantity=quantity,
+                    expiry_date=expiry, in_stock=PharmacyMedicine.stock_flag(quantity, expiry, today),
+                ))
+            if len(stock) >= 10000:
+                PharmacyMedicine.objects.bulk_create(stock)
+                stock = []
+        PharmacyMedicine.objects.bulk_create(stock)
+
+        offers.sync_stock(PharmacyMedicine.objects.filter(
+            pharmacy__in=Pharmacy.objects.filter(owner__username__startswith=f"{prefix}_pharmacy"),
+        ))
+
+    datasets.bump(datasets.PHARMACIES)
+    datasets.bump(datasets.MEDICINES)
+    return {
+        'users': users + pharmacies,
+        'pharmacies': pharmacies,
+        'medicines': medicines,
+        'stock': pharmacies * stock_per_pharmacy,
+    }
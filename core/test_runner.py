@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Run the suite with the repeated-query guard raising on every request.
+
+    Tests may also hash passwords with fewer PBKDF2 rounds than Django's.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.REPEATED_QUERY_LIMIT = settings.REPEATED_QUERY_LIMIT or 10
+        settings.REPEATED_QUERY_ACTION = 'raise'
+        settings.PASSWORD_PBKDF2_ALLOW_FEWER_ITERATIONS = True
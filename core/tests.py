@@ -1,3 +1,1263 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import random
+import re
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import login
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from . import availability, async_views, catalog, datasets, exports, jobs, metrics, search_cache, synthetic, views
+from .clustering import MAX_CLUSTER_ZOOM, invalidate as invalidate_clusters
+from .distance import DistanceIndex
+from .hashers import TunedPBKDF2PasswordHasher
+from .forms import PharmacyLocationForm
+from .middleware import PharmacyMiddleware, RepeatedQueriesError, RepeatedQueryGuardMiddleware
+from .importers import MAX_JSON_CHARS, ImportAborted, import_inventory, read_rows
+from .geo import grid_cell, haversine, nearest
+from .models import (
+    User, Pharmacy, Medicine, PharmacyMedicine, Offer, PopularSearch, ScheduledJob, StockSummary,
+)
+from .suggest import PrefixIndex, invalidate as invalidate_suggestions
+from .text_search import medicine_search
+from .pagination import decode_cursor, encode_cursor
+from .views import SEARCH_PAGE_SIZE
+
+
+def make_pharmacy(username, lat=None, lng=None, approved=True):
+    owner = User.objects.create(username=username, role='pharmacy', is_approved=approved)
+    return Pharmacy.objects.create(
+        owner=owner, name=f"{username} Pharmacy", address='', phone='',
+        latitude=lat, longitude=lng,
+    )
+
+
+class SpatialGridTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        cls.medicine = Medicine.objects.create(name='Paracetamol')
+        for i in range(60):
+            pharmacy = make_pharmacy(
+                f"owner{i}", rng.uniform(26.4, 30.4), rng.uniform(80.1, 88.1),
+            )
+            PharmacyMedicine.objects.create(
+                pharmacy=pharmacy, medicine=cls.medicine, price=10, quantity=5,
+            )
+
+    def test_location_form_updates_grid_cell(self):
+        pharmacy = make_pharmacy('mover')
+        form = PharmacyLocationForm({'latitude': 27.7172, 'longitude': 85.3240}, instance=pharmacy)
+        self.assertTrue(form.is_valid())
+        form.save()
+        pharmacy.refresh_from_db()
+        self.assertEqual((pharmacy.grid_row, pharmacy.grid_col), grid_cell(27.7172, 85.3240))
+
+    def test_nearest_matches_full_scan(self):
+        origin = (27.7172, 85.3240)
+        stock = PharmacyMedicine.objects.select_related('pharmacy')
+        expected = sorted(
+            stock,
+            key=lambda pm: (haversine(*origin, pm.pharmacy.latitude, pm.pharmacy.longitude), pm.pk),
+        )[:10]
+        found = nearest(stock, *origin, k=10)
+        self.assertEqual([pm.pk for pm in found], [pm.pk for pm in expected])
+
+    def test_nearest_respects_radius(self):
+        found = nearest(PharmacyMedicine.objects.select_related('pharmacy'), 27.7172, 85.3240, k=100, radius_km=50)
+        self.assertTrue(all(pm.distance <= 50 for pm in found))
+
+
+class DistanceIndexTests(TestCase):
+    def test_matches_scalar_haversine(self):
+        rng = random.Random(3)
+        points = [(rng.uniform(-80, 80), rng.uniform(-179, 179)) for _ in range(500)]
+        index = DistanceIndex(range(len(points)), *zip(*points))
+        distances = index.distances(27.7, 85.3)
+        for (lat, lng), distance in zip(points, distances.tolist()):
+            self.assertAlmostEqual(distance, haversine(27.7, 85.3, lat, lng), places=6)
+
+    def test_nearest_orders_top_k(self):
+        index = DistanceIndex([10, 11, 12, 13], [27.0, 27.5, 27.7, 28.5], [85.3] * 4)
+        positions, distances = index.nearest(27.7, 85.3, k=2)
+        self.assertEqual(index.ids[positions].tolist(), [12, 11])
+        self.assertEqual(len(distances), 2)
+
+
+class SearchPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(11)
+        medicine = Medicine.objects.create(name='Cetirizine')
+        for i in range(SEARCH_PAGE_SIZE * 2 + 5):
+            pharmacy = make_pharmacy(f"page{i}", rng.uniform(27.5, 27.9), rng.uniform(85.1, 85.5))
+            PharmacyMedicine.objects.create(
+                pharmacy=pharmacy, medicine=medicine, price=rng.choice([5, 10, 15]), quantity=1,
+            )
+
+    def collect(self, params):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(reverse('search_api'), {**params, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(len(body['results']), SEARCH_PAGE_SIZE)
+            seen.extend(body['results'])
+            cursor = body['next']
+            if not cursor:
+                return seen
+
+    def test_price_pages_cover_everything_in_order(self):
+        rows = self.collect({'query': 'cetiri', 'sort_by': 'price'})
+        expected = list(PharmacyMedicine.objects.order_by('price', 'pk').values_list('pk', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+
+    def test_distance_pages_cover_everything_in_order(self):
+        rows = self.collect({'sort_by': 'distance', 'lat': 27.7, 'lng': 85.3})
+        self.assertEqual(len(rows), PharmacyMedicine.objects.count())
+        self.assertEqual(len({row['id'] for row in rows}), len(rows))
+        distances = [row['distance'] for row in rows]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_pharmacies_without_a_location_come_last_in_distance_order(self):
+        medicine = Medicine.objects.get()
+        unlocated = [
+            PharmacyMedicine.objects.create(
+                pharmacy=make_pharmacy(f"nowhere{i}"), medicine=medicine, price=5, quantity=1,
+            ).pk
+            for i in range(SEARCH_PAGE_SIZE)
+        ]
+        located = PharmacyMedicine.objects.count() - len(unlocated)
+        rows = self.collect({'sort_by': 'distance', 'lat': 27.7, 'lng': 85.3})
+        self.assertEqual([row['id'] for row in rows[located:]], unlocated)
+        self.assertEqual({row['distance'] for row in rows[located:]}, {None})
+        self.assertNotIn(None, [row['distance'] for row in rows[:located]])
+        within = self.collect({'sort_by': 'distance', 'lat': 27.7, 'lng': 85.3, 'radius': 1000})
+        self.assertEqual(len(within), located)
+
+    def test_radius_needs_distance_sort_and_a_location(self):
+        for params in [
+            {'sort_by': 'price', 'radius': 5, 'lat': 27.7, 'lng': 85.3},
+            {'radius': 5, 'lat': 27.7, 'lng': 85.3},
+            {'sort_by': 'distance', 'radius': 5, 'lat': 27.7},
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(reverse('search_api'), params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('radius', response.json()['errors'])
+        response = self.client.get(reverse('search'), {'sort_by': 'price', 'radius': 5})
+        self.assertIn('radius', response.context['form'].errors)
+        response = self.client.get(reverse('search_api'), {'sort_by': 'distance', 'radius': 5, 'lat': 27.7, 'lng': 85.3})
+        self.assertEqual(response.status_code, 200)
+
+    def test_tampered_cursors_restart_from_the_first_page(self):
+        first = self.client.get(reverse('search_api'), {'sort_by': 'price'}).json()['results']
+        for sort_by in ('', 'price', 'distance'):
+            for values in (['abc', 1], ['x'], [{'a': 1}], [None, None], [1, 2, 3], [True], ['NaN', 1], [1e400, 1], [1, 2 ** 70]):
+                cursor = encode_cursor(values)
+                for name in ('search_api', 'search'):
+                    with self.subTest(sort_by=sort_by, values=values, view=name):
+                        response = self.client.get(reverse(name), {
+                            'sort_by': sort_by, 'lat': 27.7, 'lng': 85.3, 'cursor': cursor,
+                        })
+                        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode_cursor(encode_cursor(['abc', 1]), 'price'), None)
+        self.assertEqual(decode_cursor(encode_cursor(['5.50', 3]), 'price'), ['5.50', 3])
+        self.assertEqual(decode_cursor(encode_cursor([1.5, 3]), 'distance'), [1.5, 3])
+        self.assertEqual(decode_cursor(encode_cursor([1.5, 3]), 'pk'), None)
+        self.assertEqual(len(first), SEARCH_PAGE_SIZE)
+
+    def test_deep_distance_pages_skip_closer_rows_in_sql(self):
+        offers = Offer.objects.all()
+        everything = nearest(offers, 27.7, 85.3, k=Offer.objects.count(), prefix='')
+        after = everything[-6]
+        with CaptureQueriesContext(connection) as captured:
+            rest = nearest(offers, 27.7, 85.3, k=10, prefix='', after=(after.distance, after.pk))
+        self.assertEqual([o.pk for o in rest], [o.pk for o in everything[-5:]])
+        self.assertIn('NOT (', captured[0]['sql'])
+
+    def test_html_search_renders_one_page(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(len(response.context['results']), SEARCH_PAGE_SIZE)
+        self.assertIn('cursor=', response.context['next_query'])
+
+
+class MedicineTextSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.crocin = Medicine.objects.create(name='Crocin Advance', generic_name='Paracetamol')
+        cls.calpol = Medicine.objects.create(name='Calpol', generic_name='Paracetamol')
+        cls.paracip = Medicine.objects.create(name='Paracip', generic_name=None)
+        cls.zyrtec = Medicine.objects.create(name='Zyrtec', generic_name='Cetirizine')
+
+    def matches(self, query):
+        return set(Medicine.objects.filter(pk__in=medicine_search().matching(query)).values_list('pk', flat=True))
+
+    def test_matches_substrings_of_brand_or_generic_name(self):
+        self.assertEqual(self.matches('CETAMOL'), {self.crocin.pk, self.calpol.pk})
+        self.assertEqual(self.matches('tirizi'), {self.zyrtec.pk})
+        self.assertEqual(self.matches('cr'), {self.crocin.pk})
+
+    def test_index_follows_updates_and_deletes(self):
+        self.zyrtec.generic_name = 'Levocetirizine'
+        self.zyrtec.save()
+        self.assertEqual(self.matches('levocet'), {self.zyrtec.pk})
+        self.calpol.delete()
+        self.assertEqual(self.matches('paracetamol'), {self.crocin.pk})
+
+    def test_ranked_prefers_brand_name_hits(self):
+        self.assertEqual(medicine_search().ranked('parac', limit=5)[0], self.paracip.pk)
+
+    def test_rebuild_keeps_matches(self):
+        medicine_search().rebuild()
+        self.assertEqual(self.matches('calpol'), {self.calpol.pk})
+
+    def test_search_view_uses_index(self):
+        stock = PharmacyMedicine.objects.create(
+            pharmacy=make_pharmacy('fts'), medicine=self.zyrtec, price=3, quantity=2,
+        )
+        response = self.client.get(reverse('search_api'), {'query': 'cetirizine'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [stock.pk])
+
+
+class MedicineSuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Medicine.objects.create(name='Paracetamol 500mg', generic_name='Paracetamol')
+        Medicine.objects.create(name='Pantoprazole', generic_name=None)
+        Medicine.objects.create(name='Azithromycin', generic_name='Azithromycin')
+
+    def setUp(self):
+        invalidate_suggestions()
+
+    def suggest(self, q):
+        return self.client.get(reverse('medicine_suggest_api'), {'q': q}).json()['suggestions']
+
+    def test_prefix_lookup_is_normalized(self):
+        index = PrefixIndex(['Cetirizine', 'cetirizine  ', 'Cefixime', 'Zinc'])
+        self.assertEqual(index.lookup('  CE'), ['Cefixime', 'Cetirizine'])
+        self.assertEqual(index.lookup('x'), [])
+
+    def test_suggestions_are_served_without_queries_once_built(self):
+        self.assertEqual(self.suggest('pa'), ['Pantoprazole', 'Paracetamol', 'Paracetamol 500mg'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('azi'), ['Azithromycin'])
+
+    def test_saving_a_medicine_invalidates_the_index(self):
+        self.assertEqual(self.suggest('cef'), [])
+        Medicine.objects.create(name='Cefixime')
+        self.assertEqual(self.suggest('cef'), ['Cefixime'])
+
+
+class PharmacyMapApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Five pharmacies in Kathmandu, one in Pokhara, one unapproved, one unlocated.
+        for i in range(5):
+            make_pharmacy(f"ktm{i}", 27.70 + i * 0.001, 85.32)
+        make_pharmacy('pokhara', 28.21, 83.99)
+        make_pharmacy('pending', 27.70, 85.32, approved=False)
+        make_pharmacy('nowhere')
+
+    def setUp(self):
+        invalidate_clusters()
+
+    def fetch(self, bbox, zoom):
+        response = self.client.get(reverse('pharmacy_map_api'), {'bbox': bbox, 'zoom': zoom})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_low_zoom_merges_nearby_pins(self):
+        data = self.fetch('80,26,89,31', 7)
+        self.assertEqual([c['count'] for c in data['clusters']], [5])
+        self.assertEqual([p['name'] for p in data['pharmacies']], ['pokhara Pharmacy'])
+
+    def test_high_zoom_returns_pins_inside_bbox_only(self):
+        data = self.fetch('85.3,27.69,85.34,27.71', MAX_CLUSTER_ZOOM + 1)
+        self.assertEqual(data['clusters'], [])
+        self.assertEqual(len(data['pharmacies']), 5)
+
+    def test_approval_invalidates_clusters(self):
+        self.assertEqual(self.fetch('83.9,28.1,84.1,28.3', 18)['pharmacies'][0]['name'], 'pokhara Pharmacy')
+        owner = User.objects.get(username='pending')
+        owner.is_approved = True
+        owner.save()
+        data = self.fetch('85.3,27.69,85.34,27.71', 18)
+        self.assertEqual(len(data['pharmacies']), 6)
+
+    def test_requires_bbox_and_zoom(self):
+        for params in [
+            {'zoom': 3},
+            {'bbox': 'nan,nan,nan,nan', 'zoom': 5},
+            {'bbox': '80,26,inf,31', 'zoom': 5},
+            {'bbox': '80,-100,89,31', 'zoom': 5},
+            {'bbox': '1e30,26,89,31', 'zoom': 5},
+            {'bbox': '80,26,89,31', 'zoom': 10 ** 30},
+            {'bbox': '80,26,89,31', 'zoom': -1},
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(reverse('pharmacy_map_api'), params)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.fetch('-300,-85,300,85', 0)['zoom'], 0)
+
+
+class PharmacyApiCachingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('cached', 27.7, 85.3)
+
+    def test_repeat_requests_are_served_from_cache_and_revalidated(self):
+        for name in ('pharmacy_locations_api', 'pharmacy_list_api'):
+            with self.subTest(name):
+                url = reverse(name)
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                with self.assertNumQueries(0):
+                    again = self.client.get(url)
+                self.assertEqual(again.content, first.content)
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_saving_a_pharmacy_changes_the_etag(self):
+        url = reverse('pharmacy_list_api')
+        first = self.client.get(url)
+        self.pharmacy.name = 'Renamed'
+        self.pharmacy.save()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()[0]['name'], 'Renamed')
+
+    def test_fast_serializer_matches_drf(self):
+        make_pharmacy('Pokhara Ünicode')
+        url = reverse('pharmacy_list_api')
+        fast = self.client.get(url, {'serializer': 'fast'})
+        drf = self.client.get(url, {'serializer': 'drf'})
+        self.assertEqual(fast.json(), drf.json())
+        self.assertEqual(len(fast.json()), 2)
+        self.assertEqual(self.client.get(url, {'serializer': 'yaml'}).status_code, 400)
+
+
+class InventoryImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('importer', 27.7, 85.3)
+        cls.existing = Medicine.objects.create(name='Calpol', generic_name=None)
+        PharmacyMedicine.objects.create(pharmacy=cls.pharmacy, medicine=cls.existing, price=1, quantity=1)
+
+    def test_csv_rows_are_upserted_and_errors_reported(self):
+        csv_data = io.StringIO(
+            "medicine_name,generic_name,price,quantity,expiry_date\n"
+            "Calpol,Paracetamol,12.50,30,2030-01-01\n"
+            "Zyrtec,Cetirizine,8,10,\n"
+            ",Nothing,1,1,\n"
+            "Brufen,Ibuprofen,abc,1,\n"
+            "Aspro,Aspirin,1,100000000000000000000,\n"
+            f"{'A' * 256},Aspirin,1,1,\n"
+            f"Aspro,{'A' * 256},1,1,\n"
+            "Zyrtec,Cetirizine,9,12,\n"
+        )
+        report = import_inventory(self.pharmacy, read_rows(csv_data, 'csv'), chunk_size=2)
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6, 7, 8])
+        self.assertEqual(report.medicines_created, 1)
+        stock = {
+            pm.medicine.name: (pm.price, pm.quantity)
+            for pm in PharmacyMedicine.objects.filter(pharmacy=self.pharmacy).select_related('medicine')
+        }
+        self.assertEqual(stock, {'Calpol': (12.5, 30), 'Zyrtec': (9, 12)})
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.generic_name, 'Paracetamol')
+
+    def test_upload_view_imports_json_lines(self):
+        self.client.force_login(self.pharmacy.owner)
+        upload = SimpleUploadedFile(
+            'stock.jsonl',
+            b'{"medicine_name": "Calpol", "price": 3, "quantity": 4}\n'
+            b'{"medicine_name": "Flexon", "price": 2, "quantity": 5}\n',
+        )
+        response = self.client.post(reverse('import_inventory'), {'file': upload})
+        self.assertEqual(response.context['report'].imported, 2)
+        self.assertEqual(PharmacyMedicine.objects.filter(pharmacy=self.pharmacy).count(), 2)
+
+    def test_unreadable_files_abort_with_the_rows_already_imported(self):
+        csv_data = io.StringIO(
+            "medicine_name,price,quantity\n"
+            "Calpol,1,1\n"
+            "Zyrtec,1,1\n"
+            f"Brufen,1,{'9' * 200_000}\n"
+        )
+        with self.assertRaisesMessage(ImportAborted, "(131072); 2 rows were imported before it"):
+            import_inventory(self.pharmacy, read_rows(csv_data, 'csv'), chunk_size=2)
+        self.assertEqual(PharmacyMedicine.objects.filter(pharmacy=self.pharmacy).count(), 2)
+
+        self.client.force_login(self.pharmacy.owner)
+        for name, content in [
+            ('stock.csv', f"medicine_name,price,quantity\nCalpol,1,{'9' * 200_000}\n".encode()),
+            ('stock.json', b'[' + b' ' * MAX_JSON_CHARS + b']'),
+        ]:
+            response = self.client.post(reverse('import_inventory'), {'file': SimpleUploadedFile(name, content)})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Could not read file", response.context['form'].errors['file'][0])
+
+    def test_adding_a_stocked_medicine_restocks_it(self):
+        self.client.force_login(self.pharmacy.owner)
+        self.client.post(reverse('add_medicine'), {
+            'medicine_name': 'Calpol', 'price': 5, 'quantity': 7,
+        })
+        stock = PharmacyMedicine.objects.get(pharmacy=self.pharmacy)
+        self.assertEqual((stock.medicine, stock.quantity), (self.existing, 7))
+
+
+class OfferReadModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('offers', 27.7, 85.3)
+        cls.medicine = Medicine.objects.create(name='Flexon', generic_name='Ibuprofen')
+        cls.stock = PharmacyMedicine.objects.create(
+            pharmacy=cls.pharmacy, medicine=cls.medicine, price=4, quantity=3,
+            expiry_date=datetime.date(2000, 1, 1),
+        )
+
+    def offer(self):
+        return Offer.objects.get(pk=self.stock.pk)
+
+    def test_offer_mirrors_stock(self):
+        offer = self.offer()
+        self.assertEqual(
+            (offer.medicine_name, offer.generic_name, offer.pharmacy_name, offer.latitude, offer.in_stock),
+            ('Flexon', 'Ibuprofen', 'offers Pharmacy', 27.7, False),
+        )
+
+    def test_offer_follows_writes(self):
+        self.stock.expiry_date = None
+        self.stock.price = 6
+        self.stock.save()
+        self.pharmacy.latitude = 28.2
+        self.pharmacy.save()
+        self.medicine.generic_name = 'Ibuprofen + Paracetamol'
+        self.medicine.save()
+        offer = self.offer()
+        self.assertEqual(
+            (offer.price, offer.in_stock, offer.latitude, offer.grid_row, offer.generic_name),
+            (6, True, 28.2, self.pharmacy.grid_row, 'Ibuprofen + Paracetamol'),
+        )
+        self.stock.delete()
+        self.assertFalse(Offer.objects.exists())
+
+    def test_rebuild_command_restores_offers(self):
+        Offer.objects.all().delete()
+        call_command('rebuild_offers', stdout=io.StringIO())
+        self.assertEqual(self.offer().medicine_name, 'Flexon')
+
+    @override_settings(SEARCH_CACHE_TIMEOUT=0)
+    def test_search_reads_only_offers(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('search_api'), {'query': 'flex', 'sort_by': 'price'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.stock.pk])
+
+
+class SyntheticDataTests(TestCase):
+    def test_generate_is_seeded_and_fills_offers(self):
+        counts = synthetic.generate(users=5, pharmacies=4, medicines=10, stock_per_pharmacy=3, seed=7)
+        self.assertEqual(counts, {'users': 9, 'pharmacies': 4, 'medicines': 10, 'stock': 12})
+        self.assertEqual(Offer.objects.count(), 12)
+        pharmacy = Pharmacy.objects.order_by('pk').first()
+        self.assertEqual((pharmacy.grid_row, pharmacy.grid_col), grid_cell(pharmacy.latitude, pharmacy.longitude))
+
+        # A second run reuses the catalog's medicines instead of duplicating them.
+        names = list(Medicine.objects.order_by('pk').values_list('name', flat=True))
+        synthetic.generate(users=5, pharmacies=4, medicines=10, stock_per_pharmacy=3, seed=7, prefix='again')
+        self.assertEqual(list(Medicine.objects.order_by('pk').values_list('name', flat=True)), names)
+        self.assertEqual(Offer.objects.count(), 24)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_SAMPLE_RATE=1.0)
+class MetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_query_shape_ignores_literals_and_in_list_length(self):
+        self.assertEqual(
+            metrics.query_shape('SELECT 1 FROM t WHERE id IN (%s, %s, %s) LIMIT 21'),
+            metrics.query_shape('SELECT 1 FROM t WHERE id IN (%s) LIMIT 5'),
+        )
+
+    def test_views_are_recorded_and_exported_to_staff(self):
+        self.client.get(reverse('search'), {'query': 'para'})
+        self.client.get(reverse('about'))
+        staff = User.objects.create(username='ops', is_staff=True)
+        self.client.force_login(staff)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('medfinder_request_duration_seconds_count{view="search"} 1', body)
+        self.assertIn('medfinder_db_queries_bucket{view="search",le="+Inf"} 1', body)
+        self.assertIn('medfinder_template_render_seconds_count{view="about"} 1', body)
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_login(User.objects.create(username='someone'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.get(reverse('about'))
+        self.assertNotIn('view="about"', metrics.registry.render())
+
+
+class QueryCountTests(TestCase):
+    """Inventory and admin pages run the same number of queries for 1 or 20 rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('counts', 27.7, 85.3)
+        cls.medicines = Medicine.objects.bulk_create(
+            [Medicine(name=f"Counted {i}") for i in range(20)]
+        )
+        cls.admin = User.objects.create_superuser('root', password='x')
+
+    def stock(self, count):
+        PharmacyMedicine.objects.all().delete()
+        for medicine in self.medicines[:count]:
+            PharmacyMedicine.objects.create(pharmacy=self.pharmacy, medicine=medicine, price=1, quantity=1)
+
+    def queries_for(self, url, count):
+        self.stock(count)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(captured)
+
+    def assertConstantQueries(self, url):
+        self.queries_for(url, 1)  # warm per-process caches such as content types
+        self.assertEqual(self.queries_for(url, 1), self.queries_for(url, 20))
+
+    def test_inventory(self):
+        self.client.force_login(self.pharmacy.owner)
+        self.assertConstantQueries(reverse('inv'))
+
+    def test_admin_stock_list(self):
+        self.client.force_login(self.admin)
+        self.assertConstantQueries(reverse('admin:core_pharmacymedicine_changelist'))
+
+    def test_admin_pharmacy_list_and_inline(self):
+        self.client.force_login(self.admin)
+        self.assertConstantQueries(reverse('admin:core_pharmacy_changelist'))
+        self.assertConstantQueries(reverse('admin:core_pharmacy_change', args=[self.pharmacy.pk]))
+
+    @override_settings(REPEATED_QUERY_LIMIT=2, REPEATED_QUERY_ACTION='raise')
+    def test_guard_raises_on_repeated_query_shape(self):
+        def view(request):
+            for medicine in self.medicines[:3]:
+                Medicine.objects.filter(pk=medicine.pk).exists()
+            return HttpResponse()
+
+        guard = RepeatedQueryGuardMiddleware(view)
+        with self.assertRaises(RepeatedQueriesError):
+            guard(RequestFactory().get('/'))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "query plans are SQLite's EXPLAIN QUERY PLAN output")
+class QueryPlanTests(TestCase):
+    """The search, inventory and map queries are answered from indexes, not table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('plans', 27.7, 85.3)
+        for i in range(30):
+            medicine = Medicine.objects.create(name=f"Flexon {i}")
+            PharmacyMedicine.objects.create(pharmacy=cls.pharmacy, medicine=medicine, price=i, quantity=1)
+
+    def plans(self, url, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url, params or {}).status_code, 200)
+        plans = {}
+        with connection.cursor() as cursor:
+            for query in captured:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans[query['sql']] = [row[3] for row in cursor.fetchall()]
+        return plans
+
+    def assertNoScans(self, plans, *tables):
+        scan = re.compile(r'^SCAN (%s)\b' % '|'.join(tables))
+        for sql, plan in plans.items():
+            self.assertFalse([step for step in plan if scan.match(step)], f"{sql}\n{plan}")
+
+    def test_search(self):
+        for sort_by in ('price', 'distance'):
+            self.assertNoScans(
+                self.plans(reverse('search_api'), {'query': 'flex', 'sort_by': sort_by, 'lat': 27.7, 'lng': 85.3}),
+                'core_offer', 'core_pharmacy', 'core_pharmacymedicine',
+            )
+
+    def test_inventory_is_read_in_index_order(self):
+        self.client.force_login(self.pharmacy.owner)
+        plans = self.plans(reverse('inv'))
+        self.assertNoScans(plans, 'core_pharmacymedicine', 'core_medicine', 'core_pharmacy')
+        stock_plan = next(plan for sql, plan in plans.items() if 'FROM "core_pharmacymedicine"' in sql)
+        self.assertIn('stock_pharmacy_updated_idx', stock_plan[0])
+        self.assertFalse([step for step in stock_plan if 'TEMP B-TREE' in step])
+
+    def test_locations_use_partial_index(self):
+        plans = self.plans(reverse('pharmacy_locations_api'))
+        self.assertIn('pharmacy_located_idx', ' '.join(plans.popitem()[1]))
+
+    def test_nearest_with_stock_uses_location_index(self):
+        medicine = Medicine.objects.get(name='Flexon 3')
+        plans = self.plans(reverse('nearest_stock_api'), {'medicine': medicine.pk, 'lat': 27.7, 'lng': 85.3})
+        self.assertNoScans(plans, 'core_offer')
+        self.assertIn('offer_stock_location_idx', ' '.join(plans.popitem()[1]))
+
+    def test_medicine_name_lookup(self):
+        catalog.names.clear()
+        self.client.force_login(self.pharmacy.owner)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(reverse('add_medicine'), {'medicine_name': 'Flexon 3', 'price': 2, 'quantity': 1})
+        lookup = next(q['sql'] for q in captured if q['sql'].startswith('SELECT "core_medicine"'))
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + lookup)
+            self.assertIn('(normalized_name=?)', cursor.fetchone()[3])
+
+
+class AsyncViewTests(TestCase):
+    """The async views return exactly what their sync counterparts do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        medicine = Medicine.objects.create(name='Cetirizine')
+        for i in range(SEARCH_PAGE_SIZE + 3):
+            pharmacy = make_pharmacy(f"async{i}", 27.6 + i / 100, 85.3)
+            PharmacyMedicine.objects.create(pharmacy=pharmacy, medicine=medicine, price=i % 4, quantity=1)
+
+    async def compare(self, view_name, params):
+        sync_view, async_view = getattr(views, view_name), getattr(async_views, view_name)
+        expected = await sync_to_async(sync_view)(RequestFactory().get('/', params))
+        actual = await async_view(AsyncRequestFactory().get('/', params))
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(json.loads(actual.content), json.loads(expected.content))
+        return json.loads(actual.content)
+
+    async def test_search_api(self):
+        body = await self.compare('search_api', {'query': 'ceti', 'sort_by': 'price', 'count': 1})
+        self.assertEqual(body['count'], SEARCH_PAGE_SIZE + 3)
+        body = await self.compare('search_api', {'sort_by': 'price', 'cursor': body['next']})
+        self.assertEqual(len(body['results']), 3)
+        await self.compare('search_api', {'sort_by': 'distance', 'lat': 27.7, 'lng': 85.3})
+        await self.compare('search_api', {'sort_by': 'bogus'})
+
+    async def test_map_apis(self):
+        await self.compare('pharmacy_map_api', {'bbox': '80,26,89,31', 'zoom': 5})
+        await self.compare('pharmacy_map_api', {'bbox': 'x'})
+        await self.compare('pharmacy_locations_api', {})
+
+
+class StreamingExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('exporter', 27.7, 85.3)
+        make_pharmacy('nowhere')
+        for i in range(5):
+            medicine = Medicine.objects.create(name=f"Export {i}", generic_name='Paracetamol')
+            PharmacyMedicine.objects.create(
+                pharmacy=cls.pharmacy, medicine=medicine, price='2.50', quantity=i,
+                expiry_date=datetime.date(2030, 1, 1),
+            )
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_locations_export_as_json_array(self):
+        with self.settings(ASYNC_VIEWS=False):
+            response = self.client.get(reverse('pharmacy_locations_api'), {'export': 'json'})
+        self.assertEqual(
+            json.loads(self.body(response)),
+            [{'name': 'exporter Pharmacy', 'lat': 27.7, 'lng': 85.3, 'address': ''}],
+        )
+
+    def test_pharmacy_list_export_as_ndjson(self):
+        response = self.client.get(reverse('pharmacy_list_api'), {'export': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        names = [json.loads(line)['name'] for line in self.body(response).splitlines()]
+        self.assertEqual(names, ['exporter Pharmacy', 'nowhere Pharmacy'])
+
+    def test_unknown_export_format(self):
+        self.assertEqual(self.client.get(reverse('pharmacy_list_api'), {'export': 'xml'}).status_code, 400)
+
+    def test_inventory_export_round_trips_through_import(self):
+        self.client.force_login(self.pharmacy.owner)
+        body = self.body(self.client.get(reverse('export_inventory')))
+        self.assertEqual(len(body.splitlines()), 5)
+        PharmacyMedicine.objects.update(quantity=0, price=9)
+        report = import_inventory(self.pharmacy, read_rows(io.StringIO(body), 'jsonl'))
+        self.assertEqual((report.imported, report.errors), (5, []))
+        self.assertEqual(
+            sorted(PharmacyMedicine.objects.values_list('quantity', flat=True)), [0, 1, 2, 3, 4],
+        )
+
+    def test_export_is_written_in_chunks(self):
+        chunks = list(exports.stream(PharmacyMedicine.objects.order_by('pk'), {'q': 'quantity'}, 'json', chunk_size=2))
+        self.assertEqual(len(chunks), 5)  # "[", three batches, "]"
+        self.assertEqual(json.loads(b''.join(chunks)), [{'q': i} for i in range(5)])
+
+    async def test_async_export(self):
+        response = await async_views.pharmacy_locations_api(
+            AsyncRequestFactory().get('/', {'export': 'ndjson'})
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body)['name'], 'exporter Pharmacy')
+
+
+class SearchCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('cached', 27.7, 85.3)
+        cls.flexon = Medicine.objects.create(name='Flexon')
+        cls.zyrtec = Medicine.objects.create(name='Zyrtec')
+        cls.stock = PharmacyMedicine.objects.create(pharmacy=cls.pharmacy, medicine=cls.flexon, price=4, quantity=3)
+        PharmacyMedicine.objects.create(pharmacy=cls.pharmacy, medicine=cls.zyrtec, price=2, quantity=1)
+
+    def setUp(self):
+        cache.clear()
+        search_cache.popularity.flush()
+        PopularSearch.objects.all().delete()
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_api'), {'query': 'Flex', 'sort_by': 'price', **params})
+        return [(row['id'], row['price']) for row in response.json()['results']]
+
+    def test_repeated_search_is_served_from_cache(self):
+        first = self.search()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search(query='  flex '), first)
+
+    def test_nearby_users_share_a_page(self):
+        self.search(sort_by='distance', lat=27.70001, lng=85.30001)
+        with self.assertNumQueries(0):
+            self.search(sort_by='distance', lat=27.70002, lng=85.29999)
+
+    def test_stock_writes_invalidate_only_their_medicine(self):
+        self.search()
+        zyrtec_stock = PharmacyMedicine.objects.get(medicine=self.zyrtec)
+        zyrtec_stock.quantity = 5
+        zyrtec_stock.save()
+        with self.assertNumQueries(0):
+            self.search()
+        self.stock.price = 7
+        self.stock.save()
+        self.assertEqual(self.search(), [(self.stock.pk, '7.00')])
+
+    def test_moving_stock_invalidates_the_old_medicine(self):
+        self.search()
+        stock = PharmacyMedicine.objects.get(pk=self.stock.pk)
+        stock.medicine = self.zyrtec
+        stock.pharmacy = make_pharmacy('other', 27.7, 85.3)
+        stock.save()
+        self.assertEqual(self.search(), [])
+
+    def test_import_invalidates(self):
+        self.search()
+        import_inventory(self.pharmacy, [(2, {'name': 'Flexon', 'price': '9', 'quantity': '1'})])
+        self.assertEqual(self.search(), [(self.stock.pk, '9.00')])
+
+    def test_popular_searches_are_counted_and_warmed(self):
+        for _ in range(3):
+            self.search()
+        self.search(query='zyr')
+        search_cache.popularity.flush()
+        self.assertEqual(
+            list(PopularSearch.objects.order_by('-hits').values_list('params', 'hits')),
+            [('query=flex&sort_by=price', 3), ('query=zyr&sort_by=price', 1)],
+        )
+        cache.clear()
+        call_command('warm_search_cache', top=1, stdout=io.StringIO(), stderr=io.StringIO())
+        with self.assertNumQueries(0):
+            self.search()
+
+
+    def test_failed_count_flush_keeps_the_search_and_the_counts(self):
+        broken = search_cache.UPSERT_SQL.replace('core_popularsearch (', 'core_missingtable (', 1)
+        with mock.patch.object(search_cache, 'UPSERT_SQL', broken), \
+                mock.patch.object(search_cache.popularity, 'flush_every', 1), \
+                self.assertLogs('core.search_cache', 'WARNING'):
+            self.assertEqual(self.search(), [(self.stock.pk, '4.00')])
+        search_cache.popularity.flush()
+        self.assertEqual(list(PopularSearch.objects.values_list('params', 'hits')), [('query=flex&sort_by=price', 1)])
+
+
+class JobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('jobs', 27.7, 85.3)
+        today = now().date()
+        for i, expiry in enumerate([today - datetime.timedelta(days=1), today, today + datetime.timedelta(days=10), None]):
+            PharmacyMedicine.objects.create(
+                pharmacy=cls.pharmacy, medicine=Medicine.objects.create(name=f"Jobol {i}"),
+                price=1, quantity=5, expiry_date=expiry,
+            )
+        # As if the dates had passed since the rows were saved.
+        PharmacyMedicine.objects.update(in_stock=True)
+        Offer.objects.update(in_stock=True)
+
+    def test_save_sets_stock_flag(self):
+        stock = PharmacyMedicine.objects.get(medicine__name='Jobol 3')
+        stock.quantity = 0
+        stock.save(update_fields=['quantity'])
+        self.assertFalse(PharmacyMedicine.objects.get(pk=stock.pk).in_stock)
+
+    def test_expire_stock_updates_stock_and_offers_in_batches(self):
+        cache.clear()
+        self.client.get(reverse('search_api'), {'query': 'jobol'})
+        with mock.patch.object(jobs, 'EXPIRY_BATCH_SIZE', 1):
+            self.assertEqual(jobs.expire_stock(), 2)
+        self.assertEqual(jobs.expire_stock(), 0)
+        expected = ['Jobol 2', 'Jobol 3']
+        self.assertEqual(sorted(PharmacyMedicine.objects.filter(in_stock=True).values_list('medicine__name', flat=True)), expected)
+        self.assertEqual(sorted(Offer.objects.filter(in_stock=True).values_list('medicine_name', flat=True)), expected)
+        results = self.client.get(reverse('search_api'), {'query': 'jobol'}).json()['results']
+        self.assertEqual(sorted(row['medicine'] for row in results if row['in_stock']), expected)
+
+    def test_stock_summaries_feed_the_dashboard(self):
+        jobs.expire_stock()
+        self.assertEqual(jobs.stock_summaries(), 1)
+        summary = StockSummary.objects.get(pharmacy=self.pharmacy)
+        self.assertEqual(
+            (summary.items, summary.in_stock, summary.expired, summary.expiring_soon), (4, 2, 2, 1),
+        )
+        self.client.force_login(self.pharmacy.owner)
+        with self.assertNumQueries(3):  # session, user, summary
+            response = self.client.get(reverse('pharmacy_dashboard'))
+        self.assertEqual(response.context['summary'], summary)
+
+    def test_due_jobs_run_once_per_interval(self):
+        self.assertEqual(jobs.run_due(), {'expire_stock': 2, 'stock_summaries': 1})
+        self.assertEqual(jobs.run_due(), {})
+        ScheduledJob.objects.filter(name='stock_summaries').update(next_run_at=now())
+        self.assertEqual(jobs.run_due(), {'stock_summaries': 1})
+        job = ScheduledJob.objects.get(name='expire_stock')
+        self.assertEqual(job.last_error, '')
+        self.assertIsNotNone(job.last_finished_at)
+
+    def test_failures_are_recorded(self):
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch.object(jobs.JOBS['expire_stock'], 'func', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.jobs', 'ERROR'):
+            call_command('run_jobs', '--once', stdout=out, stderr=err)
+        self.assertIn('expire_stock failed: boom', err.getvalue())
+        self.assertIn('stock_summaries: 1', out.getvalue())
+        self.assertIn('RuntimeError: boom', ScheduledJob.objects.get(name='expire_stock').last_error)
+
+
+class CatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('catalog', 27.7, 85.3)
+
+    def setUp(self):
+        catalog.names.clear()
+
+    def test_normalize_name(self):
+        for name in ['Paracetamol 500mg', '  PARACETAMOL   500 MG ', 'paracetamol 500 mg']:
+            self.assertEqual(catalog.normalize_name(name), 'paracetamol 500mg')
+        self.assertEqual(catalog.normalize_name('Vitamin D3 1000 IU'), 'vitamin d3 1000iu')
+        self.assertEqual(catalog.normalize_name('Syrup 2.5 ML / 5 Ml'), 'syrup 2.5ml / 5ml')
+        self.assertEqual(catalog.normalize_name('B12 500 µg'), 'b12 500mcg')
+        self.assertEqual(catalog.normalize_name('Zinc 20 gmx'), 'zinc 20 gmx')
+
+    def test_names_are_unique_by_key(self):
+        Medicine.objects.create(name='Paracetamol 500mg')
+        with self.assertRaises(IntegrityError):
+            Medicine.objects.create(name='PARACETAMOL 500 mg')
+
+    def test_resolve_reuses_and_caches(self):
+        first = catalog.resolve('Paracetamol  500 MG', 'Paracetamol')
+        self.assertEqual(first.name, 'Paracetamol 500 MG')
+        with self.assertNumQueries(0):
+            again = catalog.resolve('paracetamol 500mg', 'Paracetamol')
+        self.assertEqual(again.pk, first.pk)
+        with self.assertNumQueries(2):  # the UPDATE and its Offer sync
+            catalog.resolve('paracetamol 500mg', 'Acetaminophen')
+        self.assertEqual(Medicine.objects.get().generic_name, 'Acetaminophen')
+
+    def test_saves_invalidate_cached_names(self):
+        medicine = catalog.resolve('Flexon')
+        medicine.name = 'Flexon Forte'
+        medicine.save()
+        self.assertNotEqual(catalog.resolve('Flexon').pk, medicine.pk)
+        self.assertEqual(catalog.resolve('flexon forte').pk, medicine.pk)
+
+    def test_add_medicine_restocks_differently_written_names(self):
+        self.client.force_login(self.pharmacy.owner)
+        for name, quantity in [('Cetirizine 10mg', 1), ('cetirizine 10 MG', 5)]:
+            self.client.post(reverse('add_medicine'), {'medicine_name': name, 'price': 2, 'quantity': quantity})
+        self.assertEqual(Medicine.objects.count(), 1)
+        self.assertEqual(list(PharmacyMedicine.objects.values_list('quantity', flat=True)), [5])
+
+    def test_import_merges_spellings_within_a_chunk(self):
+        rows = [
+            (2, {'name': 'Amoxicillin 250mg', 'price': '3', 'quantity': '1'}),
+            (3, {'name': 'AMOXICILLIN 250 mg', 'price': '4', 'quantity': '2', 'generic_name': 'Amoxicillin'}),
+        ]
+        report = import_inventory(self.pharmacy, rows)
+        self.assertEqual((report.imported, report.medicines_created), (1, 1))
+        stock = PharmacyMedicine.objects.select_related('medicine').get()
+        self.assertEqual((stock.quantity, stock.medicine.generic_name), (2, 'Amoxicillin'))
+
+    def test_merge_duplicates(self):
+        other = make_pharmacy('catalog2', 27.7, 85.3)
+        keeper = Medicine.objects.create(name='Ibuprofen')
+        duplicate = Medicine.objects.create(name='Ibuprofen 2', generic_name='Ibuprofen')
+        # As the table looked before the constraint.
+        Medicine.objects.filter(pk=duplicate.pk).update(name='IBUPROFEN ', normalized_name='old')
+        PharmacyMedicine.objects.create(pharmacy=self.pharmacy, medicine=keeper, price=1, quantity=1)
+        newer = PharmacyMedicine.objects.create(pharmacy=self.pharmacy, medicine=duplicate, price=2, quantity=2)
+        moved = PharmacyMedicine.objects.create(pharmacy=other, medicine=duplicate, price=3, quantity=3)
+
+        self.assertEqual(catalog.merge_duplicates(Medicine, PharmacyMedicine, Offer), 1)
+        keeper.refresh_from_db()
+        self.assertEqual((keeper.normalized_name, keeper.generic_name), ('ibuprofen', 'Ibuprofen'))
+        self.assertEqual(
+            sorted(PharmacyMedicine.objects.values_list('pk', 'medicine_id')),
+            [(newer.pk, keeper.pk), (moved.pk, keeper.pk)],
+        )
+        self.assertEqual(set(Offer.objects.values_list('medicine_id', flat=True)), {keeper.pk})
+
+
+class NearestStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.medicine = Medicine.objects.create(name='Cetamol')
+        cls.other = Medicine.objects.create(name='Flexon')
+        # Pharmacies about 1, 5, 20 and 300 km north of the origin.
+        cls.pharmacies = [
+            make_pharmacy(f'stock{i}', 27.7 + km / 111.2, 85.3) for i, km in enumerate([1, 5, 20, 300])
+        ]
+        for pharmacy, price, quantity in zip(cls.pharmacies, [90, 20, 10, 5], [5, 1, 5, 5]):
+            PharmacyMedicine.objects.create(pharmacy=pharmacy, medicine=cls.medicine, price=price, quantity=quantity)
+        PharmacyMedicine.objects.create(pharmacy=cls.pharmacies[0], medicine=cls.other, price=1, quantity=9)
+
+    def nearest(self, **params):
+        params = {'medicine': self.medicine.pk, 'lat': 27.7, 'lng': 85.3, **params}
+        response = self.client.get(reverse('nearest_stock_api'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['pharmacy_id'] for row in response.json()['results']]
+
+    def test_nearest_first(self):
+        self.assertEqual(self.nearest(k=2), [p.pk for p in self.pharmacies[:2]])
+        self.assertEqual(self.nearest(), [p.pk for p in self.pharmacies])
+
+    def test_quantity_stock_and_radius(self):
+        PharmacyMedicine.objects.filter(pharmacy=self.pharmacies[2]).update(in_stock=False)
+        Offer.objects.filter(pharmacy=self.pharmacies[2]).update(in_stock=False)
+        self.assertEqual(self.nearest(min_quantity=2), [self.pharmacies[0].pk, self.pharmacies[3].pk])
+        self.assertEqual(self.nearest(radius=10), [p.pk for p in self.pharmacies[:2]])
+
+    def test_price_weight(self):
+        # One unit of price is worth 1 km: 20 + 5 beats 90 + 1 and 10 + 20.
+        self.assertEqual(self.nearest(k=2, price_weight=1), [self.pharmacies[1].pk, self.pharmacies[2].pk])
+
+    def test_query_keeps_each_pharmacys_best_offer(self):
+        rows = self.client.get(reverse('nearest_stock_api'), {
+            'query': 'flexon', 'lat': 27.7, 'lng': 85.3,
+        }).json()['results']
+        self.assertEqual([(row['pharmacy_id'], row['medicine_name']) for row in rows], [(self.pharmacies[0].pk, 'Flexon')])
+
+    def test_search_grows_only_as_far_as_needed(self):
+        with self.assertNumQueries(2):  # the 2 km box, then the 8 km ring
+            availability.nearest_with_stock(Offer.objects.filter(medicine=self.medicine), 27.7, 85.3, k=2)
+
+    def test_bad_params(self):
+        for params in [
+            {}, {'lat': 27.7, 'lng': 85.3}, {'medicine': 1, 'lat': 95, 'lng': 85.3}, {'query': 'x', 'lat': 'a', 'lng': 1},
+            {'medicine': 2 ** 70, 'lat': 27.7, 'lng': 85.3}, {'medicine': 1, 'min_quantity': 2 ** 70, 'lat': 27.7, 'lng': 85.3},
+        ]:
+            self.assertEqual(self.client.get(reverse('nearest_stock_api'), params).status_code, 400)
+
+
+class BasketTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.near = make_pharmacy('basket1', 27.71, 85.3)
+        cls.far = make_pharmacy('basket2', 27.9, 85.3)
+        cls.unlocated = make_pharmacy('basket3')
+        stock = {
+            cls.near: [('Cetamol 500mg', 10), ('Flexon', 30)],
+            cls.far: [('Cetamol 500mg', 12), ('Flexon', 20), ('Amoxil 250mg', 5)],
+            cls.unlocated: [('Cetamol 500mg', 1), ('Flexon', 1)],
+        }
+        for pharmacy, items in stock.items():
+            for name, price in items:
+                PharmacyMedicine.objects.create(
+                    pharmacy=pharmacy, medicine=catalog.resolve(name), price=price, quantity=1,
+                )
+
+    def basket(self, items, **params):
+        response = self.client.get(reverse('basket_api'), {'item': items, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results']
+
+    def test_ranks_by_coverage_then_price(self):
+        results = self.basket(['cetamol 500 MG', 'Flexon', 'Amoxil 250mg'])
+        self.assertEqual([r['pharmacy_id'] for r in results], [self.far.pk, self.unlocated.pk, self.near.pk])
+        self.assertEqual((results[0]['covered'], results[0]['total_price']), (3, '37.00'))
+        self.assertEqual(results[1]['missing'], ['Amoxil 250mg'])
+        self.assertEqual(results[2]['prices'], {'cetamol 500 MG': '10.00', 'Flexon': '30.00'})
+
+    def test_distance_and_radius(self):
+        items = ['Cetamol 500mg', 'Flexon']
+        origin = {'lat': 27.7, 'lng': 85.3}
+        by_distance = self.basket(items, sort_by='distance', **origin)
+        self.assertEqual([r['pharmacy_id'] for r in by_distance], [self.near.pk, self.far.pk, self.unlocated.pk])
+        self.assertAlmostEqual(by_distance[0]['distance'], 1.11, places=2)
+        self.assertIsNone(by_distance[2]['distance'])
+        self.assertEqual([r['pharmacy_id'] for r in self.basket(items, radius=5, **origin)], [self.near.pk])
+
+    def test_fuzzy_and_unknown_items(self):
+        results = self.basket(['amox', 'Nothing Like It'])
+        self.assertEqual([(r['pharmacy_id'], r['missing']) for r in results], [(self.far.pk, ['Nothing Like It'])])
+        self.assertEqual(self.basket(['Nothing Like It']), [])
+
+    def test_one_grouped_query(self):
+        items = ['Cetamol 500mg', 'Flexon', 'Amoxil 250mg']
+        with CaptureQueriesContext(connection) as captured:
+            self.basket(items, lat=27.7, lng=85.3)
+        self.assertEqual(len(captured), 2)  # the catalog lookup and the grouped Offer query
+        self.assertIn('GROUP BY', captured[1]['sql'])
+
+    def test_bad_params(self):
+        too_many = [f'medicine {i}' for i in range(11)]
+        for params in [{}, {'item': ' '}, {'item': too_many}, {'item': 'x', 'lat': 27.7}]:
+            self.assertEqual(self.client.get(reverse('basket_api'), params).status_code, 400)
+
+
+class InventoryBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('batch', 27.7, 85.3)
+        cls.rows = [
+            PharmacyMedicine.objects.create(
+                pharmacy=cls.pharmacy, medicine=Medicine.objects.create(name=f"Batchol {i}"), price=10, quantity=1,
+            )
+            for i in range(3)
+        ]
+        cls.stranger = make_pharmacy('stranger')
+
+    def setUp(self):
+        self.client.force_login(self.pharmacy.owner)
+
+    def versions(self):
+        response = self.client.get(reverse('inventory_api'))
+        return {row['id']: row['updated_at'] for row in response.json()['results']}
+
+    def post(self, changes):
+        return self.client.post(reverse('inventory_api'), {'changes': changes}, content_type='application/json')
+
+    def test_applies_a_batch(self):
+        versions = self.versions()
+        first, second, third = (row.pk for row in self.rows)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.post([
+                {'id': first, 'updated_at': versions[first], 'quantity': 40, 'expiry_date': '2030-01-01'},
+                {'id': second, 'updated_at': versions[second], 'price': '10.00'},
+                {'id': third, 'updated_at': versions[third], 'delete': True},
+            ])
+        self.assertEqual(response.status_code, 200, response.content)
+        updates = [q['sql'] for q in captured if q['sql'].startswith('UPDATE "core_pharmacymedicine"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"price"', updates[0])
+
+        self.assertEqual(response.json()['deleted'], [third])
+        tokens = {row['id']: row['updated_at'] for row in response.json()['updated']}
+        self.assertNotEqual(tokens[first], versions[first])
+        self.assertEqual(tokens[second], versions[second])  # nothing changed
+        self.assertEqual(self.versions(), tokens)
+        offer = Offer.objects.get(pk=first)
+        self.assertEqual((offer.quantity, offer.expiry_date), (40, datetime.date(2030, 1, 1)))
+        self.assertFalse(PharmacyMedicine.objects.filter(pk=third).exists())
+        self.assertFalse(Offer.objects.filter(pk=third).exists())
+
+    def test_stale_versions_reject_the_whole_batch(self):
+        versions = self.versions()
+        first, second = self.rows[0].pk, self.rows[1].pk
+        self.rows[1].quantity = 7
+        self.rows[1].save()  # someone else edits in between
+        response = self.post([
+            {'id': first, 'updated_at': versions[first], 'quantity': 0},
+            {'id': second, 'updated_at': versions[second], 'quantity': 3},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([(row['id'], row['quantity']) for row in response.json()['conflicts']], [(second, 7)])
+        self.assertEqual(PharmacyMedicine.objects.get(pk=first).quantity, 1)
+
+    def test_in_stock_flag_follows_quantity(self):
+        row = self.rows[0]
+        self.post([{'id': row.pk, 'updated_at': self.versions()[row.pk], 'quantity': 0}])
+        self.assertFalse(PharmacyMedicine.objects.get(pk=row.pk).in_stock)
+        self.assertFalse(Offer.objects.get(pk=row.pk).in_stock)
+
+    def test_invalid_batches(self):
+        versions = self.versions()
+        row = self.rows[0].pk
+        foreign = PharmacyMedicine.objects.create(
+            pharmacy=self.stranger, medicine=self.rows[0].medicine, price=1, quantity=1,
+        )
+        for changes, index in [
+            ([{'id': row, 'updated_at': versions[row], 'price': 'abc'}], 0),
+            ([{'id': row, 'updated_at': versions[row], 'quantity': 10 ** 20}], 0),
+            ([{'id': row, 'updated_at': versions[row], 'price': 10 ** 20}], 0),
+            ([{'id': row, 'updated_at': versions[row], 'price': '1e400'}], 0),
+            ([{'id': row, 'updated_at': versions[row]}], 0),
+            ([{'id': row, 'price': 1}], 0),
+            ([{'id': row, 'updated_at': versions[row], 'price': 1}] * 2, 1),
+            ([{'id': foreign.pk, 'updated_at': foreign.updated_at.isoformat(), 'price': 5}], 0),
+        ]:
+            response = self.post(changes)
+            self.assertEqual(response.status_code, 400, changes)
+            self.assertEqual(response.json()['errors'][0]['index'], index)
+        self.assertEqual(self.client.post(reverse('inventory_api'), 'nope', content_type='application/json').status_code, 400)
+        self.assertEqual(PharmacyMedicine.objects.get(pk=foreign.pk).price, 1)
+
+
+class PharmacyContextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacy = make_pharmacy('context', 27.7, 85.3)
+        cls.owner = cls.pharmacy.owner
+        cls.shopper = User.objects.create(username='shopper', role='user', is_approved=True)
+        PharmacyMedicine.objects.create(
+            pharmacy=cls.pharmacy, medicine=Medicine.objects.create(name='Contexol'), price=1, quantity=1,
+        )
+
+    def test_user_and_pharmacy_load_in_one_query(self):
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(reverse('inv')).status_code, 200)
+        tables = [re.search(r'FROM "(\w+)"', q['sql']).group(1) for q in captured]
+        self.assertEqual(tables, ['django_session', 'core_user', 'core_pharmacymedicine'])
+        self.assertIn('JOIN "core_pharmacy"', captured[1]['sql'])
+
+    def test_owner_login_keeps_the_pharmacies_version(self):
+        before = datasets.version(datasets.PHARMACIES)
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.owner.set_password('Zq9!long-pass')
+            self.owner.save(update_fields=['password'])
+            self.client.post(reverse('login'), {'username': self.owner.username, 'password': 'Zq9!long-pass'})
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.owner.pk))
+        owner = User.objects.get(pk=self.owner.pk)
+        owner.email = 'owner@example.com'
+        owner.save()
+        self.assertEqual(datasets.version(datasets.PHARMACIES), before)
+        owner.is_approved = False
+        owner.save()
+        self.assertNotEqual(datasets.version(datasets.PHARMACIES), before)
+
+    def test_users_without_a_pharmacy(self):
+        self.client.force_login(self.shopper)
+        stock = PharmacyMedicine.objects.get()
+        self.assertEqual(self.client.get(reverse('edit_medicine', args=[stock.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('import_inventory')).status_code, 404)
+        self.assertEqual(list(self.client.get(reverse('inv')).context['medicines']), [])
+
+    def test_request_pharmacy_follows_login(self):
+        seen = []
+
+        def view(request):
+            seen.append(bool(request.pharmacy))
+            login(request, self.owner, backend='core.auth.PharmacyOwnerBackend')
+            seen.append(request.pharmacy == self.pharmacy)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        chain = SessionMiddleware(AuthenticationMiddleware(PharmacyMiddleware(view)))
+        chain(request)
+        self.assertEqual(seen, [False, True])
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class AuthFlowTests(TestCase):
+    password = 'Zq9!long-pass'
+
+    def count_hashes(self):
+        return mock.patch.object(
+            TunedPBKDF2PasswordHasher, 'encode', autospec=True, side_effect=TunedPBKDF2PasswordHasher.encode,
+        )
+
+    def user_writes(self, captured):
+        return [q['sql'] for q in captured if re.match(r'(INSERT INTO|UPDATE) "core_user"', q['sql'])]
+
+    def test_register_hashes_and_writes_once(self):
+        with self.count_hashes() as encode, CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('register'), {
+                'username': 'newbie', 'email': 'newbie@example.com', 'role': 'pharmacy',
+                'password1': self.password, 'password2': self.password,
+            })
+        self.assertRedirects(response, reverse('pharmacy_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual([sql.split(' ')[0] for sql in self.user_writes(captured)], ['INSERT'])
+        user = User.objects.select_related('pharmacy').get(username='newbie')
+        self.assertFalse(user.is_approved)
+        self.assertIsNotNone(user.last_login)
+        self.assertEqual(user.pharmacy.name, "newbie's Pharmacy")
+        self.assertEqual(self.client.session['_auth_user_id'], str(user.pk))
+
+    def test_login_hashes_and_writes_once(self):
+        user = User(username='returning', role='user', is_approved=True)
+        user.set_password(self.password)
+        user.save()
+        with self.count_hashes() as encode, CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('login'), {'username': 'returning', 'password': self.password})
+        self.assertRedirects(response, reverse('user_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(encode.call_count, 1)
+        writes = self.user_writes(captured)
+        self.assertEqual(len(writes), 1)
+        self.assertNotIn('"password"', writes[0])
+
+    def test_outdated_hash_is_upgraded_in_the_login_write(self):
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            user = User(username='old', role='user', is_approved=True)
+            user.set_password(self.password)
+            user.save()
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(reverse('login'), {'username': 'old', 'password': self.password})
+        writes = self.user_writes(captured)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"password"', writes[0])
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(user.check_password(self.password))
+
+    def test_iterations_never_drop_below_djangos_outside_tests(self):
+        with self.settings(PASSWORD_PBKDF2_ALLOW_FEWER_ITERATIONS=False):
+            self.assertEqual(TunedPBKDF2PasswordHasher().iterations, PBKDF2PasswordHasher.iterations)
+            with self.settings(PASSWORD_PBKDF2_ITERATIONS=PBKDF2PasswordHasher.iterations * 2):
+                self.assertEqual(TunedPBKDF2PasswordHasher().iterations, PBKDF2PasswordHasher.iterations * 2)
+        self.assertEqual(TunedPBKDF2PasswordHasher().iterations, 1000)
+
+    def test_wrong_password(self):
+        User.objects.create(username='someone', password=make_password(self.password))
+        for username in ('someone', 'nobody'):
+            with self.subTest(username), self.count_hashes() as encode:
+                response = self.client.post(reverse('login'), {'username': username, 'password': 'nope-nope'})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['form'].non_field_errors())
+                self.assertEqual(encode.call_count, 1)
+        self.assertIsNone(User.objects.get(username='someone').last_login)
+
+    def test_sessions_of_the_retired_backend_stay_signed_in(self):
+        user = User.objects.create(username='legacy', role='user', is_approved=True)
+        self.client.force_login(user)
+        session = self.client.session
+        session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+        session.save()
+        response = self.client.get(reverse('user_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'core.auth.PharmacyOwnerBackend')
@@ -0,0 +1,169 @@
+"""Indexed medicine name search.
+
+One entry point, `medicine_search()`, picks the backend for the active
+database:
+
+* SQLite: an FTS5 table with the trigram tokenizer over Medicine.name and
+  generic_name, kept in sync by triggers so bulk writes are indexed too.
+* PostgreSQL: pg_trgm GIN indexes on both columns.
+* Anything else: plain icontains lookups.
+
+Every backend matches substrings of the brand or generic name, so results
+are the same as the old `icontains` filter, only served from an index.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'core_medicine_fts'
+
+# Trigram FTS needs at least three characters to use the index.
+MIN_INDEXED_QUERY = 3
+
+SQLITE_INSTALL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, generic_name, content='core_medicine', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON core_medicine BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name)
+        VALUES (new.id, new.name, new.generic_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON core_medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name)
+        VALUES ('delete', old.id, old.name, old.generic_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON core_medicine BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, generic_name)
+        VALUES ('delete', old.id, old.name, old.generic_name);
+        INSERT INTO {FTS_TABLE}(rowid, name, generic_name)
+        VALUES (new.id, new.name, new.generic_name);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_INSTALL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Indexed on the same UPPER(...) expression Django emits for icontains.
+    "CREATE INDEX IF NOT EXISTS core_medicine_name_trgm ON core_medicine "
+    "USING gin ((UPPER(name::text)) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS core_medicine_generic_trgm ON core_medicine "
+    "USING gin ((UPPER(generic_name::text)) gin_trgm_ops)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS core_medicine_name_trgm",
+    "DROP INDEX IF EXISTS core_medicine_generic_trgm",
+]
+
+
+def _like_q(query):
+    return Q(name__icontains=query) | Q(generic_name__icontains=query)
+
+
+class LikeBackend:
+    def matching(self, query):
+        """Return an expression usable as `medicine__in=` for the matches."""
+        from .models import Medicine
+        return Medicine.objects.filter(_like_q(query)).values('pk')
+
+    def ranked(self, query, limit):
+        from .models import Medicine
+        return list(
+            Medicine.objects.filter(_like_q(query))
+            .order_by('name', 'pk')
+            .values_list('pk', flat=True)[:limit]
+        )
+
+    def install(self, cursor):
+        pass
+
+    def uninstall(self, cursor):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTSBackend(LikeBackend):
+    def _match(self, query):
+        # Quote the whole query as one FTS5 string so user input is never
+        # parsed as query syntax.
+        return '"%s"' % query.replace('"', '""')
+
+    def matching(self, query):
+        if len(query) < MIN_INDEXED_QUERY:
+            return super().matching(query)
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self._match(query)])
+
+    def ranked(self, query, limit):
+        if len(query) < MIN_INDEXED_QUERY:
+            return super().ranked(query, limit)
+        # bm25 weights: a brand name hit counts more than a generic name hit.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, 10.0, 5.0), rowid LIMIT %s",
+                [self._match(query), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def install(self, cursor):
+        for statement in SQLITE_INSTALL:
+            cursor.execute(statement)
+
+    def uninstall(self, cursor):
+        for statement in SQLITE_UNINSTALL:
+            cursor.execute(statement)
+
+    def rebuild(self):
+        # install() is idempotent: it restores missing triggers and then
+        # repopulates the index from core_medicine.
+        with connection.cursor() as cursor:
+            self.install(cursor)
+
+
+class PostgresTrigramBackend(LikeBackend):
+    def ranked(self, query, limit):
+        pattern = '%%%s%%' % connection.ops.prep_for_like_query(query)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM core_medicine "
+                "WHERE UPPER(name::text) LIKE UPPER(%s) OR UPPER(generic_name::text) LIKE UPPER(%s) "
+                "ORDER BY GREATEST(2 * similarity(name, %s), similarity(coalesce(generic_name, ''), %s)) DESC, id "
+                "LIMIT %s",
+                [pattern, pattern, query, query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def install(self, cursor):
+        for statement in POSTGRES_INSTALL:
+            cursor.execute(statement)
+
+    def uninstall(self, cursor):
+        for statement in POSTGRES_UNINSTALL:
+            cursor.execute(statement)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            self.install(cursor)
+            cursor.execute("REINDEX INDEX core_medicine_name_trgm")
+            cursor.execute("REINDEX INDEX core_medicine_generic_trgm")
+
+
+def backend_for(vendor):
+    if vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    if vendor == 'postgresql':
+        return PostgresTrigramBackend()
+    return LikeBackend()
+
+
+def medicine_search():
+    return backend_for(connection.vendor)
@@ -1,18 +1,31 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from .views import add_medicine
 
+# ASGI deployments serve search and the map APIs from async views.
+if settings.ASYNC_VIEWS:
+    from . import async_views as search_views
+else:
+    search_views = views
+
 urlpatterns = [
     path('', views.home_view, name='home'),
     path('register/', views.register_view, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
-    path('search/', views.search_view, name='search'),
+    path('search/', search_views.search_view, name='search'),
+    path('api/search/', search_views.search_api, name='search_api'),
+    path('api/basket/', views.basket_api, name='basket_api'),
+    path('api/medicines/suggest/', views.medicine_suggest_api, name='medicine_suggest_api'),
     path('dashboard/user/', views.user_dashboard_view, name='user_dashboard'),
     path('dashboard/pharmacy/', views.pharmacy_dashboard_view, name='pharmacy_dashboard'),
     path('dashboard/', views.dashboard_redirect, name='dashboard'),
     path('pharmacy/add-medicine/', views.add_medicine, name='add_medicine'),
     path('pharmacy/manage-inventory', views.inv, name='inv'),
+    path('pharmacy/import-inventory/', views.import_inventory, name='import_inventory'),
+    path('pharmacy/export-inventory/', views.export_inventory, name='export_inventory'),
+    path('pharmacy/api/inventory/', views.inventory_api, name='inventory_api'),
     path("edit/<int:pk>/", views.edit_medicine, name="edit_medicine"),
     path("delete/<int:pk>/", views.delete_medicine, name="delete_medicine"),
     path('about/', views.about_view, name='about'),
@@ -20,4 +33,8 @@ urlpatterns = [
      path('map/', views.map_view, name='map'),
     path('pharmacy/update-location/', views.update_pharmacy_location, name='update_pharmacy_location'),
     path('api/pharmacies/', views.PharmacyListAPI.as_view(), name='pharmacy_list_api'),
+    path('api/pharmacies/locations/', search_views.pharmacy_locations_api, name='pharmacy_locations_api'),
+    path('api/pharmacies/nearest-with-stock/', views.nearest_stock_api, name='nearest_stock_api'),
+    path('api/pharmacies/map/', search_views.pharmacy_map_api, name='pharmacy_map_api'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
@@ -1,21 +1,42 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.utils.timezone import now
+from django.views.decorators.http import condition, require_http_methods
 from datetime import datetime
+import io
+import json
+import math
+from urllib.parse import urlencode
 from rest_framework import generics
+from rest_framework.renderers import JSONRenderer
 from .models import Pharmacy
-from .serializers import PharmacySerializer
-import math
+from .serializers import PharmacySerializer, render_pharmacies
+from . import datasets, importers, inventory, metrics, search_cache
+from .exports import EXPORT_FORMATS, export_response
+from .auth import get_pharmacy, pharmacy_or_404
+from .availability import nearest_with_stock
+from .basket import rank_pharmacies
+from .clustering import cluster_index
+from .geo import nearest
+from .pagination import decode_cursor, keyset_page, split_page
+from .text_search import medicine_search
+from .suggest import normalize, suggest
 
 from .forms import (
     UserRegisterForm, UserLoginForm,
     PharmacyMedicineForm, MedicineForm,
-    SearchForm, PharmacyLocationForm
+    SearchForm, NearestStockForm, BasketForm, PharmacyLocationForm, InventoryImportForm
 )
-from .models import User, Pharmacy, PharmacyMedicine, Medicine
+from .models import User, Pharmacy, PharmacyMedicine, Medicine, Offer, StockSummary
 
 
 # =========================
@@ -25,26 +46,18 @@ def register_view(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
         if form.is_valid():
-            user = form.save()
-             # Set the password properly (hash it)
-            raw_password = form.cleaned_data.get('password1')  # or whatever your password field is
-            user.set_password(raw_password)  # <-- This hashes the password
-
-
-            # Set approval flag based on role
-            if user.role == 'pharmacy':
-                user.is_approved = False
-            else:
-                user.is_approved = True
-
-            user.save()
-            print(f"User saved with role: {user.role}, username: {user.username}")
-
-            # Create Pharmacy if user is pharmacy owner
-            if user.role == 'pharmacy':
-                pharmacy = Pharmacy.objects.create(owner=user, name=f"{user.username}'s Pharmacy", address='', phone='')
-                print(f"Created pharmacy: {pharmacy}")
+            # form.save() hashes the password; the user is then written once,
+            # with the approval flag and last_login already set.
+            user = form.save(commit=False)
+            # Pharmacy owners wait for an admin's approval.
+            user.is_approved = user.role != 'pharmacy'
+            user.last_login = now()
+            with transaction.atomic():
+                user.save()
+                if user.role == 'pharmacy':
+                    Pharmacy.objects.create(owner=user, name=f"{user.username}'s Pharmacy", address='', phone='')
 
+            user._login_recorded = True
             login(request, user)
             messages.success(request, f'Welcome {user.username}! Your account has been created.')
 
@@ -53,8 +66,6 @@ def register_view(request):
                 return redirect('pharmacy_dashboard')
             else:
                 return redirect('user_dashboard')
-        else:
-            print("Form is invalid:", form.errors)
     else:
         form = UserRegisterForm()
     return render(request, 'register.html', {'form': form})
@@ -67,18 +78,14 @@ def login_view(request):
     if request.method == 'POST':
         form = UserLoginForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(request, username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.success(request, f'Welcome back {user.username}!')
-                if user.role == 'pharmacy':
-                    return redirect('pharmacy_dashboard')
-                else:
-                    return redirect('user_dashboard')
+            # The form has already authenticated the user.
+            user = form.get_user()
+            login(request, user)
+            messages.success(request, f'Welcome back {user.username}!')
+            if user.role == 'pharmacy':
+                return redirect('pharmacy_dashboard')
             else:
-                messages.error(request, 'Invalid username or password.')
+                return redirect('user_dashboard')
     else:
         form = UserLoginForm()
     return render(request, 'login.html', {'form': form})
@@ -103,7 +110,10 @@ def user_dashboard_view(request):
 
 @login_required
 def pharmacy_dashboard_view(request):
-    return render(request, 'pharmacy_dashboard.html')
+    # Counts come precomputed from the stock_summaries job.
+    pharmacy = get_pharmacy(request)
+    summary = StockSummary.objects.filter(pharmacy=pharmacy).first() if pharmacy else None
+    return render(request, 'pharmacy_dashboard.html', {'summary': summary})
 
 
 @login_required
@@ -120,7 +130,7 @@ def update_pharmacy_location(request):
         messages.error(request, "Only pharmacy owners can update location.")
         return redirect('dashboard_redirect')
 
-    pharmacy = get_object_or_404(Pharmacy, owner=request.user)
+    pharmacy = pharmacy_or_404(request)
 
     if request.method == 'POST':
         form = PharmacyLocationForm(request.POST, instance=pharmacy)
@@ -137,68 +147,322 @@ def update_pharmacy_location(request):
 # =========================
 # MAP API
 # =========================
+# Payloads are keyed by dataset version, so they never need to expire on
+# their own; the timeout only bounds how long dead versions linger.
+PAYLOAD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _cached_json(key, build):
+    """Return an application/json response whose bytes are cached under `key`."""
+    body = cache.get(key)
+    if body is None:
+        body = build()
+        cache.set(key, body, PAYLOAD_CACHE_TIMEOUT)
+    return HttpResponse(body, content_type='application/json')
+
+
+# ?export=json|ndjson streams the full list instead of the cached payload.
+LOCATION_EXPORT_FIELDS = {'name': 'name', 'lat': 'latitude', 'lng': 'longitude', 'address': 'address'}
+
+
+def invalid_export(fmt):
+    """Return a 400 response if `fmt` is not an export format, else None."""
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'export must be one of: ' + ', '.join(EXPORT_FORMATS)}, status=400)
+    return None
+
+
+def located_pharmacies():
+    return Pharmacy.objects.filter(latitude__isnull=False, longitude__isnull=False)
+
+
+@condition(etag_func=datasets.etag(datasets.PHARMACIES))
 def pharmacy_locations_api(request):
-    pharmacies = Pharmacy.objects.exclude(latitude__isnull=True, longitude__isnull=True)
-    data = [
-        {
-            'name': p.name,
-            'lat': p.latitude,
-            'lng': p.longitude,
-            'address': p.address,
-        } for p in pharmacies
-    ]
-    return JsonResponse(data, safe=False)
+    export = request.GET.get('export')
+    if export:
+        return invalid_export(export) or export_response(
+            located_pharmacies().order_by('pk'), LOCATION_EXPORT_FIELDS, export,
+        )
+
+    def build():
+        pharmacies = located_pharmacies()
+        data = [
+            {
+                'name': p.name,
+                'lat': p.latitude,
+                'lng': p.longitude,
+                'address': p.address,
+            } for p in pharmacies
+        ]
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+    key = f'pharmacy-locations:{datasets.version(datasets.PHARMACIES)}'
+    return _cached_json(key, build)
 
 
 def map_view(request):
     return render(request, 'map.html')
 
+@method_decorator(condition(etag_func=datasets.etag(datasets.PHARMACIES)), name='get')
 class PharmacyListAPI(generics.ListAPIView):
     queryset = Pharmacy.objects.filter(owner__is_approved=True)
     serializer_class = PharmacySerializer
 
+    def list(self, request, *args, **kwargs):
+        export = request.query_params.get('export')
+        if export:
+            fields = {name: name for name in self.get_serializer_class().Meta.fields}
+            return invalid_export(export) or export_response(
+                self.filter_queryset(self.get_queryset()).order_by('pk'), fields, export,
+            )
+        # Only the plain JSON rendering is cached; the browsable API still
+        # goes through DRF as usual.
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        # ?serializer=fast|drf overrides settings.PHARMACY_LIST_SERIALIZER.
+        mode = request.query_params.get('serializer', settings.PHARMACY_LIST_SERIALIZER)
+        if mode not in ('fast', 'drf'):
+            return JsonResponse({'error': "serializer must be 'fast' or 'drf'."}, status=400)
+
+        def build():
+            queryset = self.filter_queryset(self.get_queryset())
+            if mode == 'fast':
+                return render_pharmacies(queryset)
+            return JSONRenderer().render(self.get_serializer(queryset, many=True).data)
+
+        key = f'pharmacy-list:{mode}:{datasets.version(datasets.PHARMACIES)}'
+        return _cached_json(key, build)
+
+
+# Leaflet reports longitudes past +-180 when a zoomed-out map shows the
+# world more than once; project() clamps them onto the one world.
+MAX_MAP_LONGITUDE = 720
+MAX_MAP_ZOOM = 30
+
+
+def parse_map_query(params):
+    """Return (west, south, east, north, zoom) from the query, or raise ValueError."""
+    try:
+        west, south, east, north = (float(v) for v in params['bbox'].split(','))
+        zoom = int(params['zoom'])
+    except KeyError as exc:
+        raise ValueError(f"{exc.args[0]} is required")
+    if not all(map(math.isfinite, (west, south, east, north))):
+        raise ValueError("bbox must be finite")
+    if max(abs(south), abs(north)) > 90 or max(abs(west), abs(east)) > MAX_MAP_LONGITUDE:
+        raise ValueError("bbox is out of range")
+    if not 0 <= zoom <= MAX_MAP_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_MAP_ZOOM}")
+    return west, south, east, north, zoom
+
+
+def pharmacy_map_api(request):
+    try:
+        west, south, east, north, zoom = parse_map_query(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'bbox=west,south,east,north and zoom are required.'}, status=400)
+
+    clusters, pharmacies = cluster_index().query(west, south, east, north, zoom)
+    return JsonResponse({'zoom': zoom, 'clusters': clusters, 'pharmacies': pharmacies})
+
 # =========================
 # SEARCH
 # =========================
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * \
-        math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
-    return 2 * R * math.asin(math.sqrt(a))
+SEARCH_PAGE_SIZE = 20
+# Decimal places kept of a searcher's coordinates, about 110 m.
+LOCATION_PRECISION = 3
+
+
+class SearchQuery:
+    """The search described by request.GET, parsed but not yet run.
+
+    `results` holds every matching Offer and page() fetches one page of
+    them. Pages are keyset based: by price or distance with pk as the
+    tiebreak, or by pk when no order is chosen. core.async_views runs the
+    same queries through the async ORM, and core.search_cache caches the
+    pages under `params`, the normalized search.
+    """
+
+    def __init__(self, request):
+        self.form = SearchForm(request.GET or None)
+        self.results = Offer.objects.all()
+        raw_cursor = request.GET.get('cursor')
+        self.cursor = decode_cursor(raw_cursor)
+        self.field = 'pk'
+        self.origin = None
+        self.after = None
+        self.params = None
+        if not self.form.is_valid():
+            return
+
+        query = normalize(self.form.cleaned_data.get('query') or '')
+        sort_by = self.form.cleaned_data.get('sort_by')
+        if query:
+            self.results = self.results.filter(medicine__in=medicine_search().matching(query))
+        if sort_by == 'price':
+            self.field = 'price'
+
+        lat = request.GET.get('lat')
+        lng = request.GET.get('lng')
+        if sort_by == 'distance' and lat and lng:
+            try:
+                lat, lng = float(lat), float(lng)
+                if not (math.isfinite(lat) and math.isfinite(lng)):
+                    raise ValueError(lat, lng)
+                # Rounded so nearby users share cached pages.
+                self.origin = (round(lat, LOCATION_PRECISION), round(lng, LOCATION_PRECISION))
+            except (TypeError, ValueError):
+                self.origin = None
+        self.cursor = decode_cursor(raw_cursor, 'distance' if self.origin else self.field)
+        if self.origin and self.cursor:
+            self.after = tuple(self.cursor)
+
+        self.params = {
+            'query': query,
+            'sort_by': sort_by or '',
+            'radius': self.form.cleaned_data.get('radius'),
+        }
+        if self.origin:
+            self.params['lat'], self.params['lng'] = self.origin
+
+    def querystring(self):
+        """The normalized search as a query string, cursor excluded."""
+        return urlencode({k: v for k, v in self.params.items() if v not in (None, '')})
+
+    def nearest_page(self):
+        """A distance-sorted page. Offers of pharmacies without a location
+        follow the located ones, by pk, unless a radius is given; their
+        cursors carry a null distance."""
+        size = SEARCH_PAGE_SIZE + 1
+        radius = self.form.cleaned_data.get('radius')
+        unlocated_after = self.after and self.after[0] is None
+        rows = [] if unlocated_after else nearest(
+            self.results, *self.origin, k=size, radius_km=radius, prefix='', after=self.after,
+        )
+        if len(rows) < size and radius is None:
+            unlocated = self.results.filter(grid_row__isnull=True).order_by('pk')
+            if unlocated_after:
+                unlocated = unlocated.filter(pk__gt=self.after[1])
+            for offer in unlocated[:size - len(rows)]:
+                offer.distance = None
+                rows.append(offer)
+        return split_page(rows, SEARCH_PAGE_SIZE, lambda offer: [offer.distance, offer.pk])
+
+    def page(self):
+        """Return (rows, next_cursor)."""
+        if self.origin:
+            return self.nearest_page()
+        return keyset_page(self.results, self.cursor, SEARCH_PAGE_SIZE, field=self.field)
+
+
+def next_page_query(request, next_cursor):
+    if not next_cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = next_cursor
+    return params.urlencode()
+
+
+def offer_json(offer):
+    return {
+        'id': offer.pk,
+        'medicine': offer.medicine_name,
+        'generic_name': offer.generic_name,
+        'pharmacy': offer.pharmacy_name,
+        'lat': offer.latitude,
+        'lng': offer.longitude,
+        'price': str(offer.price),
+        'quantity': offer.quantity,
+        'expiry_date': offer.expiry_date,
+        'in_stock': offer.in_stock,
+        'distance': getattr(offer, 'distance', None),
+    }
 
 
 def search_view(request):
-    form = SearchForm(request.GET or None)
-    results = PharmacyMedicine.objects.select_related('pharmacy', 'medicine').all()
+    search = SearchQuery(request)
+    results, next_cursor = search_cache.page(search)
+    return render(request, 'search.html', {
+        'form': search.form, 'results': results, 'next_query': next_page_query(request, next_cursor),
+    })
+
+
+def search_api(request):
+    """One page of offers as JSON. With ?count=1 the response also carries
+    `count`, the number of offers matching the query before any radius limit."""
+    search = SearchQuery(request)
+    if search.form.errors:
+        return JsonResponse({'errors': search.form.errors}, status=400)
+    results, next_cursor = search_cache.page(search)
+    data = {'results': [offer_json(offer) for offer in results], 'next': next_cursor}
+    if request.GET.get('count'):
+        data['count'] = search.results.count()
+    return JsonResponse(data)
+
+
+NEAREST_STOCK_LIMIT = 10
+
+
+def nearest_stock_api(request):
+    """The closest pharmacies with at least `min_quantity` of a medicine in stock.
+
+    The medicine is given by id (`medicine`) or by a search `query`. Set
+    `price_weight` to trade distance against price: each unit of price
+    counts as that many km.
+    """
+    form = NearestStockForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    data = form.cleaned_data
+    offers = Offer.objects.all()
+    if data['medicine']:
+        offers = offers.filter(medicine_id=data['medicine'])
+    else:
+        offers = offers.filter(medicine__in=medicine_search().matching(normalize(data['query'])))
+    results = nearest_with_stock(
+        offers, data['lat'], data['lng'],
+        k=data['k'] or NEAREST_STOCK_LIMIT,
+        min_quantity=data['min_quantity'] or 1,
+        radius_km=data['radius'],
+        price_weight=data['price_weight'] or 0.0,
+    )
+    return JsonResponse({'results': results})
 
-    if form.is_valid():
-        query = form.cleaned_data.get('query')
-        sort_by = form.cleaned_data.get('sort_by')
 
-        if query:
-            results = results.filter(Q(medicine__name__icontains=query))
+BASKET_LIMIT = 10
 
-        lat = request.GET.get('lat')
-        lng = request.GET.get('lng')
 
-        if sort_by == 'price':
-            results = results.order_by('price')
-        elif sort_by == 'distance' and lat and lng:
-            try:
-                user_lat, user_lng = float(lat), float(lng)
-                results = list(results)
-                for pm in results:
-                    if pm.pharmacy.latitude and pm.pharmacy.longitude:
-                        pm.distance = haversine(user_lat, user_lng, pm.pharmacy.latitude, pm.pharmacy.longitude)
-                    else:
-                        pm.distance = None
-                results.sort(key=lambda x: (x.distance is None, x.distance))
-            except ValueError:
-                pass
+def basket_api(request):
+    """Pharmacies ranked by how much of a basket (?item=...&item=...) they can fill.
+
+    More items covered ranks first, then the lower total price and the
+    shorter distance from lat/lng, or distance first with sort_by=distance.
+    """
+    form = BasketForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    data = form.cleaned_data
+    results = rank_pharmacies(
+        data['item'], data['lat'], data['lng'],
+        radius_km=data['radius'],
+        sort_by=data['sort_by'] or 'price',
+        k=data['k'] or BASKET_LIMIT,
+    )
+    return JsonResponse({'items': data['item'], 'results': results})
 
-    return render(request, 'search.html', {'form': form, 'results': results})
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+
+def medicine_suggest_api(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit', SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    return JsonResponse({'query': query, 'suggestions': suggest(query, limit)})
 
 
 # =========================
@@ -210,8 +474,12 @@ def add_medicine(request):
         form = PharmacyMedicineForm(request.POST)
         if form.is_valid():
             pharmacy_medicine = form.save(commit=False)
-            pharmacy = get_object_or_404(Pharmacy, owner=request.user)
+            pharmacy = pharmacy_or_404(request)
             pharmacy_medicine.pharmacy = pharmacy
+            # Adding a medicine that is already stocked restocks that row.
+            pharmacy_medicine.pk = PharmacyMedicine.objects.filter(
+                pharmacy=pharmacy, medicine=pharmacy_medicine.medicine,
+            ).values_list('pk', flat=True).first()
             pharmacy_medicine.save()
             messages.success(request, "Medicine added successfully!")
             return redirect('inv')
@@ -220,17 +488,62 @@ def add_medicine(request):
     return render(request, 'add_medicine.html', {'form': form})
 
 
+@login_required
+def import_inventory(request):
+    pharmacy = pharmacy_or_404(request)
+    report = None
+    if request.method == 'POST':
+        form = InventoryImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                report = importers.import_inventory(pharmacy, importers.read_rows(stream, form.format))
+            except importers.ImportAborted as exc:
+                report = exc.report
+                form.add_error('file', f"Could not read file: {exc}")
+            else:
+                messages.success(request, f"Imported {report.imported} medicines.")
+    else:
+        form = InventoryImportForm()
+    return render(request, 'import_inventory.html', {'form': form, 'report': report})
+
+
+INVENTORY_EXPORT_FIELDS = {
+    'medicine_name': 'medicine__name',
+    'generic_name': 'medicine__generic_name',
+    'price': 'price',
+    'quantity': 'quantity',
+    'expiry_date': 'expiry_date',
+    'updated_at': 'updated_at',
+}
+
+
+@login_required
+def export_inventory(request):
+    """Stream the pharmacy's stock in the same shape import_inventory reads."""
+    pharmacy = pharmacy_or_404(request)
+    export = request.GET.get('export', 'ndjson')
+    return invalid_export(export) or export_response(
+        PharmacyMedicine.objects.filter(pharmacy=pharmacy).order_by('pk'),
+        INVENTORY_EXPORT_FIELDS, export, filename=f'inventory-{pharmacy.pk}',
+    )
+
+
 @login_required
 def inv(request):
-    pharmacy = Pharmacy.objects.filter(owner=request.user).first()
-    medicines = PharmacyMedicine.objects.filter(pharmacy=pharmacy) if pharmacy else []
+    pharmacy = get_pharmacy(request)
+    medicines = (
+        PharmacyMedicine.objects.filter(pharmacy=pharmacy)
+        .select_related('medicine')
+        .order_by('-updated_at')
+        if pharmacy else []
+    )
     return render(request, 'inv.html', {'medicines': medicines})
 
 
 @login_required
 def edit_medicine(request, pk):
-    pharmacy = get_object_or_404(Pharmacy, owner=request.user)
-    med = get_object_or_404(PharmacyMedicine, pk=pk, pharmacy=pharmacy)
+    med = get_object_or_404(PharmacyMedicine, pk=pk, pharmacy=pharmacy_or_404(request))
 
     if request.method == "POST":
         form = PharmacyMedicineForm(request.POST, instance=med)
@@ -244,8 +557,7 @@ def edit_medicine(request, pk):
 
 @login_required
 def delete_medicine(request, pk):
-    pharmacy = get_object_or_404(Pharmacy, owner=request.user)
-    med = get_object_or_404(PharmacyMedicine, pk=pk, pharmacy=pharmacy)
+    med = get_object_or_404(PharmacyMedicine, pk=pk, pharmacy=pharmacy_or_404(request))
 
     if request.method == "POST":
         med.delete()
@@ -254,6 +566,27 @@ def delete_medicine(request, pk):
     return render(request, "delete_medicine.html", {"medicine": med})
 
 
+@login_required
+@require_http_methods(['GET', 'POST'])
+def inventory_api(request):
+    """GET lists the pharmacy's stock with version tokens; POST applies a
+    batch of changes in one transaction (see core.inventory)."""
+    if request.method == 'GET':
+        return JsonResponse({'results': inventory.stock_versions(request.user)})
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'errors': [{'index': None, 'message': 'body must be JSON'}]}, status=400)
+    try:
+        result = inventory.apply_batch(request.user, inventory.parse_batch(data))
+    except inventory.BatchError as exc:
+        errors = [{'index': index, 'message': message} for index, message in exc.errors]
+        return JsonResponse({'errors': errors}, status=400)
+    except inventory.Conflict as exc:
+        return JsonResponse({'conflicts': exc.rows}, status=409)
+    return JsonResponse(result)
+
+
 # =========================
 # STATIC PAGES
 # =========================
@@ -269,3 +602,11 @@ def contact_view(request):
     return render(request, "contact.html", {"year": datetime.now().year})
 
 
+
+
+# =========================
+# METRICS
+# =========================
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,29 @@
+"""Gunicorn config for serving medfinder over ASGI.
+
+    pip install gunicorn uvicorn-worker
+    ASYNC_VIEWS=1 gunicorn -c medfinder/gunicorn_asgi.py medfinder.asgi:application
+
+ASYNC_VIEWS=1 makes search and the map APIs run as async views; without
+it they are the sync views, run in a thread. Each worker is one event loop; WEB_CONCURRENCY sets how many.
+"""
+import multiprocessing
+import os
+import warnings
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'uvicorn_worker.UvicornWorker'
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+# Recycle workers now and then so per-process caches and memory stay bounded.
+max_requests = 10000
+max_requests_jitter = 1000
+
+if workers > 1 and os.environ.get('CACHE_BACKEND', 'locmem') == 'locmem':
+    # Dataset versions live in the cache (core/datasets.py), so each worker
+    # would only see its own writes.
+    warnings.warn(
+        f"CACHE_BACKEND=locmem is per process; with {workers} workers, set "
+        "CACHE_BACKEND=file or redis so they see each other's changes."
+    )
@@ -29,6 +29,10 @@ DEBUG = True
 ALLOWED_HOSTS = []
 
 AUTH_USER_MODEL = 'core.User'
+# Loads a user together with their pharmacy in one query (core.auth). It is
+# the only backend, so a failed login costs one password hash, not one per
+# backend; PharmacyMiddleware moves sessions signed in by ModelBackend over.
+AUTHENTICATION_BACKENDS = ['core.auth.PharmacyOwnerBackend']
 
 # Application definition
 
@@ -46,15 +50,34 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.RepeatedQueryGuardMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.PharmacyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view timing and SQL metrics, served to staff at /metrics/. Off
+# unless METRICS_ENABLED is set; METRICS_SAMPLE_RATE measures only a share
+# of requests so it can stay on in production.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))
+
+# N+1 guard: in development, log any request that runs one query shape
+# more than this many times. The test runner raises instead.
+REPEATED_QUERY_LIMIT = int(os.environ.get('REPEATED_QUERY_LIMIT', '10')) if DEBUG else None
+REPEATED_QUERY_ACTION = 'log'
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# How /api/pharmacies/ builds its JSON: 'fast' reads values_list() tuples
+# and encodes them with orjson (or the stdlib), 'drf' uses PharmacySerializer.
+PHARMACY_LIST_SERIALIZER = os.environ.get('PHARMACY_LIST_SERIALIZER', 'fast')
+
 ROOT_URLCONF = 'medfinder.urls'
 
 TEMPLATES = [
@@ -73,18 +96,146 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'medfinder.wsgi.application'
+ASGI_APPLICATION = 'medfinder.asgi.application'
+
+# Serve search and the map APIs from core.async_views. Off unless the
+# environment sets ASYNC_VIEWS=1; only worth it under an ASGI server.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE picks the profile: 'sqlite' (default) or 'postgres'.
+#
+# SQLite gets a busy timeout instead of immediate "database is locked"
+# errors, memory-mapped reads and a 64 MB page cache. Writers take the lock
+# at BEGIN (IMMEDIATE) so two transactions never deadlock upgrading a read
+# lock. SQLITE_TUNED=0 turns all of this off, for comparison.
+#
+# SQLITE_WAL=1 also switches the database to WAL mode, so searches keep
+# reading while an inventory write is in progress, with synchronous=NORMAL
+# (safe under WAL). Turn it on for a deployed database: WAL mode is stored
+# in the file itself and keeps -wal and -shm files next to it, which would
+# dirty the db.sqlite3 checked into this repository.
+#
+# Postgres keeps connections open for DATABASE_CONN_MAX_AGE seconds and
+# checks them before reuse, or uses psycopg's connection pool when
+# DATABASE_POOL is set (needs psycopg[pool]; persistent connections are
+# then left to the pool).
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgres':
+    DATABASE_POOL = os.environ.get('DATABASE_POOL', '').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'medfinder'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': not DATABASE_POOL,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DATABASE_POOL_MIN', '2')),
+                    'max_size': int(os.environ.get('DATABASE_POOL_MAX', '10')),
+                    'timeout': 10,
+                },
+            } if DATABASE_POOL else {},
+        }
+    }
+elif DATABASE_ENGINE == 'sqlite':
+    SQLITE_TUNED = os.environ.get('SQLITE_TUNED', '1').lower() in ('1', 'true', 'yes')
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': (
+                    ('PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;' if SQLITE_WAL else '')
+                    + 'PRAGMA mmap_size=268435456;'
+                    'PRAGMA cache_size=-64000;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+                # Seconds to wait on a locked database (SQLite's busy_timeout).
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            } if SQLITE_TUNED else {},
+        }
     }
+else:
+    raise ValueError(f"Unknown DATABASE_ENGINE {DATABASE_ENGINE!r}, use 'sqlite' or 'postgres'.")
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# CACHE_BACKEND picks where dataset versions, API payloads and search pages
+# live: 'locmem' (default, per process), 'file' (shared by every process on
+# the host, under CACHE_LOCATION) or 'redis' (shared by every host; any
+# Redis-compatible server such as Valkey, at CACHE_URL; needs redis-py).
+# Only the shared backends let one worker see another's invalidations, and
+# let warm_search_cache fill the cache the workers read: locmem is for a
+# single process (runserver, tests), and medfinder/gunicorn_asgi.py warns
+# when it is combined with more than one worker.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'medfinder',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', BASE_DIR / '.cache'),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+elif CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_URL', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+else:
+    raise ValueError(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}, use 'locmem', 'file' or 'redis'.")
+
+# Search result pages are cached for this many seconds; 0 turns it off.
+SEARCH_CACHE_TIMEOUT = int(os.environ.get('SEARCH_CACHE_TIMEOUT', '600'))
+
+
+# Password hashing
+# PASSWORD_HASHER_PROFILE picks the hasher new passwords get: pbkdf2 (the
+# default; PASSWORD_PBKDF2_ITERATIONS rounds, Django's count when unset and
+# never fewer), scrypt, or argon2 (needs the argon2-cffi package). The other
+# hashers stay listed so existing passwords still verify; each is re-hashed
+# with the chosen profile at the user's next login.
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', '0')) or None
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'core.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
 }
-
+if PASSWORD_HASHER_PROFILE not in PASSWORD_HASHER_PROFILES:
+    raise ValueError(
+        f"Unknown PASSWORD_HASHER_PROFILE {PASSWORD_HASHER_PROFILE!r}, use 'pbkdf2', 'scrypt' or 'argon2'."
+    )
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile != PASSWORD_HASHER_PROFILE
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators